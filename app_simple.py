@@ -1,17 +1,55 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt, get_jwt_identity, \
+    verify_jwt_in_request
 from flask_cors import CORS
 from flask_marshmallow import Marshmallow
 from marshmallow import Schema, fields, validate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+import io
+import json
+import math
 import os
 from dotenv import load_dotenv
 import re
 from collections import Counter
 import hashlib
-from sqlalchemy import or_, and_
+import hmac
+import ipaddress
+from sqlalchemy import event, or_, and_, case, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+import multiprocessing
+from search_index import SearchIndex
+from pagination import InvalidCursor, clamp_page_size, keyset_page, ranked_page, approximate_count
+from pubsub import create_hub, format_sse
+from response_cache import ResponseCache
+from serializers import CompiledSerializer, dumps, fast_jsonify
+from password_hashing import PasswordHasher, HasherBusy
+from ledger import Ledger, LedgerError, InsufficientFunds
+from recommendations import RecommendationBuilder
+from trending import TrendingAggregator
+from db_routing import WAIT_BUCKETS, PoolMetrics, ReplicaRouter, engine_options, in_memory_sqlite
+from profiling import RequestProfiler, format_histogram, format_metric
+from auth import IdentityCache, RevocationList
+from jobs import JobQueue
+from migrations import SUPERSEDED_INDEXES, Migrator, app_migrations, chat_counter_updates, column_drift, \
+    database_columns, database_indexes, dialect_index, index_drift, model_columns, model_indexes, sql_file_columns, \
+    sql_file_indexes
+from index_advisor import IndexAdvisor
+from rate_limit import RateLimiter, create_store as create_rate_limit_store
+from compression import ResponseCompressor, conditional, matching_etag
+from bulk_io import FORMATS, BulkImporter, detect_format, export_lines, iter_keyset, read_rows, \
+    validate_skill_row, validate_user_row
+from geo import InvalidLocation, bounding_box, covering_prefixes, encode as geohash_encode, haversine_km_many, \
+    parse_coordinates, parse_near, prefix_range
+from decimal import Decimal
 
 load_dotenv()
 
@@ -21,11 +59,126 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'mysql+pymysql
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+app.config['SEARCH_MAX_CANDIDATES'] = int(os.getenv('SEARCH_MAX_CANDIDATES', '1000'))
+app.config['SEARCH_DEFAULT_LIMIT'] = int(os.getenv('SEARCH_DEFAULT_LIMIT', '50'))
+app.config['SEARCH_INDEX_REFRESH_SECONDS'] = float(os.getenv('SEARCH_INDEX_REFRESH_SECONDS', '2'))
+# Each refresh re-reads listings stamped this long before the newest one seen, for writes that commit late
+app.config['SEARCH_INDEX_SYNC_WINDOW_SECONDS'] = float(os.getenv('SEARCH_INDEX_SYNC_WINDOW_SECONDS', '60'))
+app.config['DEFAULT_PAGE_SIZE'] = int(os.getenv('DEFAULT_PAGE_SIZE', '10'))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', '100'))
+app.config['TOTAL_COUNT_CAP'] = int(os.getenv('TOTAL_COUNT_CAP', '10000'))
+app.config['PUBSUB_URL'] = os.getenv('PUBSUB_URL', 'memory://')
+app.config['STREAM_HEARTBEAT_SECONDS'] = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+app.config['MESSAGE_PAGE_SIZE'] = int(os.getenv('MESSAGE_PAGE_SIZE', '50'))
+app.config['MAX_MESSAGE_PAGE_SIZE'] = int(os.getenv('MAX_MESSAGE_PAGE_SIZE', '200'))
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', '2048'))
+app.config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL')
+app.config['PASSWORD_HASH_SCHEME'] = os.getenv('PASSWORD_HASH_SCHEME', 'bcrypt')
+app.config['BCRYPT_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS', '12'))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS')) if os.getenv('PASSWORD_HASH_WORKERS') else None
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.getenv('PASSWORD_HASH_MAX_PENDING')) if os.getenv('PASSWORD_HASH_MAX_PENDING') else None
+app.config['RECOMMENDATION_NEIGHBORS'] = int(os.getenv('RECOMMENDATION_NEIGHBORS', '20'))
+app.config['RECOMMENDATIONS_PER_USER'] = int(os.getenv('RECOMMENDATIONS_PER_USER', '50'))
+app.config['RECOMMENDATION_VECTOR_DIM'] = int(os.getenv('RECOMMENDATION_VECTOR_DIM', '256'))
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(os.getenv('TRENDING_HALF_LIFE_HOURS', '24'))
+app.config['TRENDING_SNAPSHOT_SECONDS'] = float(os.getenv('TRENDING_SNAPSHOT_SECONDS', '10'))
+app.config['GEO_DEFAULT_RADIUS_KM'] = float(os.getenv('GEO_DEFAULT_RADIUS_KM', '10'))
+app.config['GEO_MAX_RADIUS_KM'] = float(os.getenv('GEO_MAX_RADIUS_KM', '200'))
+app.config['BULK_IMPORT_CHUNK_SIZE'] = int(os.getenv('BULK_IMPORT_CHUNK_SIZE', '1000'))
+_pool_settings = {
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+    'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    'pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], **_pool_settings)
+# Comma-separated replica URLs; read-only views are routed to them
+app.config['DATABASE_REPLICA_URLS'] = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',')
+                                       if url.strip()]
+app.config['SQLALCHEMY_BINDS'] = {f'replica{i}': {'url': url, **engine_options(url, **_pool_settings)}
+                                  for i, url in enumerate(app.config['DATABASE_REPLICA_URLS'])}
+app.config['DB_READ_YOUR_WRITES_SECONDS'] = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '5'))
+# ASGI mode (asgi.py): async engine for chat/search, threads for the Flask routes
+app.config['ASYNC_DATABASE_URL'] = os.getenv('ASYNC_DATABASE_URL')
+app.config['ASGI_WSGI_THREADS'] = int(os.getenv('ASGI_WSGI_THREADS', '10'))
+app.config['SERVER_TIMING_ENABLED'] = os.getenv('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv('N_PLUS_ONE_THRESHOLD', '10'))
+# /metrics answers scrapers sending "Authorization: Bearer <METRICS_TOKEN>" or connecting from these addresses/networks
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+app.config['METRICS_ALLOWED_IPS'] = [ipaddress.ip_network(net.strip(), strict=False)
+                                     for net in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+                                     if net.strip()]
+app.config['IDENTITY_CACHE_TTL_SECONDS'] = float(os.getenv('IDENTITY_CACHE_TTL_SECONDS', '60'))
+app.config['IDENTITY_CACHE_SIZE'] = int(os.getenv('IDENTITY_CACHE_SIZE', '10000'))
+app.config['REVOCATION_REFRESH_SECONDS'] = float(os.getenv('REVOCATION_REFRESH_SECONDS', '5'))
+app.config['REVOCATION_FILTER_CAPACITY'] = int(os.getenv('REVOCATION_FILTER_CAPACITY', '100000'))
+# Background jobs: threads per web worker (0 = leave them to `flask run-jobs`)
+app.config['JOB_WORKER_THREADS'] = int(os.getenv('JOB_WORKER_THREADS', '1'))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+app.config['JOB_BACKOFF_SECONDS'] = float(os.getenv('JOB_BACKOFF_SECONDS', '2'))
+app.config['JOB_BACKOFF_MAX_SECONDS'] = float(os.getenv('JOB_BACKOFF_MAX_SECONDS', '300'))
+app.config['JOB_LEASE_SECONDS'] = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+app.config['JOB_POLL_SECONDS'] = float(os.getenv('JOB_POLL_SECONDS', '1'))
+# In-memory SQLite has a single connection that worker threads cannot share; run jobs at the end of each request
+app.config['JOBS_EAGER'] = os.getenv('JOBS_EAGER', str(in_memory_sqlite(app.config['SQLALCHEMY_DATABASE_URI']))) \
+    .lower() == 'true'
+# Token buckets per route; "<count>/<period>" allows bursts of <count>, empty disables that limit
+app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+app.config['RATE_LIMIT_STORAGE_URL'] = os.getenv('RATE_LIMIT_STORAGE_URL', 'memory://')
+app.config['RATE_LIMIT_LOGIN'] = os.getenv('RATE_LIMIT_LOGIN', '20/minute')  # per IP
+app.config['RATE_LIMIT_REGISTER'] = os.getenv('RATE_LIMIT_REGISTER', '10/minute')  # per IP
+app.config['RATE_LIMIT_SEARCH'] = os.getenv('RATE_LIMIT_SEARCH', '60/minute')  # per user, per IP when anonymous
+app.config['RATE_LIMIT_SEND_MESSAGE'] = os.getenv('RATE_LIMIT_SEND_MESSAGE', '30/minute')  # per user
+# Reverse proxies in front of the app; their X-Forwarded-For gives the client IP that rate limits key on
+app.config['TRUSTED_PROXY_COUNT'] = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+# JSON bodies of at least COMPRESSION_MIN_SIZE bytes are sent gzip- (or brotli-) encoded to clients that accept it
+app.config['COMPRESSION_ENABLED'] = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+app.config['COMPRESSION_MIN_SIZE'] = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+app.config['COMPRESSION_GZIP_LEVEL'] = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+app.config['COMPRESSION_BROTLI_QUALITY'] = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+# How long browsers and CDNs may reuse a listing page without revalidating it (0 = revalidate every time)
+app.config['CATALOG_MAX_AGE_SECONDS'] = int(os.getenv('CATALOG_MAX_AGE_SECONDS', '0'))
 
-db = SQLAlchemy(app)
+def _request_user():
+    verify_jwt_in_request(optional=True)
+    return get_jwt_identity()
+
+db_router = ReplicaRouter(app.config['SQLALCHEMY_BINDS'], sticky_seconds=app.config['DB_READ_YOUR_WRITES_SECONDS'],
+                          identity=_request_user)
+db = SQLAlchemy(app, session_options={'class_': db_router.session_class()})
 jwt = JWTManager(app)
 ma = Marshmallow(app)
 CORS(app)
+event_hub = create_hub(app.config['PUBSUB_URL'])
+response_cache = ResponseCache(maxsize=app.config['RESPONSE_CACHE_SIZE'],
+                               shared_url=app.config['RESPONSE_CACHE_URL'],
+                               enabled=app.config['RESPONSE_CACHE_ENABLED'])
+password_hasher = PasswordHasher(scheme=app.config['PASSWORD_HASH_SCHEME'],
+                                 bcrypt_rounds=app.config['BCRYPT_ROUNDS'],
+                                 workers=app.config['PASSWORD_HASH_WORKERS'],
+                                 max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
+db_router.shared = response_cache.shared
+pool_metrics = PoolMetrics()
+rate_limiter = RateLimiter(create_rate_limit_store(app.config['RATE_LIMIT_STORAGE_URL']),
+                           enabled=app.config['RATE_LIMIT_ENABLED'], identity=_request_user)
+for _limit in ('login', 'register', 'search', 'send_message'):
+    rate_limiter.configure(_limit, app.config[f'RATE_LIMIT_{_limit.upper()}'])
+profiler = RequestProfiler(app, n_plus_one_threshold=app.config['N_PLUS_ONE_THRESHOLD'],
+                           server_timing=app.config['SERVER_TIMING_ENABLED'])
+# Registered after the profiler, so it runs first and response sizes are what goes over the wire
+compressor = ResponseCompressor(min_size=app.config['COMPRESSION_MIN_SIZE'],
+                                gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+                                brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+                                enabled=app.config['COMPRESSION_ENABLED'])
+compressor.init_app(app)
+with app.app_context():
+    for _bind_key, _engine in db.engines.items():
+        pool_metrics.instrument(_bind_key or 'primary', _engine)
+        profiler.instrument_engine(_engine)
 
 # Models
 class User(db.Model):
@@ -51,11 +204,15 @@ class User(db.Model):
     transactions_received = db.relationship('Transaction', foreign_keys='Transaction.to_user_id', backref='receiver', lazy=True)
 
     def set_password(self, password):
-        # Simple SHA256 hashing for Windows compatibility
-        self.password_hash = hashlib.sha256(password.encode()).hexdigest()
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return self.password_hash == hashlib.sha256(password.encode()).hexdigest()
+        matches, needs_rehash = password_hasher.verify(password, self.password_hash)
+        if matches and needs_rehash:
+            # Upgrades legacy SHA-256 hashes (and old cost settings) on login
+            self.password_hash = password_hasher.hash(password)
+            password_hasher.record_rehash()
+        return matches
 
 class SkillListing(db.Model):
     __tablename__ = 'skill_listings'
@@ -65,6 +222,9 @@ class SkillListing(db.Model):
     description = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(100), nullable=False)
     location = db.Column(db.String(200))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))  # derived from latitude/longitude, see geo.encode
     time_credits = db.Column(db.Integer, default=0)
     monetary_price = db.Column(db.Float, default=0.0)
     availability = db.Column(db.String(50), default='available')
@@ -79,32 +239,58 @@ class SkillListing(db.Model):
     reviews = db.relationship('Review', backref='skill', lazy=True)
     chat_sessions = db.relationship('Chat', backref='skill', lazy=True)
 
+    __table_args__ = (
+        # Feeds filter on is_active (and category/provider) and page newest first by (created_at, id).
+        # Nearly every listing is active, so the unfiltered feed walks (created_at, id) and checks is_active
+        # from the index; leading with is_active made SQLite prefer it to the geohash range and primary key.
+        db.Index('idx_skill_listings_feed', 'created_at', 'id', 'is_active'),
+        db.Index('idx_skill_listings_category_feed', 'category', 'is_active', 'created_at', 'id'),
+        db.Index('idx_skill_listings_provider_feed', 'provider_id', 'is_active', 'created_at'),
+        db.Index('idx_skills_location', 'location'),
+        # MAX(updated_at) for catalog ETags
+        db.Index('idx_skill_listings_updated_at', 'updated_at'),
+        # Radius queries range-scan geohash prefixes and read coordinates from the index
+        db.Index('idx_skill_listings_geo', 'geohash', 'latitude', 'longitude'),
+        dialect_index('ft_skill_listings_text', 'title', 'description', mysql_prefix='FULLTEXT'),
+    )
+
 class Wallet(db.Model):
     __tablename__ = 'wallets'
     
     id = db.Column(db.Integer, primary_key=True)
-    balance = db.Column(db.Float, default=0.0)
-    time_credits = db.Column(db.Integer, default=0)
+    # Exact decimals: balances only change through the ledger's guarded relative UPDATEs
+    balance = db.Column(db.Numeric(10, 2), default=Decimal('0.00'), nullable=False)
+    time_credits = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
 
 class Transaction(db.Model):
     __tablename__ = 'transactions'
     
     id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, default=0.0)
+    amount = db.Column(db.Numeric(10, 2), default=Decimal('0.00'))
     time_credits = db.Column(db.Integer, default=0)
     status = db.Column(db.String(20), default='pending')  # pending, completed, failed, cancelled
     transaction_type = db.Column(db.String(20), default='skill_exchange')  # skill_exchange, recharge, withdrawal
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
     
+    idempotency_key = db.Column(db.String(64))
+    
     from_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     to_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     skill_id = db.Column(db.Integer, db.ForeignKey('skill_listings.id'))
 
+    __table_args__ = (
+        db.UniqueConstraint('from_user_id', 'idempotency_key', name='uq_transactions_idempotency'),
+        # History pages are (from_user_id = ? OR to_user_id = ?) ORDER BY created_at DESC, id DESC
+        db.Index('idx_transactions_from_user_feed', 'from_user_id', 'created_at', 'id'),
+        db.Index('idx_transactions_to_user_feed', 'to_user_id', 'created_at', 'id'),
+        db.Index('idx_transactions_status', 'status'),
+    )
+
 class Review(db.Model):
     __tablename__ = 'reviews'
     
@@ -117,6 +303,15 @@ class Review(db.Model):
     reviewed_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     skill_id = db.Column(db.Integer, db.ForeignKey('skill_listings.id'))
     transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'))
+    # Set once the rating is in user_stats, by its review_stats job or rebuild-user-stats
+    stats_applied = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_reviews_reviewer', 'reviewer_id'),
+        db.Index('idx_reviews_reviewed_feed', 'reviewed_id', 'created_at', 'id'),
+        # One review per reviewer and reviewed user
+        db.Index('uq_reviews_reviewer_reviewed', 'reviewer_id', 'reviewed_id', unique=True),
+    )
 
 class Chat(db.Model):
     __tablename__ = 'chats'
@@ -128,9 +323,20 @@ class Chat(db.Model):
     user1_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     user2_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     skill_id = db.Column(db.Integer, db.ForeignKey('skill_listings.id'))
+    # Maintained by each send in the same transaction, so the inbox and unread badges never
+    # scan messages (`flask rebuild-chat-counters` recomputes them). No FK: messages points here.
+    last_message_id = db.Column(db.Integer)
+    user1_received = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    user2_received = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     
     messages = db.relationship('Message', backref='chat', lazy=True)
 
+    __table_args__ = (
+        # create_chat's dedup lookup; also the user1_id half of the inbox OR
+        db.Index('idx_chats_pair_skill', 'user1_id', 'user2_id', 'skill_id'),
+        db.Index('idx_chats_user2_active', 'user2_id', 'is_active'),
+    )
+
 class Message(db.Model):
     __tablename__ = 'messages'
     
@@ -144,6 +350,110 @@ class Message(db.Model):
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+    __table_args__ = (
+        db.Index('idx_messages_chat_id_id', 'chat_id', 'id'),
+        # MAX(edited_at) per chat for message ETags
+        db.Index('idx_messages_chat_edited', 'chat_id', 'edited_at'),
+        db.Index('idx_messages_sender', 'sender_id'),
+    )
+
+class ChatReadCursor(db.Model):
+    __tablename__ = 'chat_read_cursors'
+
+    chat_id = db.Column(db.Integer, db.ForeignKey('chats.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, default=0, nullable=False)
+    # Messages the user had received up to last_read_message_id; unread = received counter - read_count
+    read_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class RevokedToken(db.Model):
+    """Revoked access tokens; a row without a jti revokes every token the user was issued before revoked_at."""
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    revoked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_revoked_tokens_user', 'user_id'),
+        db.Index('idx_revoked_tokens_expires', 'expires_at'),
+    )
+
+class UserStats(db.Model):
+    """Denormalized reputation counters, kept current by the writes that change them."""
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    review_count = db.Column(db.Integer, default=0, nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, nullable=False)
+    completed_exchanges = db.Column(db.Integer, default=0, nullable=False)
+    credits_earned = db.Column(db.Integer, default=0, nullable=False)
+    money_earned = db.Column(db.Numeric(12, 2), default=Decimal('0.00'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Listings embed reputations, so catalog ETags also include MAX(updated_at) here
+        db.Index('idx_user_stats_updated_at', 'updated_at'),
+    )
+
+class TrendingCounter(db.Model):
+    """Time-decayed activity score per category/location; score is as of updated_at."""
+    __tablename__ = 'trending_counters'
+
+    dimension = db.Column(db.String(20), primary_key=True)  # category, location
+    name = db.Column(db.String(200), primary_key=True)  # as long as skill_listings.location
+    score = db.Column(db.Float, default=0.0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class SkillNeighbor(db.Model):
+    """Precomputed top-k similar listings, written by `flask rebuild-recommendations`."""
+    __tablename__ = 'skill_neighbors'
+
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill_listings.id'), primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('skill_listings.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+class UserRecommendation(db.Model):
+    """Precomputed top-k suggested listings per user, written by `flask rebuild-recommendations`."""
+    __tablename__ = 'user_recommendations'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    skill_id = db.Column(db.Integer, db.ForeignKey('skill_listings.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+class Job(db.Model):
+    """Queued side effects of committed writes; run by `JobQueue` workers and deleted once done."""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, running, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    # When a pending job is due; for a running job, when its lease runs out
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_by = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+ledger = Ledger(db, Wallet, Transaction)
+trending = TrendingAggregator(db, TrendingCounter, ('category', 'location'),
+                              half_life=app.config['TRENDING_HALF_LIFE_HOURS'] * 3600,
+                              snapshot_seconds=app.config['TRENDING_SNAPSHOT_SECONDS'])
+jobs = JobQueue(db, Job, max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+                backoff_seconds=app.config['JOB_BACKOFF_SECONDS'],
+                backoff_max_seconds=app.config['JOB_BACKOFF_MAX_SECONDS'],
+                lease_seconds=app.config['JOB_LEASE_SECONDS'], poll_seconds=app.config['JOB_POLL_SECONDS'],
+                eager=app.config['JOBS_EAGER'])
+jobs.init_app(app, workers=app.config['JOB_WORKER_THREADS'])
+
 # Schemas
 class UserSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
@@ -174,6 +484,7 @@ class ReviewSchema(ma.SQLAlchemyAutoSchema):
         model = Review
         include_fk = True
         load_instance = True
+        exclude = ('stats_applied',)
 
 class ChatSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
@@ -202,12 +513,310 @@ chats_schema = ChatSchema(many=True)
 message_schema = MessageSchema()
 messages_schema = MessageSchema(many=True)
 
+# Compiled serializers for hot read paths; output matches the schemas above
+skill_serializer = CompiledSerializer(SkillListing)
+user_serializer = CompiledSerializer(User, exclude=('password_hash',))
+
+# ------------------------------
+# Auth
+# ------------------------------
+
+def _load_profile(user_id: int):
+    row = db.session.query(*user_serializer.entities).filter(User.id == user_id).first()
+    return user_serializer.dump_row(row) if row else None
+
+identity_cache = IdentityCache(_load_profile, ttl=app.config['IDENTITY_CACHE_TTL_SECONDS'],
+                               maxsize=app.config['IDENTITY_CACHE_SIZE'])
+revocations = RevocationList(db, RevokedToken, capacity=app.config['REVOCATION_FILTER_CAPACITY'],
+                             refresh_seconds=app.config['REVOCATION_REFRESH_SECONDS'])
+
+def _issue_token(user) -> str:
+    # Role and status travel in the token, so authenticated requests never load the user
+    return create_access_token(identity=str(user.id),
+                               additional_claims={'role': user.role, 'act': bool(user.is_active)})
+
+@jwt.token_in_blocklist_loader
+def _token_revoked(jwt_header, jwt_payload):
+    return jwt_payload.get('act') is False or revocations.is_revoked(jwt_payload)
+
+def _current_role():
+    claims = get_jwt()
+    if 'role' in claims:
+        return claims['role']
+    # Tokens issued before roles were embedded
+    profile = identity_cache.get(int(get_jwt_identity()))
+    return profile['role'] if profile else None
+
+def _is_admin() -> bool:
+    return _current_role() == 'admin'
+
+def _user_changed(user_id: int, claims_changed: bool = False):
+    """Drop cached identity after a user write; revoke outstanding tokens when their claims went stale."""
+    identity_cache.invalidate(user_id)
+    if claims_changed:
+        revocations.revoke_user(user_id, app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds())
+
+# ------------------------------
+# Skill Search Index
+# ------------------------------
+
+skill_search_index = SearchIndex()
+_search_index_state = {'built': False, 'synced_at': 0.0, 'watermark': None}
+_search_index_lock = threading.Lock()
+
+def _sync_search_index(force: bool = False, session=None):
+    """Build the index on first use, then pick up listings created, edited or deactivated by other workers."""
+    now = time.monotonic()
+    if not force and _search_index_state['built'] and \
+            now - _search_index_state['synced_at'] < app.config['SEARCH_INDEX_REFRESH_SECONDS']:
+        return
+    # Once built, requests search the current index rather than wait for a refresh in progress.
+    # Async handlers share one thread, so blocking here while another holds the lock would deadlock.
+    if not _search_index_lock.acquire(blocking=force or not _search_index_state['built']):
+        return
+    try:
+        query = (session or db.session).query(SkillListing.id, SkillListing.title, SkillListing.description,
+                                              SkillListing.is_active, SkillListing.updated_at)
+        watermark = _search_index_state['watermark']
+        if watermark is None:
+            query = query.filter(SkillListing.is_active == True)
+        else:
+            # Stamps are taken before commit, so a row can appear after newer ones were read;
+            # re-reading a trailing window catches those instead of skipping them for good
+            query = query.filter(SkillListing.updated_at >= watermark
+                                 - timedelta(seconds=app.config['SEARCH_INDEX_SYNC_WINDOW_SECONDS']))
+        for skill_id, title, description, is_active, updated_at in query.order_by(SkillListing.id).yield_per(1000):
+            if is_active:
+                skill_search_index.add(skill_id, title, description)
+            else:
+                skill_search_index.remove(skill_id)
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+        _search_index_state['watermark'] = watermark
+        _search_index_state['built'] = True
+        _search_index_state['synced_at'] = now
+    finally:
+        _search_index_lock.release()
+
+def _ranked_skill_ids(search_text: str, query):
+    """BM25-ranked ids of the listings that pass the SQL filters in ``query``, at most SEARCH_MAX_CANDIDATES.
+
+    Hits are checked against the filters a batch at a time, best first, until
+    enough pass, so a selective filter still finds matches ranked far down.
+    """
+    _sync_search_index(session=query.session)
+    cap = app.config['SEARCH_MAX_CANDIDATES']
+    ranked = []
+    for batch in skill_search_index.search_batches(search_text, cap):
+        if not batch:
+            break
+        allowed = {row[0] for row in query.filter(SkillListing.id.in_(batch)).with_entities(SkillListing.id)}
+        ranked += [doc_id for doc_id in batch if doc_id in allowed]
+        if len(ranked) >= cap:
+            break
+    return ranked[:cap]
+
+def _matching_skill_ids(search_text: str, skill_ids, session=None):
+    """The ids among ``skill_ids`` that match ``search_text``."""
+    _sync_search_index(session=session)
+    return {doc_id for doc_id, _ in skill_search_index.search(search_text, limit=len(skill_ids),
+                                                                doc_ids=set(skill_ids))}
+
+def _load_skills_in_order(skill_ids, session=None):
+    if not skill_ids:
+        return []
+    rows = (session or db.session).query(*skill_serializer.entities).filter(SkillListing.id.in_(skill_ids))
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in skill_ids if i in by_id]
+
+def _skills_within(query, lat: float, lon: float, radius_km: float):
+    """``[(id, distance_km)]`` of listings in ``query`` within the radius, nearest first.
+
+    The geohash prefixes covering the circle turn into index range scans
+    (bounded by the next prefix, see ``prefix_range``), so only listings in
+    a few cells around the point are read.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    candidates = query.filter(SkillListing.geohash.isnot(None),
+                              SkillListing.latitude.between(min_lat, max_lat))
+    if -180.0 <= min_lon and max_lon <= 180.0:
+        # Boxes crossing the antimeridian rely on the geohash cells alone
+        candidates = candidates.filter(SkillListing.longitude.between(min_lon, max_lon))
+    prefixes = covering_prefixes(lat, lon, radius_km)
+    if prefixes != ['']:
+        ranges = []
+        for low, high in map(prefix_range, prefixes):
+            ranges.append(SkillListing.geohash >= low if high is None
+                          else and_(SkillListing.geohash >= low, SkillListing.geohash < high))
+        candidates = candidates.filter(or_(*ranges))
+    rows = candidates.with_entities(SkillListing.id, SkillListing.latitude, SkillListing.longitude).all()
+    if not rows:
+        return []
+    skill_ids, lats, lons = zip(*rows)
+    distances = haversine_km_many(lat, lon, lats, lons)
+    nearby = [(skill_id, float(distance)) for skill_id, distance in zip(skill_ids, distances)
+              if distance <= radius_km]
+    nearby.sort(key=lambda hit: (hit[1], hit[0]))
+    return nearby
+
+def _nearby_skills(query, lat: float, lon: float, radius_km: float):
+    """The nearest SEARCH_MAX_CANDIDATES listings within ``radius_km``.
+
+    In dense areas a small circle already holds enough listings, so the
+    search starts at 1/16 of the radius and doubles. Anything
+    outside a circle that holds ``cap`` listings is farther than all of
+    them, so the result is exactly the nearest ``cap``.
+    """
+    cap = app.config['SEARCH_MAX_CANDIDATES']
+    probe = radius_km / 16
+    while True:
+        search_radius = min(probe, radius_km)
+        nearby = _skills_within(query, lat, lon, search_radius)
+        if len(nearby) >= cap or search_radius >= radius_km:
+            return nearby[:cap]
+        probe *= 2
+
+def _skills_page(query, search_text, cursor, limit: int, include_total: bool, near=None):
+    """One page of listings: nearest first with ``near=(lat, lon, radius_km)``, BM25 order when
+    searching, (created_at, id) keyset order otherwise.
+    """
+    distances = None
+    if near or search_text:
+        if near:
+            nearby = _nearby_skills(query, *near)
+            if search_text:
+                # Ranked among the nearby listings only, which already passed the filters
+                matching = _matching_skill_ids(search_text, [skill_id for skill_id, _ in nearby], query.session)
+                nearby = [hit for hit in nearby if hit[0] in matching]
+            distances = dict(nearby)
+            ranked_ids = [skill_id for skill_id, _ in nearby]
+        else:
+            ranked_ids = _ranked_skill_ids(search_text, query)
+        page_ids, next_cursor, prev_cursor = ranked_page(ranked_ids, cursor, limit)
+        skills = _load_skills_in_order(page_ids, query.session)
+        # Ranked results are already capped at SEARCH_MAX_CANDIDATES
+        total, total_is_exact = len(ranked_ids), len(ranked_ids) < app.config['SEARCH_MAX_CANDIDATES']
+    else:
+        skills, next_cursor, prev_cursor = keyset_page(query.with_entities(*skill_serializer.entities),
+                                                       SkillListing, cursor, limit)
+        total = total_is_exact = None
+        if include_total:
+            total, total_is_exact = approximate_count(query, SkillListing, app.config['TOTAL_COUNT_CAP'])
+
+    skills = skill_serializer.dump_rows(skills)
+    reputations = _load_reputations((s['provider_id'] for s in skills), query.session)
+    for skill in skills:
+        skill['provider_reputation'] = reputations[skill['provider_id']]
+        if distances is not None:
+            skill['distance_km'] = round(distances[skill['id']], 3)
+
+    result = {
+        'skills': skills,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'per_page': limit
+    }
+    if total is not None:
+        result['total'] = total
+        result['total_is_exact'] = total_is_exact
+    return result
+
+# ------------------------------
+# Response Cache Tags
+# ------------------------------
+
+def _skill_list_tags():
+    # Keyset pages behind a cursor are stable when listings are added at the
+    # head, so only first pages, filtered views and searches depend on creates
+    category = request.args.get('category')
+    tags = [f'skills:category:{category}' if category else 'skills:all']
+    if not request.args.get('cursor'):
+        tags.append('skills:first-page')
+    if request.args.get('search') or request.args.get('near'):
+        tags.append('skills:search')
+    return tags
+
+def _invalidate_skill_caches(skill, created: bool = False):
+    tags = [f'skills:category:{skill.category}', 'skills:first-page', 'skills:search', 'categories', 'locations']
+    if not created:
+        # Edits and deactivations can change any page the listing sits on
+        tags += [f'skill:{skill.id}', 'skills:all']
+    response_cache.invalidate(*tags)
+
+# ------------------------------
+# Conditional Responses
+# ------------------------------
+
+# updated_at comes from the app servers' clocks and MySQL keeps whole seconds, so a write in the
+# same second as the newest stamp (or from a server slightly behind) may not raise the maximum.
+# No ETag is issued until the newest stamp is older than this.
+_VALIDATOR_SETTLE_SECONDS = 2
+
+def _catalog_etag():
+    """Strong ETag for the current listing page, from MAX(updated_at)/MAX(id) instead of the body.
+
+    The maxima are over whole tables, so each is one index lookup whatever
+    the filters; any listing write or reputation change revalidates every
+    page. Listings are only ever deactivated, which stamps updated_at too.
+    """
+    newest_listing, last_id, newest_stats = db.session.execute(select(
+        select(func.max(SkillListing.updated_at)).scalar_subquery(),
+        select(func.max(SkillListing.id)).scalar_subquery(),
+        select(func.max(UserStats.updated_at)).scalar_subquery())).one()
+    settled = datetime.utcnow() - timedelta(seconds=_VALIDATOR_SETTLE_SECONDS)
+    if any(stamp is not None and stamp > settled for stamp in (newest_listing, newest_stats)):
+        return None
+    parts = [request.path, '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True))),
+             str(newest_listing), str(last_id), str(newest_stats)]
+    if request.args.get('search'):
+        # Results come from this worker's search index, which may lag the table
+        _sync_search_index()
+        parts.append(str(skill_search_index.version))
+    return 'skills-' + hashlib.sha1('|'.join(parts).encode()).hexdigest()[:24]
+
+def _catalog_cache_control() -> str:
+    max_age = app.config['CATALOG_MAX_AGE_SECONDS']
+    return f'public, max-age={max_age}' if max_age > 0 else 'public, no-cache'
+
+# ------------------------------
+# Trending
+# ------------------------------
+
+# How much one event counts towards a category/location trending
+TRENDING_WEIGHTS = {'listing': 1.0, 'chat': 2.0, 'exchange': 3.0}
+
+def _record_trending(category: str, location: str, event: str, times: int = 1):
+    weight = TRENDING_WEIGHTS[event] * times
+    trending.record('category', category, weight)
+    trending.record('location', location, weight)
+
+def _popular_response(dimension: str, column, key: str):
+    limit = clamp_page_size(request.args.get('limit', type=int), 10, 50)
+    ranked = trending.top(dimension, limit)
+    active = db.session.query(column, func.count(SkillListing.id)) \
+        .filter(SkillListing.is_active == True, column.isnot(None)) \
+        .group_by(column)
+    if ranked:
+        counts = dict(active.filter(column.in_([name for name, _ in ranked])).all())
+    else:
+        # Nothing recorded or backfilled yet: fall back to listing counts
+        ranked = active.order_by(func.count(SkillListing.id).desc()).limit(limit).all()
+        counts = dict(ranked)
+    return jsonify({key: [{'name': name, 'count': counts.get(name, 0), 'score': round(score, 2)}
+                          for name, score in ranked]}), 200
+
+def _busy_response(message: str, retry_after: int = 1):
+    response = jsonify({'message': message})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
 # Routes
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/auth/register', methods=['POST'])
+@rate_limiter.limit('register', by='ip')
 def register():
     try:
         data = request.get_json()
@@ -222,32 +831,33 @@ def register():
         user.username = data['username']
         user.email = data['email']
         user.phone = data.get('phone')
-        user.role = data.get('role', 'user')
+        # Never from the request: admins are made with PUT /api/admin/users/<id> or `flask set-role`
+        user.role = 'user'
         
         user.set_password(data['password'])
+        # Inserted in the same transaction: every user has a wallet the moment they exist
+        user.wallet = Wallet()
         
         db.session.add(user)
         db.session.commit()
         
-        # Create wallet for user
-        wallet = Wallet()
-        wallet.user_id = user.id
-        db.session.add(wallet)
-        db.session.commit()
-        
-        access_token = create_access_token(identity=str(user.id))
+        access_token = _issue_token(user)
         
         return jsonify({
             'message': 'User registered successfully',
             'access_token': access_token,
-            'user': user_schema.dump(user)
+            'user': user_serializer.dump_object(user)
         }), 201
         
+    except HasherBusy as e:
+        db.session.rollback()
+        return _busy_response(str(e))
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Registration failed', 'error': str(e)}), 500
 
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limiter.limit('login', by='ip')
 def login():
     try:
         data = request.get_json()
@@ -255,29 +865,36 @@ def login():
         user = User.query.filter_by(email=data['email']).first()
         
         if user and user.check_password(data['password']):
-            access_token = create_access_token(identity=str(user.id))
+            if db.session.is_modified(user):
+                db.session.commit()
+            if not user.is_active:
+                return jsonify({'message': 'Account is disabled'}), 403
+            access_token = _issue_token(user)
             return jsonify({
                 'message': 'Login successful',
                 'access_token': access_token,
-                'user': user_schema.dump(user)
+                'user': user_serializer.dump_object(user)
             }), 200
         else:
             return jsonify({'message': 'Invalid credentials'}), 401
             
+    except HasherBusy as e:
+        db.session.rollback()
+        return _busy_response(str(e))
     except Exception as e:
+        db.session.rollback()
         return jsonify({'message': 'Login failed', 'error': str(e)}), 500
 
 @app.route('/api/user/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
     try:
-        user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
+        profile = identity_cache.get(int(get_jwt_identity()))
         
-        if not user:
+        if profile is None:
             return jsonify({'message': 'User not found'}), 404
         
-        return jsonify({'user': user_schema.dump(user)}), 200
+        return jsonify({'user': profile}), 200
         
     except Exception as e:
         return jsonify({'message': 'Failed to get profile', 'error': str(e)}), 500
@@ -300,25 +917,69 @@ def update_profile():
             user.phone = data['phone']
         
         db.session.commit()
+        _user_changed(user_id)
         
         return jsonify({
             'message': 'Profile updated successfully',
-            'user': user_schema.dump(user)
+            'user': user_serializer.dump_object(user)
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Failed to update profile', 'error': str(e)}), 500
 
+@app.route('/api/auth/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    try:
+        claims = get_jwt()
+        revocations.revoke(claims['jti'], int(claims['sub']), claims['exp'])
+        return jsonify({'message': 'Logged out'}), 200
+    except Exception as e:
+        return jsonify({'message': 'Logout failed', 'error': str(e)}), 500
+
+@app.route('/api/admin/users/<int:user_id>', methods=['PUT'])
+@jwt_required()
+def admin_update_user(user_id: int):
+    try:
+        if not _is_admin():
+            return jsonify({'message': 'Admin access required'}), 403
+        user = db.session.get(User, user_id)
+        if not user:
+            return jsonify({'message': 'User not found'}), 404
+
+        data = request.get_json() or {}
+        if 'role' in data:
+            if data['role'] not in ('user', 'admin'):
+                return jsonify({'message': "role must be 'user' or 'admin'"}), 400
+            user.role = data['role']
+        if 'is_active' in data:
+            if not isinstance(data['is_active'], bool):
+                return jsonify({'message': 'is_active must be a boolean'}), 400
+            user.is_active = data['is_active']
+
+        claims_changed = db.session.is_modified(user)
+        db.session.commit()
+        # Tokens carry role and status, so the ones already issued must stop working
+        _user_changed(user_id, claims_changed=claims_changed)
+
+        return jsonify({'message': 'User updated', 'user': user_serializer.dump_object(user)}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to update user', 'error': str(e)}), 500
+
 @app.route('/api/user/skills', methods=['GET'])
 @jwt_required()
 def get_user_skills():
     try:
         user_id = int(get_jwt_identity())
-        skills = SkillListing.query.filter_by(provider_id=user_id, is_active=True).order_by(SkillListing.created_at.desc()).all()
+        skills = db.session.query(*skill_serializer.entities) \
+            .filter(SkillListing.provider_id == user_id, SkillListing.is_active == True) \
+            .order_by(SkillListing.created_at.desc()) \
+            .all()
         
-        return jsonify({
-            'skills': skills_schema.dump(skills),
+        return fast_jsonify({
+            'skills': skill_serializer.dump_rows(skills),
             'total': len(skills)
         }), 200
         
@@ -326,13 +987,22 @@ def get_user_skills():
         return jsonify({'message': 'Failed to get user skills', 'error': str(e)}), 500
 
 @app.route('/api/skills', methods=['GET'])
+@response_cache.cached(ttl=30, tags=_skill_list_tags)
+@db_router.read_only
+@conditional(_catalog_etag, _catalog_cache_control)
 def get_skills():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
+        cursor = request.args.get('cursor')
+        per_page = clamp_page_size(request.args.get('per_page', type=int),
+                                   app.config['DEFAULT_PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        include_total = request.args.get('include_total', 'false').lower() in ('1', 'true', 'yes')
         category = request.args.get('category')
         location = request.args.get('location')
         search = request.args.get('search')
+        near = request.args.get('near')
+        if near:
+            near = parse_near(near, request.args.get('radius_km'),
+                              app.config['GEO_DEFAULT_RADIUS_KM'], app.config['GEO_MAX_RADIUS_KM'])
         
         query = SkillListing.query.filter_by(is_active=True)
         
@@ -340,28 +1010,27 @@ def get_skills():
             query = query.filter_by(category=category)
         if location:
             query = query.filter_by(location=location)
-        if search:
-            query = query.filter(SkillListing.title.contains(search) | SkillListing.description.contains(search))
-        
-        skills = query.paginate(page=page, per_page=per_page, error_out=False)
-        
-        return jsonify({
-            'skills': skills_schema.dump(skills.items),
-            'total': skills.total,
-            'pages': skills.pages,
-            'current_page': page
-        }), 200
+
+        return fast_jsonify(_skills_page(query, search, cursor, per_page, include_total, near)), 200
         
+    except (InvalidCursor, InvalidLocation) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': 'Failed to get skills', 'error': str(e)}), 500
 
 @app.route('/api/skills/<int:skill_id>', methods=['GET'])
+@response_cache.cached(ttl=60, tags=lambda skill_id: [f'skill:{skill_id}'])
+@db_router.read_only
 def get_skill_by_id(skill_id: int):
     try:
-        skill = SkillListing.query.get(skill_id)
-        if not skill or not skill.is_active:
+        skill = db.session.query(*skill_serializer.entities) \
+            .filter(SkillListing.id == skill_id, SkillListing.is_active == True) \
+            .first()
+        if not skill:
             return jsonify({'message': 'Skill not found'}), 404
-        return jsonify({'skill': skill_schema.dump(skill)}), 200
+        result = skill_serializer.dump_row(skill)
+        result['provider_reputation'] = _load_reputations([skill.provider_id])[skill.provider_id]
+        return fast_jsonify({'skill': result}), 200
     except Exception as e:
         return jsonify({'message': 'Failed to get skill', 'error': str(e)}), 500
 @app.route('/api/skills', methods=['POST'])
@@ -376,65 +1045,184 @@ def create_skill():
         skill.description = data['description']
         skill.category = data['category']
         skill.location = data.get('location')
+        coordinates = parse_coordinates(data.get('latitude'), data.get('longitude'))
+        if coordinates:
+            skill.latitude, skill.longitude = coordinates
+            skill.geohash = geohash_encode(*coordinates)
         skill.time_credits = data.get('time_credits', 0)
         skill.monetary_price = data.get('monetary_price', 0.0)
         skill.provider_id = user_id
         
         
         db.session.add(skill)
+        db.session.flush()
+        jobs.enqueue(db.session, 'skill_created', {'skill_id': skill.id})
         db.session.commit()
-        
+
         return jsonify({
             'message': 'Skill created successfully',
             'skill': skill_schema.dump(skill)
         }), 201
         
+    except InvalidLocation as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Failed to create skill', 'error': str(e)}), 500
 
+@jobs.task('skill_created')
+def _publish_new_skill(skill_id: int):
+    """Search index, cached pages and trending for a new listing."""
+    skill = db.session.get(SkillListing, skill_id)
+    if skill is None:
+        return
+    if _search_index_state['built'] and skill.is_active:
+        # An index not built yet loads the listing with the rest; standalone workers never build one
+        skill_search_index.add(skill.id, skill.title, skill.description)
+    _invalidate_skill_caches(skill, created=True)
+    _record_trending(skill.category, skill.location, 'listing')
+
+@app.route('/api/categories/popular', methods=['GET'])
+@response_cache.cached(ttl=300, tags=['categories'])
+def get_popular_categories():
+    try:
+        return _popular_response('category', SkillListing.category, 'categories')
+    except Exception as e:
+        return jsonify({'message': 'Failed to get popular categories', 'error': str(e)}), 500
+
+@app.route('/api/locations/popular', methods=['GET'])
+@response_cache.cached(ttl=300, tags=['locations'])
+def get_popular_locations():
+    try:
+        return _popular_response('location', SkillListing.location, 'locations')
+    except Exception as e:
+        return jsonify({'message': 'Failed to get popular locations', 'error': str(e)}), 500
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'TradeCraft API is running'}), 200
+    return jsonify({
+        'status': 'healthy',
+        'message': 'TradeCraft API is running',
+        'password_hasher': password_hasher.metrics(),
+        'db_pools': pool_metrics.snapshot(),
+        'db_routing': db_router.metrics(),
+        'auth': {'identity_cache': {'hits': identity_cache.hits, 'misses': identity_cache.misses},
+                 'revocations': revocations.metrics()},
+        'jobs': jobs.metrics(),
+        'rate_limits': rate_limiter.metrics(),
+        'compression': compressor.metrics()
+    }), 200
 
 # ------------------------------
-# Skill Advanced Search
+# Metrics
 # ------------------------------
-@app.route('/api/skills/search', methods=['POST'])
-def search_skills_advanced():
+
+def _pool_metric_lines():
+    pools = pool_metrics.snapshot()
+    lines = []
+    for name, key, kind, help_text in (
+            ('db_pool_checked_out', 'checked_out', 'gauge', 'Connections currently checked out.'),
+            ('db_pool_capacity', 'capacity', 'gauge', 'Pool size plus allowed overflow.'),
+            ('db_pool_saturation', 'saturation', 'gauge', 'Checked out connections divided by capacity.'),
+            ('db_pool_peak_checked_out', 'peak_checked_out', 'gauge', 'Most connections checked out at once.'),
+            ('db_pool_checkout_timeouts_total', 'timeouts', 'counter', 'Checkouts that gave up waiting.')):
+        lines += format_metric(name, kind, help_text, [({'database': db_name}, stats[key])
+                                                        for db_name, stats in pools.items()])
+    lines += format_histogram('db_pool_checkout_wait_seconds', 'Time to get a connection from the pool.', [
+        ({'database': db_name}, [(bound, stats['wait_seconds_buckets'][str(bound)]) for bound in WAIT_BUCKETS],
+         stats['checkouts'], stats['wait_seconds'])
+        for db_name, stats in pools.items()])
+    routing = db_router.metrics()
+    lines += format_metric('db_replica_routed_requests_total', 'counter', 'Read-only requests by target database.',
+                           [({'target': 'replica'}, routing['replica_requests']),
+                            ({'target': 'primary_sticky'}, routing['sticky_primary_requests'])])
+    return lines
+
+def _app_metric_lines():
+    hasher = password_hasher.metrics()
+    revoked = revocations.metrics()
+    return (format_metric('password_hash_in_flight', 'gauge', 'Password hashes queued or running.',
+                          [({}, hasher['in_flight'])])
+            + format_metric('password_hash_rejected_total', 'counter', 'Hashes refused because the pool was full.',
+                            [({}, hasher['rejected'])])
+            + format_metric('response_cache_requests_total', 'counter', 'Cached route lookups by result.',
+                            [({'result': 'hit'}, response_cache.hits), ({'result': 'miss'}, response_cache.misses)])
+            + format_metric('identity_cache_requests_total', 'counter', 'Identity cache lookups by result.',
+                            [({'result': 'hit'}, identity_cache.hits), ({'result': 'miss'}, identity_cache.misses)])
+            + format_metric('revoked_tokens', 'gauge', 'Unexpired revoked tokens held in the filter.',
+                            [({}, revoked['revoked_tokens'])])
+            + format_metric('revocation_confirm_queries_total', 'counter',
+                            'Filter hits confirmed against the revoked_tokens table.',
+                            [({}, revoked['confirmation_queries'])]))
+
+profiler.add_collector(_pool_metric_lines)
+profiler.add_collector(_app_metric_lines)
+profiler.add_collector(jobs.metric_lines)
+profiler.add_collector(rate_limiter.metric_lines)
+profiler.add_collector(compressor.metric_lines)
+
+def _metrics_allowed() -> bool:
+    token = app.config['METRICS_TOKEN']
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
     try:
-        data = request.get_json() or {}
-        search_text = (data.get('query') or '').strip()
-        filters = data.get('filters') or {}
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return any(address in network for network in app.config['METRICS_ALLOWED_IPS'])
 
-        query = SkillListing.query.filter_by(is_active=True)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not _metrics_allowed():
+        return jsonify({'message': 'Forbidden'}), 403
+    return profiler.metrics_response()
 
-        category = (filters.get('category') or '').strip() if isinstance(filters, dict) else None
-        location = (filters.get('location') or '').strip() if isinstance(filters, dict) else None
-        min_credits = filters.get('min_credits') if isinstance(filters, dict) else None
-        max_credits = filters.get('max_credits') if isinstance(filters, dict) else None
-        max_price = filters.get('max_price') if isinstance(filters, dict) else None
+# ------------------------------
+# Skill Advanced Search
+# ------------------------------
+def _search_skills(session, data: dict):
+    """Search results for a request body; ``session`` may be the sync facade of an async session."""
+    search_text = (data.get('query') or '').strip()
+    filters = data.get('filters') or {}
 
-        if category:
-            query = query.filter_by(category=category)
-        if location:
-            query = query.filter_by(location=location)
-        if isinstance(min_credits, int):
-            query = query.filter(SkillListing.time_credits >= min_credits)
-        if isinstance(max_credits, int):
-            query = query.filter(SkillListing.time_credits <= max_credits)
-        if isinstance(max_price, (int, float)):
-            query = query.filter(SkillListing.monetary_price <= float(max_price))
-        if search_text:
-            like_expr = f"%{search_text}%"
-            query = query.filter(or_(SkillListing.title.like(like_expr),
-                                     SkillListing.description.like(like_expr)))
-
-        results = query.order_by(SkillListing.created_at.desc()).all()
-        return jsonify({
-            'skills': skills_schema.dump(results),
-            'total': len(results)
-        }), 200
+    query = session.query(SkillListing).filter_by(is_active=True)
+
+    category = (filters.get('category') or '').strip() if isinstance(filters, dict) else None
+    location = (filters.get('location') or '').strip() if isinstance(filters, dict) else None
+    min_credits = filters.get('min_credits') if isinstance(filters, dict) else None
+    max_credits = filters.get('max_credits') if isinstance(filters, dict) else None
+    max_price = filters.get('max_price') if isinstance(filters, dict) else None
+    near = filters.get('near') if isinstance(filters, dict) else None
+    if isinstance(near, (list, tuple)):
+        near = ','.join(str(v) for v in near)
+    if near:
+        near = parse_near(near, filters.get('radius_km'),
+                          app.config['GEO_DEFAULT_RADIUS_KM'], app.config['GEO_MAX_RADIUS_KM'])
+
+    if category:
+        query = query.filter_by(category=category)
+    if location:
+        query = query.filter_by(location=location)
+    if isinstance(min_credits, int):
+        query = query.filter(SkillListing.time_credits >= min_credits)
+    if isinstance(max_credits, int):
+        query = query.filter(SkillListing.time_credits <= max_credits)
+    if isinstance(max_price, (int, float)):
+        query = query.filter(SkillListing.monetary_price <= float(max_price))
+
+    limit = clamp_page_size(data.get('limit'), app.config['SEARCH_DEFAULT_LIMIT'], app.config['MAX_PAGE_SIZE'])
+    include_total = bool(data.get('include_total'))
+
+    return _skills_page(query, search_text, data.get('cursor'), limit, include_total, near)
+
+@app.route('/api/skills/search', methods=['POST'])
+@rate_limiter.limit('search')
+@db_router.read_only
+def search_skills_advanced():
+    try:
+        return fast_jsonify(_search_skills(db.session, request.get_json() or {})), 200
+    except (InvalidCursor, InvalidLocation) as e:
+        return jsonify({'message': str(e)}), 400
     except Exception as e:
         return jsonify({'message': 'Search failed', 'error': str(e)}), 500
 
@@ -455,32 +1243,246 @@ def _serialize_skill_basic(skill: SkillListing):
         'title': skill.title
     }
 
+def _serialize_message_preview(message: Message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+        'sender_id': message.sender_id
+    }
+
+class ChatError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+def _member_chat(session, chat_id: int, user_id: int, lock: bool = False) -> Chat:
+    chat = session.get(Chat, chat_id, with_for_update=lock or None)
+    if not chat or not chat.is_active:
+        raise ChatError('Chat not found', 404)
+    if user_id not in [chat.user1_id, chat.user2_id]:
+        raise ChatError('Not authorized for this chat', 403)
+    return chat
+
+def _received_count(user_id: int):
+    """The chat's received-message counter for ``user_id``, as a SQL expression."""
+    return case((Chat.user1_id == user_id, Chat.user1_received), else_=Chat.user2_received)
+
+def _load_chat_inbox(session, user_id: int):
+    """Load a user's chats with participants, skill, last message, unread count and the other
+    participant's read position in one query, without touching older messages.
+    """
+    user1 = aliased(User)
+    user2 = aliased(User)
+    last_message = aliased(Message)
+    own_cursor = aliased(ChatReadCursor)
+    peer_cursor = aliased(ChatReadCursor)
+
+    unread_count = _received_count(user_id) - func.coalesce(own_cursor.read_count, 0)
+    peer_id = case((Chat.user1_id == user_id, Chat.user2_id), else_=Chat.user1_id)
+
+    return session.query(Chat, user1, user2, SkillListing, last_message, unread_count.label('unread_count'),
+                         peer_cursor.last_read_message_id) \
+        .outerjoin(user1, user1.id == Chat.user1_id) \
+        .outerjoin(user2, user2.id == Chat.user2_id) \
+        .outerjoin(SkillListing, SkillListing.id == Chat.skill_id) \
+        .outerjoin(own_cursor, and_(own_cursor.chat_id == Chat.id, own_cursor.user_id == user_id)) \
+        .outerjoin(peer_cursor, and_(peer_cursor.chat_id == Chat.id, peer_cursor.user_id == peer_id)) \
+        .outerjoin(last_message, last_message.id == Chat.last_message_id) \
+        .filter(or_(Chat.user1_id == user_id, Chat.user2_id == user_id), Chat.is_active == True) \
+        .order_by(Chat.created_at.desc()) \
+        .all()
+
+def _chat_inbox(session, user_id: int):
+    result = []
+    for chat, user1, user2, skill, last_message, unread_count, peer_read_id in _load_chat_inbox(session, user_id):
+        result.append({
+            'id': chat.id,
+            'created_at': chat.created_at.isoformat(),
+            'is_active': chat.is_active,
+            'user1_id': chat.user1_id,
+            'user2_id': chat.user2_id,
+            'user1': _serialize_user_basic(user1) if user1 else None,
+            'user2': _serialize_user_basic(user2) if user2 else None,
+            'skill': _serialize_skill_basic(skill) if skill else None,
+            'last_message': _serialize_message_preview(last_message) if last_message else None,
+            'unread_count': unread_count or 0,
+            'peer_last_read_message_id': peer_read_id or 0
+        })
+    return result
+
+def _unread_counts(session, user_id: int, chat_id: int = None):
+    """``{chat_id: unread}`` for the user's chats with unread messages, from the counters alone."""
+    cursor = aliased(ChatReadCursor)
+    unread = _received_count(user_id) - func.coalesce(cursor.read_count, 0)
+    query = session.query(Chat.id, unread) \
+        .outerjoin(cursor, and_(cursor.chat_id == Chat.id, cursor.user_id == user_id)) \
+        .filter(or_(Chat.user1_id == user_id, Chat.user2_id == user_id), Chat.is_active == True, unread > 0)
+    if chat_id is not None:
+        query = query.filter(Chat.id == chat_id)
+    return dict(query.all())
+
+def _chat_messages(session, chat_id: int, user_id: int, after_id, before_id, limit: int, if_none_match):
+    """``(etag, body)`` for one page of a chat; ``body`` is None when ``if_none_match`` already holds the etag."""
+    _member_chat(session, chat_id, user_id)
+
+    # New messages raise the newest id and edits the newest edited_at, so the two identify the
+    # chat's state. Both come from an index, so revalidations load no message rows.
+    latest_id, last_edit = session.execute(select(
+        select(func.max(Message.id)).where(Message.chat_id == chat_id).scalar_subquery(),
+        select(func.max(Message.edited_at)).where(Message.chat_id == chat_id).scalar_subquery())).one()
+    latest_id = latest_id or 0
+    edited = last_edit.strftime('%Y%m%d%H%M%S%f') if last_edit else 0
+    etag = f'chat-{chat_id}-{latest_id}-{edited}-{after_id}-{before_id}-{limit}'
+    if matching_etag(if_none_match, etag):
+        return etag, None
+
+    query = session.query(Message).filter(Message.chat_id == chat_id)
+    if after_id is not None:
+        messages = query.filter(Message.id > after_id).order_by(Message.id.asc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before_id is not None:
+            query = query.filter(Message.id < before_id)
+        messages = query.order_by(Message.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = list(reversed(messages[:limit]))
+
+    result = [{
+        'id': m.id,
+        'content': m.content,
+        'created_at': m.created_at.isoformat(),
+        'is_edited': m.is_edited,
+        'edited_at': m.edited_at.isoformat() if m.edited_at else None,
+        'chat_id': m.chat_id,
+        'sender_id': m.sender_id,
+        'receiver_id': m.receiver_id
+    } for m in messages]
+    return etag, {'messages': result, 'has_more': has_more, 'latest_id': latest_id}
+
+def _advance_read_cursor(session, chat_id: int, user_id: int, message_id: int = None):
+    """Move the user's read cursor up to ``message_id`` (default: the latest message).
+
+    Returns ``(member_ids, receipt)`` for the ``chat_read`` event, or None when
+    the cursor was already there. The cursor also stores how many messages the
+    user had received at that point, which is what unread counts subtract.
+    """
+    cursor = session.get(ChatReadCursor, (chat_id, user_id))
+    if cursor is not None and message_id is not None and cursor.last_read_message_id >= message_id:
+        return None
+    # Queried rather than taken from a loaded Chat, which may have come from a lagging replica
+    last_id, received, *members = session.query(func.coalesce(Chat.last_message_id, 0), _received_count(user_id),
+                                                Chat.user1_id, Chat.user2_id) \
+        .filter(Chat.id == chat_id).one()
+    position = last_id if message_id is None else min(message_id, last_id)
+    if position <= (cursor.last_read_message_id if cursor is not None else 0):
+        return None
+    read_count = received
+    if position < last_id:
+        # Only the messages after the new position are counted, not the chat's history
+        read_count -= session.query(func.count(Message.id)) \
+            .filter(Message.chat_id == chat_id, Message.receiver_id == user_id,
+                    Message.id > position, Message.id <= last_id).scalar()
+
+    if not _upsert_read_cursor(session, chat_id, user_id, position, read_count, exists=cursor is not None):
+        return None
+    return members, {'chat_id': chat_id, 'user_id': user_id, 'last_read_message_id': position}
+
+def _upsert_read_cursor(session, chat_id: int, user_id: int, position: int, read_count: int,
+                        exists: bool) -> bool:
+    """Store the cursor at ``position`` and commit; False when it was already there or further on.
+
+    The first read of a chat inserts the cursor. Two first reads at the same
+    moment both try to, so the insert runs in a savepoint and the loser
+    falls back to the guarded update, which never moves the cursor back.
+    """
+    if not exists:
+        try:
+            with session.begin_nested():
+                session.add(ChatReadCursor(chat_id=chat_id, user_id=user_id, last_read_message_id=position,
+                                           read_count=read_count))
+            session.commit()
+            return True
+        except IntegrityError:
+            pass  # a concurrent request created it first
+    moved = session.execute(
+        update(ChatReadCursor)
+        .where(ChatReadCursor.chat_id == chat_id, ChatReadCursor.user_id == user_id,
+               ChatReadCursor.last_read_message_id < position)
+        .values(last_read_message_id=position, read_count=read_count, updated_at=datetime.utcnow())
+    ).rowcount
+    session.commit()
+    return bool(moved)
+
+def _mark_chat_read(chat_id: int, user_id: int, message_id: int = None):
+    # Checked on the primary: a lagging replica could miss the cursor and cause a duplicate insert
+    with db_router.primary():
+        return _advance_read_cursor(db.session, chat_id, user_id, message_id)
+
+def _post_chat_message(session, chat_id: int, user_id: int, content: str) -> dict:
+    """Store a message from a chat member and return its payload.
+
+    The chat row is locked before the insert, so one chat's messages commit
+    in id order. A reader that sees ``last_message_id`` has then also seen
+    every earlier message counted in ``userN_received``; otherwise a send
+    committing after a later one left its message under the reader's
+    cursor but outside ``read_count``, an unread count stuck above zero.
+    """
+    chat = _member_chat(session, chat_id, user_id, lock=True)
+    content = (content or '').strip()
+    if not content:
+        raise ChatError('Message content is required', 400)
+
+    receiver_id = chat.user1_id if user_id == chat.user2_id else chat.user2_id
+
+    msg = Message()
+    msg.chat_id = chat.id
+    msg.sender_id = user_id
+    msg.receiver_id = receiver_id
+    msg.content = content
+
+    session.add(msg)
+    session.flush()
+    # Same transaction as the insert, under the chat's row lock
+    received = Chat.user1_received if receiver_id == chat.user1_id else Chat.user2_received
+    session.execute(
+        update(Chat)
+        .where(Chat.id == chat.id)
+        .values({received: received + 1,
+                 Chat.last_message_id: case((or_(Chat.last_message_id.is_(None), Chat.last_message_id < msg.id),
+                                             msg.id), else_=Chat.last_message_id)})
+        .execution_options(synchronize_session=False)
+    )
+    jobs.enqueue(session, 'chat_message_sent', {'message_id': msg.id})
+    session.commit()
+
+    return _message_event(msg)
+
+def _message_event(msg) -> dict:
+    return {
+        'id': msg.id,
+        'content': msg.content,
+        'created_at': msg.created_at.isoformat(),
+        'chat_id': msg.chat_id,
+        'sender_id': msg.sender_id,
+        'receiver_id': msg.receiver_id
+    }
+
+@jobs.task('chat_message_sent')
+def _notify_chat_message(message_id: int):
+    """Push a new message to both members' event streams."""
+    msg = db.session.get(Message, message_id)
+    if msg is not None:
+        _publish_to_users((msg.sender_id, msg.receiver_id), 'chat_message', _message_event(msg))
+
 @app.route('/api/chats', methods=['GET'])
 @jwt_required()
+@db_router.read_only
 def list_chats():
     try:
         user_id = int(get_jwt_identity())
-        chats = Chat.query.filter(
-            (Chat.user1_id == user_id) | (Chat.user2_id == user_id),
-            Chat.is_active == True
-        ).order_by(Chat.created_at.desc()).all()
-
-        result = []
-        for chat in chats:
-            user1 = User.query.get(chat.user1_id)
-            user2 = User.query.get(chat.user2_id)
-            skill = SkillListing.query.get(chat.skill_id) if chat.skill_id else None
-            result.append({
-                'id': chat.id,
-                'created_at': chat.created_at.isoformat(),
-                'is_active': chat.is_active,
-                'user1_id': chat.user1_id,
-                'user2_id': chat.user2_id,
-                'user1': _serialize_user_basic(user1) if user1 else None,
-                'user2': _serialize_user_basic(user2) if user2 else None,
-                'skill': _serialize_skill_basic(skill) if skill else None
-            })
-        return jsonify({'chats': result}), 200
+        return jsonify({'chats': _chat_inbox(db.session, user_id)}), 200
     except Exception as e:
         return jsonify({'message': 'Failed to load chats', 'error': str(e)}), 500
 
@@ -523,6 +1525,8 @@ def create_chat():
             chat.skill_id = skill_id
             db.session.add(chat)
             db.session.commit()
+            if skill_id:
+                _record_trending(skill.category, skill.location, 'chat')
 
         return jsonify({'message': 'Chat ready', 'chat': {
             'id': chat.id,
@@ -539,67 +1543,1005 @@ def create_chat():
 def get_chat_messages(chat_id: int):
     try:
         user_id = int(get_jwt_identity())
-        chat = Chat.query.get(chat_id)
-        if not chat or not chat.is_active:
-            return jsonify({'message': 'Chat not found'}), 404
-        if user_id not in [chat.user1_id, chat.user2_id]:
-            return jsonify({'message': 'Not authorized for this chat'}), 403
-
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at.asc()).all()
-        result = [{
-            'id': m.id,
-            'content': m.content,
-            'created_at': m.created_at.isoformat(),
-            'is_edited': m.is_edited,
-            'edited_at': m.edited_at.isoformat() if m.edited_at else None,
-            'chat_id': m.chat_id,
-            'sender_id': m.sender_id,
-            'receiver_id': m.receiver_id
-        } for m in messages]
-        return jsonify({'messages': result}), 200
+        after_id = request.args.get('after_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+        limit = clamp_page_size(request.args.get('limit', type=int),
+                                app.config['MESSAGE_PAGE_SIZE'], app.config['MAX_MESSAGE_PAGE_SIZE'])
+
+        etag, body = _chat_messages(db.session, chat_id, user_id, after_id, before_id, limit, request.if_none_match)
+        if body is None:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        # Opening a chat counts as reading it
+        if body['messages']:
+            _publish_read_receipt(_mark_chat_read(chat_id, user_id, body['messages'][-1]['id']))
+
+        response = jsonify(body)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response, 200
+    except ChatError as e:
+        return jsonify({'message': str(e)}), e.status
     except Exception as e:
         return jsonify({'message': 'Failed to load messages', 'error': str(e)}), 500
 
+@app.route('/api/chats/<int:chat_id>/read', methods=['POST'])
+@jwt_required()
+def mark_chat_read(chat_id: int):
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        message_id = data.get('message_id')
+        if message_id is not None and not isinstance(message_id, int):
+            return jsonify({'message': 'message_id must be an integer'}), 400
+
+        _member_chat(db.session, chat_id, user_id)
+        _publish_read_receipt(_mark_chat_read(chat_id, user_id, message_id))
+
+        cursor = db.session.get(ChatReadCursor, (chat_id, user_id))
+        return jsonify({
+            'chat_id': chat_id,
+            'last_read_message_id': cursor.last_read_message_id if cursor else 0,
+            'unread_count': _unread_counts(db.session, user_id, chat_id).get(chat_id, 0)
+        }), 200
+    except ChatError as e:
+        return jsonify({'message': str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to mark chat read', 'error': str(e)}), 500
+
+@app.route('/api/chats/unread', methods=['GET'])
+@jwt_required()
+@db_router.read_only
+def get_unread_counts():
+    try:
+        counts = _unread_counts(db.session, int(get_jwt_identity()))
+        return jsonify({
+            'total': sum(counts.values()),
+            'chats': [{'chat_id': chat_id, 'unread_count': count} for chat_id, count in sorted(counts.items())]
+        }), 200
+    except Exception as e:
+        return jsonify({'message': 'Failed to load unread counts', 'error': str(e)}), 500
+
 @app.route('/api/chats/<int:chat_id>/messages', methods=['POST'])
 @jwt_required()
+@rate_limiter.limit('send_message')
 def send_chat_message(chat_id: int):
     try:
         user_id = int(get_jwt_identity())
-        chat = Chat.query.get(chat_id)
-        if not chat or not chat.is_active:
-            return jsonify({'message': 'Chat not found'}), 404
-        if user_id not in [chat.user1_id, chat.user2_id]:
-            return jsonify({'message': 'Not authorized for this chat'}), 403
+        data = request.get_json() or {}
+        payload = _post_chat_message(db.session, chat_id, user_id, data.get('content'))
+
+        return jsonify({'message': 'Message sent', 'data': payload}), 201
+    except ChatError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to send message', 'error': str(e)}), 500
+
+# ------------------------------
+# Real-time Stream (Server-Sent Events)
+# ------------------------------
+
+def _publish_to_users(user_ids, event: str, data: dict):
+    # Delivery is best effort: the write already committed and clients resync on reconnect
+    for uid in set(user_ids):
+        try:
+            event_hub.publish(f'user:{uid}', {'event': event, 'data': data})
+        except Exception as e:
+            app.logger.warning('Failed to publish %s to user %s: %s', event, uid, e)
 
+def _publish_read_receipt(receipt):
+    """Tell both members how far the reader got; ``receipt`` comes from ``_advance_read_cursor``."""
+    if receipt is not None:
+        members, payload = receipt
+        _publish_to_users(members, 'chat_read', payload)
+
+# EventSource cannot send headers, so the stream alone also takes ?jwt=<token>; anywhere
+# else a token in the URL would end up in access logs, browser history and Referer headers
+STREAM_TOKEN_LOCATIONS = ['headers', 'query_string']
+
+@app.route('/api/stream', methods=['GET'])
+def event_stream():
+    verify_jwt_in_request(locations=STREAM_TOKEN_LOCATIONS)
+    user_id = int(get_jwt_identity())
+    subscription = event_hub.subscribe(f'user:{user_id}')
+    heartbeat = app.config['STREAM_HEARTBEAT_SECONDS']
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                item = subscription.get(timeout=heartbeat)
+                if item is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield format_sse(item['data'], item['event'])
+        finally:
+            subscription.close()
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# ------------------------------
+# Wallet & Transactions
+# ------------------------------
+
+def _serialize_wallet(wallet: Wallet):
+    return {
+        'id': wallet.id,
+        'user_id': wallet.user_id,
+        'balance': float(wallet.balance or 0),
+        'time_credits': wallet.time_credits or 0,
+        'updated_at': wallet.updated_at.isoformat() if wallet.updated_at else None
+    }
+
+def _serialize_transaction(tx: Transaction, users: dict):
+    sender = users.get(tx.from_user_id)
+    receiver = users.get(tx.to_user_id)
+    return {
+        'id': tx.id,
+        'amount': float(tx.amount or 0),
+        'time_credits': tx.time_credits or 0,
+        'status': tx.status,
+        'transaction_type': tx.transaction_type,
+        'created_at': tx.created_at.isoformat() if tx.created_at else None,
+        'completed_at': tx.completed_at.isoformat() if tx.completed_at else None,
+        'from_user_id': tx.from_user_id,
+        'to_user_id': tx.to_user_id,
+        'skill_id': tx.skill_id,
+        'sender': _serialize_user_basic(sender) if sender else None,
+        'receiver': _serialize_user_basic(receiver) if receiver else None
+    }
+
+def _load_users_by_id(user_ids):
+    if not user_ids:
+        return {}
+    return {u.id: u for u in User.query.filter(User.id.in_(set(user_ids)))}
+
+@app.route('/api/wallet', methods=['GET'])
+@jwt_required()
+def get_wallet():
+    try:
+        user_id = int(get_jwt_identity())
+        wallet = Wallet.query.filter_by(user_id=user_id).first()
+        if not wallet:
+            return jsonify({'message': 'Wallet not found'}), 404
+        return jsonify({'wallet': _serialize_wallet(wallet)}), 200
+    except Exception as e:
+        return jsonify({'message': 'Failed to get wallet', 'error': str(e)}), 500
+
+@app.route('/api/transactions', methods=['GET'])
+@jwt_required()
+def get_transactions():
+    try:
+        user_id = int(get_jwt_identity())
+        limit = clamp_page_size(request.args.get('per_page', type=int),
+                                app.config['DEFAULT_PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        query = Transaction.query.filter(or_(Transaction.from_user_id == user_id, Transaction.to_user_id == user_id))
+        transactions, next_cursor, prev_cursor = keyset_page(query, Transaction, request.args.get('cursor'), limit)
+        total, total_is_exact = approximate_count(query, Transaction, app.config['TOTAL_COUNT_CAP'])
+
+        users = _load_users_by_id([t.from_user_id for t in transactions] + [t.to_user_id for t in transactions])
+        return jsonify({
+            'transactions': [_serialize_transaction(t, users) for t in transactions],
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+            'total': total,
+            'total_is_exact': total_is_exact
+        }), 200
+    except InvalidCursor as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'message': 'Failed to get transactions', 'error': str(e)}), 500
+
+@app.route('/api/transactions', methods=['POST'])
+@jwt_required()
+def create_transaction():
+    try:
+        user_id = int(get_jwt_identity())
         data = request.get_json() or {}
-        content = (data.get('content') or '').strip()
-        if not content:
-            return jsonify({'message': 'Message content is required'}), 400
+        transaction_type = data.get('transaction_type', 'skill_exchange')
+        from_user_id = user_id
+
+        if transaction_type == 'recharge':
+            # Credits a wallet without a debit anywhere, so only an admin (crediting a
+            # payment received outside the app) may create one
+            if not _is_admin():
+                return jsonify({'message': 'Recharges can only be made by an administrator'}), 403
+            to_user_id = data.get('to_user_id', user_id)
+            if not isinstance(to_user_id, int):
+                return jsonify({'message': 'to_user_id must be an integer'}), 400
+            # from_user_id stays the admin: the ledger debits nobody for a recharge, and the
+            # Idempotency-Key belongs to the admin's keys rather than the credited user's.
+            # The credited user still sees it in their history as to_user_id.
+        elif transaction_type == 'withdrawal':
+            to_user_id = user_id
+        else:
+            to_user_id = data.get('to_user_id')
+            if not isinstance(to_user_id, int):
+                return jsonify({'message': 'to_user_id is required'}), 400
+
+        tx, created = ledger.transfer(
+            from_user_id=from_user_id,
+            to_user_id=to_user_id,
+            amount=data.get('amount', 0),
+            time_credits=data.get('time_credits', 0),
+            transaction_type=transaction_type,
+            skill_id=data.get('skill_id'),
+            idempotency_key=request.headers.get('Idempotency-Key') or data.get('idempotency_key'),
+            settle=data.get('settle', True) is not False
+        )
+        users = _load_users_by_id([tx.from_user_id, tx.to_user_id])
+        return jsonify({
+            'message': 'Transaction recorded' if created else 'Transaction already recorded',
+            'transaction': _serialize_transaction(tx, users)
+        }), 201 if created else 200
+    except InsufficientFunds as e:
+        return jsonify({'message': str(e)}), 409
+    except LedgerError as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Failed to create transaction', 'error': str(e)}), 500
+
+@app.cli.command('set-role')
+@click.argument('email')
+@click.argument('role', type=click.Choice(['user', 'admin']))
+def set_role_command(email, role):
+    """Give a user the ``user`` or ``admin`` role (e.g. the first admin)."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f'No user with email {email}')
+    user.role = role
+    db.session.commit()
+    _user_changed(user.id, claims_changed=True)
+    print(f'{user.username} is now {role}')
+
+@app.cli.command('settle-transactions')
+def settle_transactions_command():
+    """Settle pending transactions in batches until none are left."""
+    total_completed = total_failed = 0
+    while True:
+        completed, failed = ledger.settle_pending(batch_size=500)
+        if not completed and not failed:
+            break
+        total_completed += completed
+        total_failed += failed
+    print(f'Settled {total_completed} transactions, {total_failed} failed')
+
+# ------------------------------
+# Background Jobs
+# ------------------------------
+
+def _job_worker_process(threads: int):
+    jobs.start(app, threads)
+    jobs.join()
+
+@app.cli.command('run-jobs')
+@click.option('--processes', type=int, default=1, show_default=True, help='Worker processes.')
+@click.option('--threads', type=int, default=4, show_default=True, help='Worker threads per process.')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+def run_jobs_command(processes, threads, once):
+    """Run queued background jobs until interrupted."""
+    if once:
+        print(f'Ran {jobs.run_until_empty()} jobs')
+        return
+    if processes <= 1:
+        _job_worker_process(threads)
+        return
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_job_worker_process, args=(threads,), daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+@app.cli.command('retry-failed-jobs')
+@click.option('--name', help='Only jobs with this name.')
+def retry_failed_jobs_command(name):
+    """Queue jobs that used up their attempts again."""
+    print(f'Requeued {jobs.retry_failed(name)} jobs')
+
+# ------------------------------
+# User Stats & Reviews
+# ------------------------------
+
+_USER_STATS_COUNTERS = ('review_count', 'rating_sum', 'completed_exchanges', 'credits_earned', 'money_earned')
+
+def _bump_user_stats(user_id: int, **deltas):
+    """Add ``deltas`` to a user's counters inside the caller's transaction."""
+    values = {name: getattr(UserStats, name) + delta for name, delta in deltas.items()}
+    values['updated_at'] = datetime.utcnow()
+    statement = update(UserStats).where(UserStats.user_id == user_id).values(**values) \
+        .execution_options(synchronize_session=False)
+    if db.session.execute(statement).rowcount:
+        return
+    # First counter for this user; a concurrent writer may create the row first
+    try:
+        with db.session.begin_nested():
+            db.session.add(UserStats(user_id=user_id, **{name: deltas.get(name, 0) for name in _USER_STATS_COUNTERS}))
+    except IntegrityError:
+        db.session.execute(statement)
+    _reputations_changed(db.session, [user_id])
+
+def _reputations_changed(session, user_ids):
+    """Invalidate the cached listing responses that embed these users' reputations once ``session`` commits.
+
+    The tags are looked up now: the commit hook cannot run queries.
+    """
+    rows = session.query(SkillListing.id, SkillListing.category) \
+        .filter(SkillListing.provider_id.in_(user_ids), SkillListing.is_active == True).all()
+    if not rows:
+        return
+    tags = session.info.setdefault('cache_tags', set())
+    tags.add('skills:all')
+    tags.update(f'skills:category:{category}' for _, category in rows)
+    tags.update(f'skill:{skill_id}' for skill_id, _ in rows)
+
+def _invalidate_committed_tags(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        response_cache.invalidate(*sorted(tags))
+
+event.listen(Session, 'after_commit', _invalidate_committed_tags)
+event.listen(Session, 'after_rollback', lambda session: session.info.pop('cache_tags', None))
+
+def _record_completed_transactions(transactions):
+    deltas = {}
+    for tx in transactions:
+        if tx.transaction_type != 'skill_exchange':
+            continue
+        for uid in (tx.from_user_id, tx.to_user_id):
+            deltas.setdefault(uid, {'completed_exchanges': 0, 'credits_earned': 0, 'money_earned': Decimal('0.00')})
+            deltas[uid]['completed_exchanges'] += 1
+        deltas[tx.to_user_id]['credits_earned'] += tx.time_credits or 0
+        deltas[tx.to_user_id]['money_earned'] += Decimal(tx.amount or 0)
+    for uid in sorted(deltas):
+        _bump_user_stats(uid, **deltas[uid])
+
+    exchanged = Counter(tx.skill_id for tx in transactions
+                        if tx.transaction_type == 'skill_exchange' and tx.skill_id)
+    if exchanged:
+        skills = SkillListing.query.filter(SkillListing.id.in_(exchanged)) \
+            .with_entities(SkillListing.id, SkillListing.category, SkillListing.location)
+        for skill_id, category, location in skills:
+            _record_trending(category, location, 'exchange', times=exchanged[skill_id])
+
+ledger.on_completed = _record_completed_transactions
+
+@jobs.task('review_stats')
+def _apply_review_stats(review_id: int):
+    """Count a review in its user's stats exactly once, however often the job runs."""
+    # Claims the review before touching user_stats, the same lock order as rebuild-user-stats
+    claimed = db.session.execute(
+        update(Review).where(Review.id == review_id, Review.stats_applied == False)
+        .values(stats_applied=True).execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        return  # already counted, or the review is gone
+    reviewed_id, rating = db.session.query(Review.reviewed_id, Review.rating).filter(Review.id == review_id).one()
+    _bump_user_stats(reviewed_id, review_count=1, rating_sum=rating)
+
+def _serialize_reputation(stats):
+    if stats is None:
+        return {'average_rating': None, 'review_count': 0, 'completed_exchanges': 0}
+    return {
+        'average_rating': round(stats.rating_sum / stats.review_count, 2) if stats.review_count else None,
+        'review_count': stats.review_count,
+        'completed_exchanges': stats.completed_exchanges
+    }
+
+def _load_reputations(user_ids, session=None):
+    """Reputation for many users with one primary-key lookup."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    found = {s.user_id: s for s in (session or db.session).query(UserStats).filter(UserStats.user_id.in_(user_ids))}
+    return {uid: _serialize_reputation(found.get(uid)) for uid in user_ids}
+
+@app.route('/api/user/stats', methods=['GET'])
+@jwt_required()
+def get_user_stats():
+    try:
+        user_id = int(get_jwt_identity())
+        stats = UserStats.query.get(user_id)
+        result = _serialize_reputation(stats)
+        result.update({
+            'user_id': user_id,
+            'credits_earned': stats.credits_earned if stats else 0,
+            'money_earned': float(stats.money_earned) if stats else 0.0
+        })
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'message': 'Failed to get user stats', 'error': str(e)}), 500
 
-        receiver_id = chat.user1_id if user_id == chat.user2_id else chat.user2_id
+@app.route('/api/reviews', methods=['POST'])
+@jwt_required()
+def create_review():
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json() or {}
+        reviewed_id = data.get('reviewed_id')
+        rating = data.get('rating')
 
-        msg = Message()
-        msg.chat_id = chat.id
-        msg.sender_id = user_id
-        msg.receiver_id = receiver_id
-        msg.content = content
+        if not isinstance(reviewed_id, int):
+            return jsonify({'message': 'reviewed_id is required'}), 400
+        if not isinstance(rating, int) or not 1 <= rating <= 5:
+            return jsonify({'message': 'rating must be an integer from 1 to 5'}), 400
+        if reviewed_id == user_id:
+            return jsonify({'message': 'Cannot review yourself'}), 400
+        if identity_cache.get(reviewed_id) is None:
+            return jsonify({'message': 'User not found'}), 404
+        if Review.query.filter_by(reviewer_id=user_id, reviewed_id=reviewed_id).first() is not None:
+            return jsonify({'message': 'You have already reviewed this user'}), 409
 
-        db.session.add(msg)
+        review = Review()
+        review.reviewer_id = user_id
+        review.reviewed_id = reviewed_id
+        review.rating = rating
+        review.comment = data.get('comment')
+        review.skill_id = data.get('skill_id')
+        review.transaction_id = data.get('transaction_id')
+        db.session.add(review)
+        db.session.flush()
+        # Off the request path: concurrent reviews of one user would all wait on its stats row
+        jobs.enqueue(db.session, 'review_stats', {'review_id': review.id})
         db.session.commit()
 
-        return jsonify({'message': 'Message sent', 'data': {
-            'id': msg.id,
-            'content': msg.content,
-            'created_at': msg.created_at.isoformat(),
-            'chat_id': msg.chat_id,
-            'sender_id': msg.sender_id,
-            'receiver_id': msg.receiver_id
-        }}), 201
+        return jsonify({'message': 'Review created', 'review': review_schema.dump(review)}), 201
+    except IntegrityError:
+        # A concurrent request from the same reviewer won the unique index
+        db.session.rollback()
+        return jsonify({'message': 'You have already reviewed this user'}), 409
     except Exception as e:
         db.session.rollback()
-        return jsonify({'message': 'Failed to send message', 'error': str(e)}), 500
+        return jsonify({'message': 'Failed to create review', 'error': str(e)}), 500
+
+@app.route('/api/users/<int:user_id>/reviews', methods=['GET'])
+def get_user_reviews(user_id: int):
+    try:
+        limit = clamp_page_size(request.args.get('per_page', type=int),
+                                app.config['DEFAULT_PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+        reviews, next_cursor, prev_cursor = keyset_page(Review.query.filter(Review.reviewed_id == user_id),
+                                                       Review, request.args.get('cursor'), limit)
+        reviewers = _load_users_by_id([r.reviewer_id for r in reviews])
+        result = []
+        for review in reviews:
+            item = review_schema.dump(review)
+            reviewer = reviewers.get(review.reviewer_id)
+            # Public endpoint: no email
+            item['reviewer'] = {'id': reviewer.id, 'username': reviewer.username} if reviewer else None
+            result.append(item)
+        return jsonify({
+            'reviews': result,
+            'stats': _serialize_reputation(UserStats.query.get(user_id)),
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
+        }), 200
+    except InvalidCursor as e:
+        return jsonify({'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'message': 'Failed to get reviews', 'error': str(e)}), 500
+
+def _user_stats_totals(session, user_ids):
+    """``{user_id: counters}`` recomputed from applied reviews and completed exchanges for ``user_ids``."""
+    totals = {}
+
+    def row(uid):
+        return totals.setdefault(uid, {'user_id': uid, 'review_count': 0, 'rating_sum': 0,
+                                       'completed_exchanges': 0, 'credits_earned': 0,
+                                       'money_earned': Decimal('0.00')})
+
+    for uid, count, rating_sum in session.query(Review.reviewed_id, func.count(Review.id), func.sum(Review.rating)) \
+            .filter(Review.reviewed_id.in_(user_ids), Review.stats_applied == True).group_by(Review.reviewed_id):
+        row(uid).update(review_count=count, rating_sum=int(rating_sum or 0))
+
+    exchanges = session.query(Transaction).filter(Transaction.status == 'completed',
+                                                  Transaction.transaction_type == 'skill_exchange')
+    for uid, count, credits, money in exchanges.filter(Transaction.to_user_id.in_(user_ids)) \
+            .with_entities(Transaction.to_user_id, func.count(Transaction.id),
+                           func.sum(Transaction.time_credits), func.sum(Transaction.amount)) \
+            .group_by(Transaction.to_user_id):
+        entry = row(uid)
+        entry['completed_exchanges'] += count
+        entry['credits_earned'] = int(credits or 0)
+        entry['money_earned'] = Decimal(money or 0)
+    for uid, count in exchanges.filter(Transaction.from_user_id.in_(user_ids)) \
+            .with_entities(Transaction.from_user_id, func.count(Transaction.id)) \
+            .group_by(Transaction.from_user_id):
+        row(uid)['completed_exchanges'] += count
+    return totals
+
+def _rebuild_user_stats_batch(session, user_ids):
+    """Recompute the counters of ``user_ids``; None when a concurrent writer created a row first (retry)."""
+    existing = {uid for (uid,) in session.query(UserStats.user_id).filter(UserStats.user_id.in_(user_ids))}
+    for uid in sorted(set(_user_stats_totals(session, user_ids)) - existing):
+        try:
+            with session.begin_nested():
+                session.add(UserStats(user_id=uid, **{name: 0 for name in _USER_STATS_COUNTERS}))
+        except IntegrityError:
+            pass  # a concurrent writer created it
+    session.commit()
+
+    # Reviews, then stats rows: the review_stats job takes its locks in the same order. Pending jobs
+    # for the reviews marked here find them applied and do nothing, so nothing is counted twice.
+    session.execute(update(Review).where(Review.reviewed_id.in_(user_ids), Review.stats_applied == False)
+                    .values(stats_applied=True).execution_options(synchronize_session=False))
+    # Locking reads first: on MySQL the consistent snapshot for the counts starts after them
+    locked = {uid for (uid,) in session.query(UserStats.user_id).filter(UserStats.user_id.in_(user_ids))
+              .order_by(UserStats.user_id).with_for_update()}
+    totals = _user_stats_totals(session, user_ids)
+    now = datetime.utcnow()
+    try:
+        # Users whose first review or exchange committed since the rows above were created
+        with session.begin_nested():
+            session.add_all([UserStats(**totals[uid], updated_at=now) for uid in sorted(totals.keys() - locked)])
+    except IntegrityError:
+        session.rollback()
+        return None
+    session.bulk_update_mappings(UserStats, [
+        dict(totals.get(uid) or {'user_id': uid, **{name: 0 for name in _USER_STATS_COUNTERS}}, updated_at=now)
+        for uid in sorted(locked)
+    ])
+    _reputations_changed(session, user_ids)
+    session.commit()
+    return len(totals)
+
+def _rebuild_user_stats(session, batch_size: int = 1000) -> int:
+    """Recompute user_stats in batches of users while reviews and exchanges keep bumping them.
+
+    Each batch first creates the rows it is missing, then locks the batch's
+    rows and only then counts: a writer that bumped a row first has
+    committed before the count reads, and one that comes later waits for
+    the lock and adds its delta on top. Returns the number of users with counters.
+    """
+    rebuilt, last_id = 0, 0
+    while True:
+        user_ids = [uid for (uid,) in session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(batch_size)]
+        if not user_ids:
+            return rebuilt
+        last_id = user_ids[-1]
+        counted = None
+        while counted is None:
+            counted = _rebuild_user_stats_batch(session, user_ids)
+        rebuilt += counted
+
+@app.cli.command('rebuild-user-stats')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def rebuild_user_stats_command(batch_size):
+    """Recompute user_stats from reviews and completed transactions (safe while the app is serving)."""
+    print(f'Rebuilt stats for {_rebuild_user_stats(db.session, batch_size)} users')
+
+def _rebuild_chat_counters(session):
+    """Recompute each chat's last message and received counters, and each cursor's read count, from messages."""
+    for statement in chat_counter_updates(db.metadata.tables):
+        session.execute(statement)
+    session.commit()
+
+@app.cli.command('rebuild-chat-counters')
+def rebuild_chat_counters_command():
+    """Recompute chat unread counters and last-message pointers (after upgrading or bulk-loading messages)."""
+    _rebuild_chat_counters(db.session)
+    print(f'Rebuilt counters for {Chat.query.count()} chats')
+
+# ------------------------------
+# Recommendations
+# ------------------------------
+
+def _active_skills_by_score(query, skill_column, score_column, exclude_user_id: int, limit: int):
+    """Look up precomputed rows and return the listings that are still active, best first."""
+    rows = query \
+        .join(SkillListing, SkillListing.id == skill_column) \
+        .filter(SkillListing.is_active == True) \
+        .order_by(score_column.desc()) \
+        .with_entities(*skill_serializer.entities)
+    if exclude_user_id is not None:
+        rows = rows.filter(SkillListing.provider_id != exclude_user_id)
+    return skill_serializer.dump_rows(rows.limit(limit))
+
+@app.route('/api/skills/suggestions', methods=['GET'])
+@jwt_required()
+def get_skill_suggestions():
+    try:
+        user_id = int(get_jwt_identity())
+        limit = clamp_page_size(request.args.get('limit', type=int), 6, 50)
+        suggestions = _active_skills_by_score(UserRecommendation.query.filter(UserRecommendation.user_id == user_id),
+                                              UserRecommendation.skill_id, UserRecommendation.score, user_id, limit)
+        if not suggestions:
+            # Not in the last rebuild yet (new user, no activity): newest listings
+            rows = SkillListing.query \
+                .filter(SkillListing.is_active == True, SkillListing.provider_id != user_id) \
+                .order_by(SkillListing.created_at.desc()) \
+                .with_entities(*skill_serializer.entities) \
+                .limit(limit)
+            suggestions = skill_serializer.dump_rows(rows)
+        return fast_jsonify({'suggestions': suggestions}), 200
+    except Exception as e:
+        return jsonify({'message': 'Failed to get suggestions', 'error': str(e)}), 500
+
+@app.route('/api/skills/<int:skill_id>/similar', methods=['GET'])
+@response_cache.cached(ttl=300, tags=lambda skill_id: [f'skill:{skill_id}', 'recommendations'])
+def get_similar_skills(skill_id: int):
+    try:
+        limit = clamp_page_size(request.args.get('limit', type=int), 6, 50)
+        similar = _active_skills_by_score(SkillNeighbor.query.filter(SkillNeighbor.skill_id == skill_id),
+                                          SkillNeighbor.neighbor_id, SkillNeighbor.score, None, limit)
+        return fast_jsonify({'similar': similar}), 200
+    except Exception as e:
+        return jsonify({'message': 'Failed to get similar skills', 'error': str(e)}), 500
+
+def _bulk_replace(model, columns, arrays, chunk_size: int = 10000):
+    model.query.delete()
+    for start in range(0, len(arrays[0]), chunk_size):
+        chunk = [a[start:start + chunk_size].tolist() for a in arrays]
+        db.session.bulk_insert_mappings(model, [dict(zip(columns, values)) for values in zip(*chunk)])
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recompute skill_neighbors and user_recommendations from listings, chats, transactions and reviews."""
+    listings = SkillListing.query \
+        .filter(SkillListing.is_active == True) \
+        .with_entities(SkillListing.id, SkillListing.title, SkillListing.description,
+                       SkillListing.category, SkillListing.provider_id) \
+        .order_by(SkillListing.id) \
+        .yield_per(10000)
+
+    def interactions():
+        skill_chats = Chat.query.filter(Chat.skill_id.isnot(None))
+        for user1_id, user2_id, skill_id in skill_chats.with_entities(Chat.user1_id, Chat.user2_id, Chat.skill_id) \
+                .yield_per(10000):
+            yield user1_id, skill_id
+            yield user2_id, skill_id
+        skill_transactions = Transaction.query.filter(Transaction.skill_id.isnot(None),
+                                                      Transaction.status == 'completed')
+        for from_user_id, to_user_id, skill_id in skill_transactions \
+                .with_entities(Transaction.from_user_id, Transaction.to_user_id, Transaction.skill_id) \
+                .yield_per(10000):
+            yield from_user_id, skill_id
+            yield to_user_id, skill_id
+        yield from Review.query.filter(Review.skill_id.isnot(None)) \
+            .with_entities(Review.reviewer_id, Review.skill_id).yield_per(10000)
+
+    builder = RecommendationBuilder(dim=app.config['RECOMMENDATION_VECTOR_DIM'],
+                                    neighbors=app.config['RECOMMENDATION_NEIGHBORS'],
+                                    per_user=app.config['RECOMMENDATIONS_PER_USER'])
+    result = builder.build(listings, interactions())
+
+    # One transaction: readers keep seeing the previous tables until commit
+    _bulk_replace(SkillNeighbor, ('skill_id', 'neighbor_id', 'score'), result.skill_neighbors)
+    _bulk_replace(UserRecommendation, ('user_id', 'skill_id', 'score'), result.user_recommendations)
+    db.session.commit()
+    response_cache.invalidate('recommendations')
+
+    timings = ', '.join(f'{name}={seconds:.2f}' for name, seconds in result.timings.items())
+    print(f'Stored {len(result.skill_neighbors[0])} skill neighbors and '
+          f'{len(result.user_recommendations[0])} user recommendations ({timings})')
+
+@app.cli.command('rebuild-trending')
+def rebuild_trending_command():
+    """Recompute trending scores from listings, chats and completed exchanges (e.g. after a fresh deploy)."""
+    rate = math.log(2) / (app.config['TRENDING_HALF_LIFE_HOURS'] * 3600)
+    now = datetime.utcnow()
+    totals = {'category': Counter(), 'location': Counter()}
+
+    def add(category, location, event, at):
+        weight = TRENDING_WEIGHTS[event] * math.exp(-rate * max((now - at).total_seconds(), 0.0)) if at else 0.0
+        if category:
+            totals['category'][category.strip()] += weight
+        if location and location.strip():
+            totals['location'][location.strip()] += weight
+
+    columns = (SkillListing.category, SkillListing.location)
+    for category, location, at in db.session.query(*columns, SkillListing.created_at).yield_per(10000):
+        add(category, location, 'listing', at)
+    for category, location, at in db.session.query(*columns, Chat.created_at) \
+            .join(Chat, Chat.skill_id == SkillListing.id).yield_per(10000):
+        add(category, location, 'chat', at)
+    for category, location, at in db.session.query(*columns, Transaction.completed_at) \
+            .join(Transaction, Transaction.skill_id == SkillListing.id) \
+            .filter(Transaction.status == 'completed', Transaction.transaction_type == 'skill_exchange') \
+            .yield_per(10000):
+        add(category, location, 'exchange', at)
+
+    trending.replace_all(totals)
+    print(f"Stored {len(totals['category'])} category and {len(totals['location'])} location scores")
+
+# ------------------------------
+# Bulk Import / Export
+# ------------------------------
+
+def _prepare_skill_chunk(valid):
+    """Resolve providers for a chunk of listings with two IN queries."""
+    refs = {mapping['provider_ref'] for _, mapping in valid if 'provider_ref' in mapping}
+    ids = {mapping['provider_id'] for _, mapping in valid if 'provider_id' in mapping}
+    by_ref, known_ids = {}, set()
+    if refs:
+        lowered = refs | {ref.lower() for ref in refs}
+        for uid, username, email in User.query \
+                .filter(or_(User.username.in_(refs), User.email.in_(lowered))) \
+                .with_entities(User.id, User.username, User.email):
+            by_ref[username] = uid
+            by_ref[email.lower()] = uid
+    if ids:
+        known_ids = {uid for (uid,) in User.query.filter(User.id.in_(ids)).with_entities(User.id)}
+
+    kept, errors = [], []
+    for line, mapping in valid:
+        if 'provider_ref' in mapping:
+            ref = mapping.pop('provider_ref')
+            provider_id = by_ref.get(ref) or by_ref.get(ref.lower())
+            if provider_id is None:
+                errors.append((line, f'Unknown provider {ref}'))
+                continue
+            mapping['provider_id'] = provider_id
+        elif mapping['provider_id'] not in known_ids:
+            errors.append((line, f"Unknown provider_id {mapping['provider_id']}"))
+            continue
+        kept.append((line, mapping))
+    return kept, errors
+
+def _prepare_user_chunk(valid):
+    """Reject duplicates (within the chunk and against the DB) and hash plain passwords in parallel."""
+    usernames = {mapping['username'] for _, mapping in valid}
+    emails = {mapping['email'] for _, mapping in valid}
+    phones = {mapping['phone'] for _, mapping in valid if mapping['phone']}
+    taken = set()
+    for username, email, phone in User.query \
+            .filter(or_(User.username.in_(usernames), User.email.in_(emails), User.phone.in_(phones))) \
+            .with_entities(User.username, User.email, User.phone):
+        taken.update((('username', username), ('email', email.lower()), ('phone', phone)))
+
+    kept, errors = [], []
+    for line, mapping in valid:
+        unique = [(field, mapping[field]) for field in ('username', 'email', 'phone') if mapping[field]]
+        duplicate = next((value for value in unique if value in taken), None)
+        if duplicate:
+            errors.append((line, f'{duplicate[0]} {duplicate[1]} already exists'))
+            continue
+        taken.update(unique)
+        kept.append((line, mapping))
+
+    def hash_row(item):
+        line, mapping = item
+        if 'password' in mapping:
+            try:
+                mapping['password_hash'] = password_hasher.hash(mapping.pop('password'))
+            except HasherBusy as e:
+                return line, str(e)
+        return line, None
+
+    # Keep every hashing worker busy; the hasher's own queue bounds the concurrency
+    with ThreadPoolExecutor(max_workers=max(password_hasher.workers, 1)) as pool:
+        failed = {line: error for line, error in pool.map(hash_row, kept) if error}
+    errors.extend(failed.items())
+    return [(line, mapping) for line, mapping in kept if line not in failed], errors
+
+def _create_imported_wallets(kept):
+    usernames = [mapping['username'] for _, mapping in kept]
+    user_ids = [uid for (uid,) in User.query.filter(User.username.in_(usernames)).with_entities(User.id)]
+    db.session.bulk_insert_mappings(Wallet, [{'user_id': uid} for uid in user_ids])
+
+def _imported_listings(kept):
+    # The search index picks the rows up on its next sync; cached pages and
+    # popular lists must go now, as after create_skill
+    places = Counter((mapping['category'], mapping['location']) for _, mapping in kept if mapping['is_active'])
+    if not places:
+        return
+    for (category, location), times in places.items():
+        _record_trending(category, location, 'listing', times=times)
+    categories = sorted({f'skills:category:{category}' for category, _ in places})
+    response_cache.invalidate('skills:all', 'skills:first-page', 'skills:search', 'categories', 'locations',
+                              *categories)
+
+def _importer(kind: str, chunk_size: int = None) -> BulkImporter:
+    chunk_size = chunk_size or app.config['BULK_IMPORT_CHUNK_SIZE']
+    if kind == 'skills':
+        return BulkImporter(db, SkillListing, validate_skill_row, _prepare_skill_chunk,
+                            after_commit=_imported_listings, chunk_size=chunk_size)
+    return BulkImporter(db, User, validate_user_row, _prepare_user_chunk, _create_imported_wallets,
+                        chunk_size=chunk_size)
+
+def _run_import(kind: str, rows, chunk_size: int = None) -> dict:
+    return _importer(kind, chunk_size).run(rows)
+
+def _export_records(kind: str):
+    serializer = skill_serializer if kind == 'skills' else user_serializer
+    rows = iter_keyset(db.session.query(*serializer.entities), serializer.entities[0])
+    return serializer.keys, (serializer.dump_row(row) for row in rows)
+
+@app.route('/api/admin/import/<any(skills, users):kind>', methods=['POST'])
+@jwt_required()
+def bulk_import(kind: str):
+    try:
+        if not _is_admin():
+            return jsonify({'message': 'Admin access required'}), 403
+        fmt = request.args.get('format') or detect_format(content_type=request.content_type)
+        if fmt not in FORMATS:
+            return jsonify({'message': f"format must be one of {', '.join(FORMATS)}"}), 400
+        # Read the body as a stream: rows are validated and inserted chunk by chunk
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        report = _run_import(kind, read_rows(stream, fmt))
+        return jsonify({'format': fmt, **report}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Import failed', 'error': str(e)}), 500
+
+@app.route('/api/admin/export/<any(skills, users):kind>', methods=['GET'])
+@jwt_required()
+def bulk_export(kind: str):
+    if not _is_admin():
+        return jsonify({'message': 'Admin access required'}), 403
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return jsonify({'message': f"format must be one of {', '.join(FORMATS)}"}), 400
+    fields, records = _export_records(kind)
+    response = Response(stream_with_context(export_lines(records, fmt, fields, dumps)),
+                        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return response
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(['skills', 'users']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults to the file extension.')
+@click.option('--chunk-size', type=int, help='Rows per transaction.')
+def import_data_command(kind, path, fmt, chunk_size):
+    """Bulk-load listings or users from an NDJSON or CSV file."""
+    with open(path, encoding='utf-8', newline='') as stream:
+        report = _run_import(kind, read_rows(stream, fmt or detect_format(path)), chunk_size)
+    print(json.dumps(report, indent=2))
+
+@app.cli.command('export-data')
+@click.argument('kind', type=click.Choice(['skills', 'users']))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson')
+@click.option('--output', type=click.Path(dir_okay=False), help='Defaults to stdout.')
+def export_data_command(kind, fmt, output):
+    """Stream listings or users (without password hashes) as NDJSON or CSV."""
+    fields, records = _export_records(kind)
+    stream = open(output, 'wb') if output else click.get_binary_stream('stdout')
+    try:
+        for chunk in export_lines(records, fmt, fields, dumps):
+            stream.write(chunk)
+    finally:
+        if output:
+            stream.close()
+
+# ------------------------------
+# Schema Migrations
+# ------------------------------
+
+MIGRATIONS = app_migrations(db.metadata)
+
+def _migrator():
+    return Migrator(db.engine, MIGRATIONS)
+
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, help='Stop after this version.')
+@click.option('--stamp', type=int, help='Record migrations up to this version as applied without running them '
+                                        '(databases created from database_schema.sql).')
+@click.option('--status', is_flag=True, help='List migrations and whether they have been applied.')
+def migrate_command(target, stamp, status):
+    """Bring the database schema up to date."""
+    migrator = _migrator()
+    if status:
+        applied = migrator.applied()
+        for migration in migrator.migrations:
+            state = f'applied {applied[migration.version]:%Y-%m-%d %H:%M}' if migration.version in applied \
+                else 'pending'
+            print(f'{migration.version:>4}  {state:<22}  {migration.description}')
+        return
+    if stamp is not None:
+        migrator.stamp(stamp)
+        print(f'Stamped migrations up to {stamp}')
+        return
+    done = migrator.upgrade(target)
+    for migration in done:
+        print(f'Applied {migration.version}: {migration.description}')
+    print(f'Applied {len(done)} migrations' if done else 'Schema is up to date')
+
+@app.cli.command('check-schema')
+@click.option('--sql-file', type=click.Path(exists=True, dir_okay=False),
+              default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database_schema.sql'),
+              show_default=True)
+@click.option('--database/--no-database', default=True, help='Also compare with the connected database.')
+def check_schema_command(sql_file, database):
+    """Compare the models' columns and indexes with database_schema.sql and the database; exits 1 on any difference."""
+    with open(sql_file, encoding='utf-8') as stream:
+        text = stream.read()
+    where = os.path.basename(sql_file)
+    problems = column_drift(model_columns(db.metadata), sql_file_columns(text), where)
+    problems += index_drift(model_indexes(db.metadata), sql_file_indexes(text), where)
+    if database:
+        expected = model_indexes(db.metadata, db.engine.dialect.name)
+        table_names = [table.name for table in db.metadata.sorted_tables]
+        with db.engine.connect() as conn:
+            # SQLite keeps the type a column was created with and enforces neither lengths nor decimals
+            problems += column_drift(model_columns(db.metadata), database_columns(conn, table_names), 'database',
+                                     types=db.engine.dialect.name != 'sqlite')
+            actual = database_indexes(conn, table_names)
+        # Extra indexes in the database may be ones MySQL made for foreign keys; only superseded ones are reported
+        superseded = {name for names in SUPERSEDED_INDEXES.values() for name in names}
+        problems += index_drift(expected, actual, 'database', extra=False)
+        problems += [f'database: superseded index {name} is still present (run `flask migrate`)'
+                     for name in sorted(superseded & actual.keys())]
+        pending = _migrator().pending()
+        if pending:
+            problems.append(f'database: {len(pending)} pending migrations (run `flask migrate`)')
+    for problem in problems:
+        print(problem)
+    if problems:
+        raise SystemExit(1)
+    print('Models, schema file and database agree')
+
+# Read-only routes replayed by advise-indexes, as (label, path); {user} is the sample user
+_ADVISED_ROUTES = (
+    ('skills feed', '/api/skills'),
+    ('skills by category', '/api/skills?category={category}'),
+    ('skills search', '/api/skills?search={word}'),
+    ('own skills', '/api/user/skills'),
+    ('chat inbox', '/api/chats'),
+    ('unread counts', '/api/chats/unread'),
+    ('transactions', '/api/transactions'),
+    ('user reviews', '/api/users/{user}/reviews'),
+)
+
+@app.cli.command('advise-indexes')
+@click.option('--user-id', type=int, help='Replay as this user; defaults to the one with the most chats.')
+@click.option('--ignore', multiple=True, help='Tables whose full scans are expected (small lookup tables).')
+@click.option('--fail', is_flag=True, help='Exit 1 if any query scans a table or sorts without an index.')
+def advise_indexes_command(user_id, ignore, fail):
+    """EXPLAIN the SQL the main read routes generate and flag full scans and unindexed sorts."""
+    if user_id is None:
+        user_id = db.session.execute(
+            select(Chat.user1_id).group_by(Chat.user1_id).order_by(func.count().desc()).limit(1)).scalar() \
+            or db.session.execute(select(func.min(User.id))).scalar()
+    user = db.session.get(User, user_id) if user_id is not None else None
+    if user is None:
+        raise click.ClickException('No user to replay the routes as')
+    skill = SkillListing.query.filter_by(is_active=True).order_by(SkillListing.id.desc()).first()
+    values = {'user': user_id, 'category': skill.category if skill else 'none',
+              'word': (skill.title.split() or ['none'])[0] if skill else 'none'}
+    routes = list(_ADVISED_ROUTES)
+    chat = Chat.query.filter(or_(Chat.user1_id == user_id, Chat.user2_id == user_id)) \
+        .order_by(Chat.id.desc()).first()
+    if chat is not None:
+        # after_id past the newest message: the same queries, without moving the user's read cursor
+        routes.append(('chat messages', f'/api/chats/{chat.id}/messages?after_id={chat.last_message_id or 0}'))
+
+    headers = {'Authorization': f'Bearer {_issue_token(user)}'}
+    advisor = IndexAdvisor(db.engine)
+    with app.test_client() as client:
+        for label, path in routes:
+            with advisor.capture(label):
+                status = client.get(path.format(**values), headers=headers).status_code
+            if status >= 400:
+                print(f'{label}: {path} returned {status}, plans may be incomplete')
+
+    flagged = 0
+    for label, statement, lines, problems in advisor.report(ignore_tables=set(ignore)):
+        if not problems:
+            continue
+        flagged += 1
+        print(f'[{label}] {"; ".join(problems)}')
+        print(f'    {statement[:300]}')
+        for line in lines:
+            print(f'      {line}')
+    print(f'{flagged} of {sum(map(len, advisor.captured.values()))} queries need attention')
+    if fail and flagged:
+        raise SystemExit(1)
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        _migrator().upgrade()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
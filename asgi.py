@@ -0,0 +1,342 @@
+"""ASGI entry point: chat, search and the event stream on an async database driver.
+
+    uvicorn asgi:application --workers 4
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker -w 4
+
+The chat endpoints, ``POST /api/skills/search`` and ``GET /api/stream``
+are served by coroutines: their queries run on an asyncio driver (aiomysql,
+aiosqlite, asyncpg), so a request waiting on the database or an idle stream
+holds no thread. Every other route goes to the Flask app on a thread pool of
+``ASGI_WSGI_THREADS``. Both share the same query and serialization code in
+``app_simple``; coroutines run it through ``AsyncSession.run_sync``.
+
+Needs ``starlette``, ``a2wsgi``, ``uvicorn``, ``sqlalchemy[asyncio]`` and the
+driver for the database (all pinned in requirements-optional.txt). The async engine uses ``ASYNC_DATABASE_URL``, or
+``DATABASE_URL`` with its driver swapped. Async reads always use the primary.
+"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from flask_jwt_extended import decode_token
+from jwt import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+
+import app_simple as api
+from compression import matching_etag
+from db_routing import async_database_url, async_engine_options
+from geo import InvalidLocation
+from pagination import InvalidCursor, clamp_page_size
+from pubsub import format_sse
+from rate_limit import MemoryBuckets
+from serializers import dumps
+
+config = api.app.config
+_async_url = config['ASYNC_DATABASE_URL'] or async_database_url(config['SQLALCHEMY_DATABASE_URI'])
+async_engine = create_async_engine(_async_url, **async_engine_options(_async_url, **api._pool_settings))
+api.pool_metrics.instrument('async', async_engine.sync_engine)
+# Rows are serialized after commit; keep their loaded attributes instead of refreshing them
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+# ------------------------------
+# Helpers
+# ------------------------------
+
+class AuthError(Exception):
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def _json(payload, status: int = 200, headers=None) -> Response:
+    return Response(dumps(payload), status_code=status, media_type='application/json', headers=headers)
+
+
+def _compressed_json(request, payload, headers=None) -> Response:
+    """A 200 JSON response encoded as the Flask routes' would be (same threshold, encodings and ETag suffix)."""
+    headers = dict(headers or {})
+    encoding, body = api.compressor.encode(dumps(payload).encode(), request.headers.get('accept-encoding'))
+    if api.compressor.enabled:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+        if 'ETag' in headers:
+            headers['ETag'] = quote_etag(f"{headers['ETag']}-{encoding}")
+    elif 'ETag' in headers:
+        headers['ETag'] = quote_etag(headers['ETag'])
+    return Response(body, media_type='application/json', headers=headers)
+
+
+async def _json_body(request) -> dict:
+    try:
+        data = json.loads(await request.body() or b'{}')
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _int_param(params, name: str):
+    try:
+        return int(params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+async def _authenticate(request, locations=('headers',)) -> dict:
+    """Claims of the request's access token, with the same checks and errors as ``@jwt_required``."""
+    header = request.headers.get('authorization')
+    if header:
+        scheme, _, token = header.partition(' ')
+        if scheme != 'Bearer' or not token:
+            raise AuthError("Bad Authorization header. Expected 'Authorization: Bearer <JWT>'", 422)
+    elif 'query_string' in locations and request.query_params.get(config['JWT_QUERY_STRING_NAME']):
+        token = request.query_params[config['JWT_QUERY_STRING_NAME']]
+    else:
+        raise AuthError('Missing Authorization Header', 401)
+    try:
+        with api.app.app_context():
+            claims = decode_token(token)
+    except ExpiredSignatureError:
+        raise AuthError('Token has expired', 401)
+    except InvalidTokenError as e:
+        raise AuthError(str(e), 422)
+    if claims.get('type') != 'access':
+        raise AuthError('Only non-refresh tokens are allowed', 422)
+    revoked = claims.get('act') is False
+    # The filter answers in memory; only possible hits query the table, off the event loop
+    if not revoked and api.revocations.might_be_revoked(claims):
+        revoked = await run_in_threadpool(api.revocations.is_revoked, claims)
+    if revoked:
+        raise AuthError('Token has been revoked', 401)
+    return claims
+
+
+async def _rate_limited(request, name: str, user=None):
+    """A 429 response when the caller is over the limit ``name`` (keyed like ``RateLimiter.client_key``), else None."""
+    limiter = api.rate_limiter
+    if not limiter.enabled or name not in limiter.limits:
+        return None
+    key = f'user:{user}' if user is not None else f'ip:{request.client.host if request.client else None}'
+    if isinstance(limiter.store, MemoryBuckets):
+        retry_after = limiter.hit(name, key)
+    else:
+        retry_after = await run_in_threadpool(limiter.hit, name, key)
+    if not retry_after:
+        return None
+    return _json({'message': f'Too many requests, retry in {retry_after} seconds'}, 429,
+                 headers={'Retry-After': str(retry_after)})
+
+
+def endpoint(route: str):
+    """Turn auth errors into responses and record latency under the Flask route's metric labels."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request):
+            started = time.perf_counter()
+            try:
+                response = await handler(request)
+            except AuthError as e:
+                response = _json({config['JWT_ERROR_MESSAGE_KEY']: str(e)}, e.status)
+            api.profiler.latency.observe((request.method, route, str(response.status_code)),
+                                         time.perf_counter() - started)
+            return response
+        return wrapper
+    return decorator
+
+
+# ------------------------------
+# Async routes
+# ------------------------------
+
+@endpoint('/api/chats')
+async def list_chats(request):
+    user_id = int((await _authenticate(request))['sub'])
+    try:
+        async with AsyncSession() as session:
+            chats = await session.run_sync(api._chat_inbox, user_id)
+        return _json({'chats': chats})
+    except Exception as e:
+        return _json({'message': 'Failed to load chats', 'error': str(e)}, 500)
+
+
+@endpoint('/api/chats/<int:chat_id>/messages')
+async def chat_messages(request):
+    if request.method == 'POST':
+        return await send_chat_message(request)
+    user_id = int((await _authenticate(request))['sub'])
+    chat_id = request.path_params['chat_id']
+    params = request.query_params
+    after_id, before_id = _int_param(params, 'after_id'), _int_param(params, 'before_id')
+    limit = clamp_page_size(_int_param(params, 'limit'), config['MESSAGE_PAGE_SIZE'], config['MAX_MESSAGE_PAGE_SIZE'])
+    try:
+        async with AsyncSession() as session:
+            if_none_match = parse_etags(request.headers.get('if-none-match'))
+            etag, body = await session.run_sync(api._chat_messages, chat_id, user_id, after_id, before_id, limit,
+                                                if_none_match)
+            if body is None:
+                return Response(status_code=304, headers={'ETag': quote_etag(matching_etag(if_none_match, etag))})
+            # Opening a chat counts as reading it
+            receipt = None
+            if body['messages']:
+                receipt = await session.run_sync(api._advance_read_cursor, chat_id, user_id, body['messages'][-1]['id'])
+        if receipt is not None:
+            await run_in_threadpool(api._publish_read_receipt, receipt)
+        return _compressed_json(request, body, headers={'ETag': etag, 'Cache-Control': 'private, no-cache'})
+    except api.ChatError as e:
+        return _json({'message': str(e)}, e.status)
+    except Exception as e:
+        return _json({'message': 'Failed to load messages', 'error': str(e)}, 500)
+
+
+@endpoint('/api/chats/unread')
+async def unread_counts(request):
+    user_id = int((await _authenticate(request))['sub'])
+    try:
+        async with AsyncSession() as session:
+            counts = await session.run_sync(api._unread_counts, user_id)
+        return _json({'total': sum(counts.values()),
+                      'chats': [{'chat_id': chat_id, 'unread_count': count} for chat_id, count in sorted(counts.items())]})
+    except Exception as e:
+        return _json({'message': 'Failed to load unread counts', 'error': str(e)}, 500)
+
+
+@endpoint('/api/chats/<int:chat_id>/read')
+async def mark_chat_read(request):
+    user_id = int((await _authenticate(request))['sub'])
+    chat_id = request.path_params['chat_id']
+    message_id = (await _json_body(request)).get('message_id')
+    if message_id is not None and not isinstance(message_id, int):
+        return _json({'message': 'message_id must be an integer'}, 400)
+    try:
+        async with AsyncSession() as session:
+            await session.run_sync(api._member_chat, chat_id, user_id)
+            receipt = await session.run_sync(api._advance_read_cursor, chat_id, user_id, message_id)
+            cursor = await session.get(api.ChatReadCursor, (chat_id, user_id))
+            unread = await session.run_sync(api._unread_counts, user_id, chat_id)
+    except api.ChatError as e:
+        return _json({'message': str(e)}, e.status)
+    except Exception as e:
+        return _json({'message': 'Failed to mark chat read', 'error': str(e)}, 500)
+    if receipt is not None:
+        await run_in_threadpool(api._publish_read_receipt, receipt)
+    return _json({'chat_id': chat_id, 'last_read_message_id': cursor.last_read_message_id if cursor else 0,
+                  'unread_count': unread.get(chat_id, 0)})
+
+
+async def send_chat_message(request):
+    claims = await _authenticate(request)
+    user_id = int(claims['sub'])
+    limited = await _rate_limited(request, 'send_message', claims['sub'])
+    if limited is not None:
+        return limited
+    data = await _json_body(request)
+    try:
+        async with AsyncSession() as session:
+            payload = await session.run_sync(api._post_chat_message, request.path_params['chat_id'], user_id,
+                                             data.get('content'))
+    except api.ChatError as e:
+        return _json({'message': str(e)}, e.status)
+    except Exception as e:
+        return _json({'message': 'Failed to send message', 'error': str(e)}, 500)
+
+    # The Flask routes may read from replicas; keep this user's reads on the primary for a while
+    await run_in_threadpool(api.db_router.wrote, claims['sub'])
+    return _json({'message': 'Message sent', 'data': payload}, 201)
+
+
+@endpoint('/api/skills/search')
+async def search_skills_advanced(request):
+    user = None
+    if request.headers.get('authorization'):
+        try:
+            user = (await _authenticate(request))['sub']
+        except AuthError:
+            pass  # the search itself is public; count bad tokens by address
+    limited = await _rate_limited(request, 'search', user)
+    if limited is not None:
+        return limited
+    data = await _json_body(request)
+    try:
+        async with AsyncSession() as session:
+            return _compressed_json(request, await session.run_sync(api._search_skills, data))
+    except (InvalidCursor, InvalidLocation) as e:
+        return _json({'message': str(e)}, 400)
+    except Exception as e:
+        return _json({'message': 'Search failed', 'error': str(e)}, 500)
+
+
+@endpoint('/api/stream')
+async def event_stream(request):
+    user_id = int((await _authenticate(request, api.STREAM_TOKEN_LOCATIONS))['sub'])
+    subscription = api.event_hub.subscribe_async(f'user:{user_id}')
+    heartbeat = config['STREAM_HEARTBEAT_SECONDS']
+
+    async def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                item = await subscription.get_async(timeout=heartbeat)
+                if item is None:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield format_sse(item['data'], item['event'])
+        finally:
+            subscription.close()
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+# ------------------------------
+# Application
+# ------------------------------
+
+def _warm_up():
+    # Built before serving: async handlers must never wait for the first build
+    with api.app.app_context():
+        api._sync_search_index(force=True)
+        api.revocations.maybe_refresh(force=True)
+
+
+async def _refresh_revocations():
+    # Keeps the filter current so token checks on the event loop never refresh it themselves.
+    # Not forced: that would rebuild the whole filter every time instead of every rebuild_seconds
+    while True:
+        await asyncio.sleep(config['REVOCATION_REFRESH_SECONDS'])
+        try:
+            await run_in_threadpool(api.revocations.maybe_refresh)
+        except Exception:
+            api.app.logger.exception('Refreshing revoked tokens failed')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(_warm_up)
+    refresher = asyncio.create_task(_refresh_revocations())
+    try:
+        yield
+    finally:
+        refresher.cancel()
+        await async_engine.dispose()
+
+
+application = Starlette(routes=[
+    Route('/api/chats', list_chats, methods=['GET']),
+    Route('/api/chats/unread', unread_counts, methods=['GET']),
+    Route('/api/chats/{chat_id:int}/read', mark_chat_read, methods=['POST']),
+    Route('/api/chats/{chat_id:int}/messages', chat_messages, methods=['GET', 'POST']),
+    Route('/api/skills/search', search_skills_advanced, methods=['POST']),
+    Route('/api/stream', event_stream, methods=['GET']),
+    Mount('/', WSGIMiddleware(api.app, workers=config['ASGI_WSGI_THREADS'])),
+], lifespan=lifespan)
@@ -0,0 +1,239 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, insert, select
+
+from response_cache import LRUCache
+
+
+def _utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def _timestamp(value: datetime) -> float:
+    # Columns hold naive UTC, like the rest of the schema
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+# ------------------------------
+# Identity cache
+# ------------------------------
+
+class IdentityCache:
+    """Per-worker TTL+LRU cache of user profiles, so authenticated requests need no user lookup.
+
+    Writers call ``invalidate`` after changing a user; other workers pick the
+    change up when their entry expires (``ttl`` seconds at most).
+    """
+
+    _MISSING = object()
+
+    def __init__(self, loader, ttl: float = 60.0, maxsize: int = 10000):
+        self.loader = loader
+        self.ttl = ttl
+        self._cache = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            return None if entry is self._MISSING else entry
+        self.misses += 1
+        profile = self.loader(user_id)
+        # Unknown ids are cached too (briefly), so probing them cannot hammer the database
+        self._cache.set(user_id, self._MISSING if profile is None else profile,
+                        self.ttl if profile is not None else min(self.ttl, 5.0))
+        return profile
+
+    def invalidate(self, user_id: int):
+        self._cache.set(user_id, None, 0)
+
+
+# ------------------------------
+# Token revocation
+# ------------------------------
+
+class BloomFilter:
+    """Fixed-size set membership with no false negatives and ~``error_rate`` false positives."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    """Revoked tokens, checked without a database query for the tokens that were not revoked.
+
+    Single-token revocations (logout) live in ``model`` rows keyed by the
+    token's ``jti`` and in a bloom filter; only a filter hit is confirmed
+    against the table. Rows without a ``jti`` revoke every token a user was
+    issued before ``revoked_at`` (role changes, deactivation); there are
+    few of those, so they are kept exactly. New rows from other workers are
+    picked up every ``refresh_seconds``; every ``rebuild_seconds`` expired
+    rows are deleted and the filter is rebuilt from the rest.
+
+    Ids are assigned at insert but become visible at commit, so a row can
+    show up after rows with higher ids. Each refresh therefore re-reads the
+    last ``reread_ids`` ids as well, and skips the rows it already applied.
+    """
+
+    def __init__(self, db, model, capacity: int = 100000, error_rate: float = 0.01,
+                 refresh_seconds: float = 5.0, rebuild_seconds: float = 600.0, reread_ids: int = 1000):
+        self.db = db
+        self.Revoked = model
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.reread_ids = reread_ids
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._user_cutoffs = {}
+        self._last_id = 0
+        self._seen_ids = set()  # applied ids within the re-read window
+        self._refreshed_at = 0.0
+        self._rebuilt_at = 0.0
+        self.confirmations = 0
+
+    def revoke(self, jti: str, user_id: int, expires_at: float):
+        self._insert(jti=jti, user_id=user_id, revoked_at=_utc(time.time()), expires_at=_utc(expires_at))
+        with self._lock:
+            self._bloom.add(jti)
+
+    def revoke_user(self, user_id: int, token_lifetime: float):
+        """Revoke every token issued to ``user_id`` so far; new logins are unaffected."""
+        now = time.time()
+        # Token iat has one-second resolution; a token issued in this same second is revoked too
+        cutoff, expires = math.floor(now) + 1, now + token_lifetime
+        self._insert(jti=None, user_id=user_id, revoked_at=_utc(cutoff), expires_at=_utc(expires))
+        with self._lock:
+            self._add_cutoff(self._user_cutoffs, user_id, cutoff, expires)
+
+    def _insert(self, **values):
+        table = self.Revoked.__table__
+        with self.db.engine.begin() as conn:
+            conn.execute(insert(table).values(**values))
+
+    def _lookup(self, claims: dict):
+        user_id = int(claims['sub']) if str(claims.get('sub', '')).isdigit() else None
+        with self._lock:
+            cutoff, _ = self._user_cutoffs.get(user_id, (None, None))
+            maybe_revoked = claims.get('jti') in self._bloom if claims.get('jti') else False
+        return (cutoff is not None and claims.get('iat', 0) < cutoff), maybe_revoked
+
+    def might_be_revoked(self, claims: dict) -> bool:
+        """In-memory check only; ``False`` is final, ``True`` needs ``is_revoked`` to confirm."""
+        revoked, maybe_revoked = self._lookup(claims)
+        return revoked or maybe_revoked
+
+    def is_revoked(self, claims: dict) -> bool:
+        try:
+            self.maybe_refresh()
+        except Exception:
+            pass  # keep checking against what is loaded
+        revoked, maybe_revoked = self._lookup(claims)
+        if revoked:
+            return True
+        if not maybe_revoked:
+            return False
+        self.confirmations += 1
+        table = self.Revoked.__table__
+        with self.db.engine.connect() as conn:
+            return conn.execute(select(table.c.id).where(table.c.jti == claims['jti'])).first() is not None
+
+    def maybe_refresh(self, force: bool = False):
+        now = time.time()
+        if not force and now - self._refreshed_at < self.refresh_seconds:
+            return
+        if not self._refresh_lock.acquire(blocking=force):
+            return
+        try:
+            if force or now - self._rebuilt_at >= self.rebuild_seconds:
+                self._rebuild(now)
+            else:
+                self._load_new(now)
+            self._refreshed_at = now
+        finally:
+            self._refresh_lock.release()
+
+    def _rows(self, conn, condition):
+        table = self.Revoked.__table__
+        return conn.execute(select(table.c.id, table.c.jti, table.c.user_id, table.c.revoked_at, table.c.expires_at)
+                            .where(condition).order_by(table.c.id)).all()
+
+    @staticmethod
+    def _add_cutoff(cutoffs, user_id: int, cutoff: float, expires: float):
+        previous = cutoffs.get(user_id)
+        if previous is None or previous[0] < cutoff:
+            cutoffs[user_id] = (cutoff, max(expires, previous[1]) if previous else expires)
+
+    def _apply(self, bloom, cutoffs, rows):
+        for row in rows:
+            if row.jti:
+                bloom.add(row.jti)
+            else:
+                self._add_cutoff(cutoffs, row.user_id, _timestamp(row.revoked_at), _timestamp(row.expires_at))
+
+    def _window(self, ids):
+        floor = self._last_id - self.reread_ids
+        return {row_id for row_id in ids if row_id > floor}
+
+    def _load_new(self, now: float):
+        table = self.Revoked.__table__
+        with self.db.engine.connect() as conn:
+            rows = self._rows(conn, table.c.id > self._last_id - self.reread_ids)
+        rows = [row for row in rows if row.id not in self._seen_ids]
+        if not rows:
+            return
+        with self._lock:
+            self._apply(self._bloom, self._user_cutoffs, rows)
+            self._last_id = max(self._last_id, rows[-1].id)
+            self._seen_ids = self._window(self._seen_ids | {row.id for row in rows})
+            overfull = self._bloom.count > self._bloom.capacity
+        if overfull:
+            self._rebuild(now)
+
+    def _rebuild(self, now: float):
+        table = self.Revoked.__table__
+        with self.db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.expires_at < _utc(now)))
+            rows = self._rows(conn, table.c.expires_at >= _utc(now))
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        cutoffs = {}
+        self._apply(bloom, cutoffs, rows)
+        with self._lock:
+            # Revocations made by this worker while the rows were loading stay in effect
+            for user_id, (cutoff, expires) in self._user_cutoffs.items():
+                if expires > now:
+                    self._add_cutoff(cutoffs, user_id, cutoff, expires)
+            self._bloom, self._user_cutoffs = bloom, cutoffs
+            self._last_id = max([self._last_id] + [row.id for row in rows])
+            self._seen_ids = self._window(row.id for row in rows)
+        self._rebuilt_at = now
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {'revoked_tokens': self._bloom.count, 'revoked_users': len(self._user_cutoffs),
+                    'filter_bytes': len(self._bloom._bits), 'confirmation_queries': self.confirmations}
@@ -0,0 +1,368 @@
+"""Load-test the main API routes with concurrent clients and compare against a baseline.
+
+Usage:
+    python benchmarks/bench_api.py [--users 2000] [--listings 20000] [--chats 500] [--messages-per-chat 200]
+                                   [--clients 8] [--requests 400] [--database-url URL] [--base-url URL]
+                                   [--output results.json] [--baseline baseline.json] [--max-regression 0.25]
+                                   [--accept-encoding 'gzip, br'] [--revalidate]
+
+Seeds synthetic users, listings and chats with long histories, then runs
+each scenario (register, login, get_skills, search, list_chats,
+get_chat_messages, send_chat_message) with --clients concurrent clients
+until --requests requests completed, and prints per-scenario throughput,
+p50/p95/p99 latency, SQL queries per request and mean response bytes as JSON.
+Requests send --accept-encoding (pass '' for uncompressed responses); with
+--revalidate each client sends If-None-Match with ETags it has seen.
+
+Without --database-url a temporary SQLite file is used; point it at a
+local MySQL container (mysql+pymysql://...) for realistic numbers. Seeding
+drops every table first, so a non-SQLite database must have "bench" in its
+name (e.g. .../tradecraft_bench) unless --force is given. Requests
+go through Flask's test client in this process, or over HTTP to a running
+server with --base-url (it must use the same DATABASE_URL and
+JWT_SECRET_KEY, and SERVER_TIMING_ENABLED=true for query counts).
+
+With --baseline, the run exits non-zero when a scenario's p95 latency grew
+by more than --max-regression, its queries per request by more than
+--max-query-regression, or requests that used to succeed started failing.
+Latency is noisy on small machines; use more --requests for stable p95s.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+from sqlalchemy.engine import make_url
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'benchmark-password'
+WORDS = ['guitar', 'piano', 'python', 'spanish', 'yoga', 'cooking', 'plumbing', 'design', 'math', 'photography',
+         'french', 'gardening', 'carpentry', 'marketing', 'violin', 'drawing', 'tutoring', 'fitness', 'writing',
+         'repair']
+CATEGORIES = ['Music', 'Programming', 'Languages', 'Fitness', 'Home', 'Design', 'Education', 'Art']
+CITIES = [('Berlin', 52.52, 13.40), ('Madrid', 40.42, -3.70), ('Paris', 48.86, 2.35), ('Lisbon', 38.72, -9.14)]
+_QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+# ------------------------------
+# Seeding
+# ------------------------------
+
+def seed(m, args, rng):
+    now = datetime.utcnow()
+    password_hash = m.password_hasher.hash(PASSWORD)
+    m.db.drop_all()
+    m.db.create_all()
+    m.db.session.bulk_insert_mappings(m.User, [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': password_hash}
+        for i in range(1, args.users + 1)])
+    m.db.session.bulk_insert_mappings(m.Wallet, [{'user_id': i} for i in range(1, args.users + 1)])
+    listings = []
+    for i in range(1, args.listings + 1):
+        city, lat, lon = rng.choice(CITIES)
+        lat, lon = lat + rng.uniform(-0.2, 0.2), lon + rng.uniform(-0.2, 0.2)
+        listings.append({
+            'id': i, 'title': ' '.join(rng.sample(WORDS, 2)).title() + ' lessons',
+            'description': ' '.join(rng.choices(WORDS, k=30)), 'category': rng.choice(CATEGORIES),
+            'location': city, 'latitude': lat, 'longitude': lon, 'geohash': m.geohash_encode(lat, lon),
+            'time_credits': rng.randint(0, 5), 'monetary_price': rng.randint(0, 100),
+            'provider_id': rng.randint(1, args.users), 'created_at': now - timedelta(minutes=i),
+            'updated_at': now - timedelta(minutes=i), 'is_active': True})
+        if len(listings) == 5000:
+            m.db.session.bulk_insert_mappings(m.SkillListing, listings)
+            listings = []
+    m.db.session.bulk_insert_mappings(m.SkillListing, listings)
+
+    chats, pairs = [], set()
+    while len(chats) < min(args.chats, args.users * (args.users - 1) // 2):
+        a, b = sorted(rng.sample(range(1, args.users + 1), 2))
+        if (a, b) not in pairs:
+            pairs.add((a, b))
+            chats.append({'id': len(chats) + 1, 'user1_id': a, 'user2_id': b, 'created_at': now, 'is_active': True})
+    m.db.session.bulk_insert_mappings(m.Chat, chats)
+    messages = []
+    for chat in chats:
+        for j in range(args.messages_per_chat):
+            sender, receiver = (chat['user1_id'], chat['user2_id']) if j % 2 else (chat['user2_id'], chat['user1_id'])
+            messages.append({'chat_id': chat['id'], 'sender_id': sender, 'receiver_id': receiver,
+                             'content': ' '.join(rng.choices(WORDS, k=12)),
+                             'created_at': now - timedelta(seconds=args.messages_per_chat - j)})
+            if len(messages) == 5000:
+                m.db.session.bulk_insert_mappings(m.Message, messages)
+                messages = []
+    m.db.session.bulk_insert_mappings(m.Message, messages)
+    m.db.session.commit()
+    m._rebuild_chat_counters(m.db.session)
+    return [(chat['id'], chat['user1_id'], chat['user2_id']) for chat in chats]
+
+
+# ------------------------------
+# Clients
+# ------------------------------
+
+class Client:
+    """Sends the configured Accept-Encoding and, with ``revalidate``, If-None-Match for paths it has seen."""
+
+    def __init__(self, accept_encoding: str = '', revalidate: bool = False):
+        self.accept_encoding = accept_encoding
+        self.etags = {} if revalidate else None
+
+    def request(self, method: str, path: str, body=None, headers=None):
+        """``(status, server_timing, body_bytes)``; bytes as sent, i.e. compressed when negotiated."""
+        headers = dict(headers or {})
+        if self.accept_encoding:
+            headers['Accept-Encoding'] = self.accept_encoding
+        if self.etags is not None and method == 'GET' and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        status, response_headers, size = self._send(method, path, body, headers)
+        if self.etags is not None and response_headers.get('ETag'):
+            self.etags[path] = response_headers['ETag']
+        return status, response_headers.get('Server-Timing', ''), size
+
+
+class InProcessClient(Client):
+    def __init__(self, app, **kwargs):
+        super().__init__(**kwargs)
+        self.client = app.test_client()
+
+    def _send(self, method, path, body, headers):
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.headers, len(response.get_data())
+
+
+class HttpClient(Client):
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def _send(self, method, path, body, headers):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json', **headers})
+        try:
+            # urllib does not decode Content-Encoding, so this is the size on the wire
+            with urllib.request.urlopen(req, timeout=60) as response:
+                return response.status, response.headers, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, len(e.read())
+
+
+def scenarios(tokens, chats, args, counter):
+    """name -> function(rng) returning (method, path, body, headers)."""
+    chat_users = [(chat_id, user_id) for chat_id, a, b in chats for user_id in (a, b)]
+
+    def auth(user_id):
+        return {'Authorization': f'Bearer {tokens[user_id]}'}
+
+    def register(rng):
+        n = next(counter)
+        return 'POST', '/api/auth/register', {'username': f'bench{n}-{os.getpid()}',
+                                              'email': f'bench{n}-{os.getpid()}@example.com',
+                                              'password': PASSWORD}, None
+
+    def login(rng):
+        user_id = rng.randint(1, args.users)
+        return 'POST', '/api/auth/login', {'email': f'user{user_id}@example.com', 'password': PASSWORD}, None
+
+    def get_skills(rng):
+        params = [f'per_page={rng.choice([10, 20, 50])}']
+        roll = rng.random()
+        if roll < 0.3:
+            params.append(f'category={rng.choice(CATEGORIES)}')
+        elif roll < 0.5:
+            params.append(f'search={rng.choice(WORDS)}')
+        elif roll < 0.6:
+            _, lat, lon = rng.choice(CITIES)
+            params.append(f'near={lat},{lon}&radius_km=5')
+        return 'GET', '/api/skills?' + '&'.join(params), None, None
+
+    def search(rng):
+        filters = {'category': rng.choice(CATEGORIES)} if rng.random() < 0.3 else {}
+        return 'POST', '/api/skills/search', {'query': ' '.join(rng.sample(WORDS, 2)), 'filters': filters}, None
+
+    def list_chats(rng):
+        _, user_id = rng.choice(chat_users)
+        return 'GET', '/api/chats', None, auth(user_id)
+
+    def get_chat_messages(rng):
+        chat_id, user_id = rng.choice(chat_users)
+        query = f'?before_id={rng.randint(2, 10 ** 6)}' if rng.random() < 0.3 else ''
+        return 'GET', f'/api/chats/{chat_id}/messages{query}', None, auth(user_id)
+
+    def send_chat_message(rng):
+        chat_id, user_id = rng.choice(chat_users)
+        return 'POST', f'/api/chats/{chat_id}/messages', {'content': ' '.join(rng.choices(WORDS, k=8))}, \
+            auth(user_id)
+
+    return {'register': register, 'login': login, 'get_skills': get_skills, 'search_skills_advanced': search,
+            'list_chats': list_chats, 'get_chat_messages': get_chat_messages,
+            'send_chat_message': send_chat_message}
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (position - low)
+
+
+def run_scenario(make_client, build, clients: int, requests: int, seed: int) -> dict:
+    latencies, queries, sizes, statuses = [], [], [], {}
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = make_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            method, path, body, headers = build(rng)
+            started = time.perf_counter()
+            status, timing, size = client.request(method, path, body, headers)
+            elapsed = time.perf_counter() - started
+            match = _QUERIES.search(timing)
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(size)
+                statuses[status] = statuses.get(status, 0) + 1
+                if match:
+                    queries.append(int(match.group(1)))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+        'mean_bytes': round(sum(sizes) / len(sizes)) if sizes else None,
+    }
+
+
+def regressions(results: dict, baseline: dict, max_regression: float, max_query_regression: float) -> list:
+    found = []
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        if before['p95_ms'] and current['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            found.append(f"{name}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+        if before.get('queries_per_request') is not None and current.get('queries_per_request') is not None \
+                and current['queries_per_request'] > before['queries_per_request'] * (1 + max_query_regression) + 0.05:
+            found.append(f"{name}: queries/request {before['queries_per_request']} -> "
+                         f"{current['queries_per_request']}")
+        if current['errors'] / max(current['requests'], 1) > before['errors'] / max(before['requests'], 1) + 0.01:
+            found.append(f"{name}: errors {before['errors']}/{before['requests']} -> "
+                         f"{current['errors']}/{current['requests']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--listings', type=int, default=20000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--messages-per-chat', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400, help='requests per scenario')
+    parser.add_argument('--scenarios', help='comma-separated subset to run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url')
+    parser.add_argument('--force', action='store_true',
+                        help='seed (drop and recreate all tables in) a --database-url not named for benchmarks')
+    parser.add_argument('--base-url', help='drive a running server over HTTP instead of the in-process client')
+    parser.add_argument('--output', help='also write the JSON report here')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--accept-encoding', default='gzip, br', help="Accept-Encoding to send; '' for none")
+    parser.add_argument('--revalidate', action='store_true', help='send If-None-Match with ETags already seen')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='allowed relative p95 increase')
+    parser.add_argument('--max-query-regression', type=float, default=0.1,
+                        help='allowed relative increase in queries per request (periodic index syncs add a few)')
+    args = parser.parse_args()
+
+    if args.database_url:
+        url = make_url(args.database_url)
+        if url.get_backend_name() != 'sqlite' and 'bench' not in (url.database or '') and not args.force:
+            parser.error(f'seeding drops every table in {url.render_as_string(hide_password=True)}; use a database '
+                         f'with "bench" in its name, or pass --force')
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'api_bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}?timeout=30'
+    os.environ.setdefault('SERVER_TIMING_ENABLED', 'true')
+    # Responses must come from the routes, not from the cache, or the numbers say nothing about them
+    os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'false')
+    # Every simulated client shares one address and a few users; the limits would shed most of the load
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    import app_simple as m
+    from flask_jwt_extended import create_access_token
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    with m.app.app_context():
+        chats = seed(m, args, rng)
+        tokens = {i: create_access_token(identity=str(i)) for i in range(1, args.users + 1)}
+        database = m.db.engine.dialect.name
+    seed_s = time.perf_counter() - started
+
+    client_options = {'accept_encoding': args.accept_encoding, 'revalidate': args.revalidate}
+    if args.base_url:
+        make_client = lambda: HttpClient(args.base_url, **client_options)  # noqa: E731
+    else:
+        make_client = lambda: InProcessClient(m.app, **client_options)  # noqa: E731
+    counter = iter(range(10 ** 9))
+    available = scenarios(tokens, chats, args, counter)
+    chosen = args.scenarios.split(',') if args.scenarios else list(available)
+
+    results = {'config': {key: getattr(args, key) for key in ('users', 'listings', 'chats', 'messages_per_chat',
+                                                               'clients', 'requests', 'seed', 'accept_encoding',
+                                                               'revalidate')},
+               'database': database, 'seed_s': round(seed_s, 2), 'scenarios': {}}
+    for index, name in enumerate(chosen):
+        results['scenarios'][name] = run_scenario(make_client, available[name], args.clients, args.requests,
+                                                  args.seed + index)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.max_regression, args.max_query_regression)
+        if found:
+            print('Regressions:\n  ' + '\n  '.join(found), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Measure bulk import and streaming export throughput (rows/sec) for NDJSON and CSV.
+
+Usage:
+    python benchmarks/bench_bulk_import.py [--listings 100000] [--users 2000] [--chunk-size 1000]
+
+Runs against a throwaway SQLite file (so commits hit disk like a real
+database would). Listings reference their provider by username, which
+exercises the per-chunk provider lookup; users carry pre-computed hashes
+except for a few plain passwords, so the hashing path is covered without
+dominating the timing.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+
+import app_simple as m  # noqa: E402
+from bulk_io import export_lines, read_rows  # noqa: E402
+from serializers import dumps  # noqa: E402
+
+FAKE_HASH = '$2b$04$' + 'a' * 53
+
+
+def user_rows(n: int, fmt: str, plain_every: int = 100):
+    for i in range(n):
+        row = {'username': f'{fmt}user{i}', 'email': f'{fmt}user{i}@example.com', 'phone': f'{fmt[0]}{i:09d}'}
+        if i % plain_every == 0:
+            row['password'] = f'secret{i}'
+        else:
+            row['password_hash'] = FAKE_HASH
+        yield row
+
+
+def skill_rows(n: int, providers):
+    for i in range(n):
+        yield {
+            'title': f'Listing {i}',
+            'description': 'Lorem ipsum dolor sit amet ' * 8,
+            'category': f'Category {i % 20}',
+            'location': f'City {i % 50}',
+            'latitude': 40 + (i % 1000) / 100,
+            'longitude': -3 + (i % 700) / 100,
+            'time_credits': i % 10,
+            'monetary_price': (i % 100) * 1.25,
+            'provider_username': providers[i % len(providers)],
+        }
+
+
+def encode(rows, fmt: str) -> str:
+    rows = list(rows)
+    if fmt == 'ndjson':
+        return ''.join(json.dumps(row) + '\n' for row in rows)
+    fields = sorted({key for row in rows for key in row})
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def timed_import(kind: str, body: str, fmt: str, chunk_size: int) -> dict:
+    report = m._run_import(kind, read_rows(io.StringIO(body, newline=''), fmt), chunk_size)
+    if report['rejected']:
+        raise SystemExit(f'{kind}/{fmt}: unexpected rejections {report["errors"][:3]}')
+    return {'rows': report['inserted'], 'seconds': report['elapsed_s'], 'rows_per_s': report['rows_per_s']}
+
+
+def timed_export(kind: str, fmt: str) -> dict:
+    started = time.perf_counter()
+    fields, records = m._export_records(kind)
+    size = sum(len(chunk) for chunk in export_lines(records, fmt, fields, dumps))
+    elapsed = time.perf_counter() - started
+    count = m.db.session.query(m.SkillListing if kind == 'skills' else m.User).count()
+    return {'rows': count, 'seconds': round(elapsed, 3), 'rows_per_s': round(count / elapsed, 1),
+            'megabytes': round(size / 2 ** 20, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    report = {'listings': args.listings, 'users': args.users, 'chunk_size': args.chunk_size}
+    with m.app.app_context():
+        m.db.create_all()
+        for fmt in ('ndjson', 'csv'):
+            body = encode(user_rows(args.users, fmt), fmt)
+            report[f'import_users_{fmt}'] = timed_import('users', body, fmt, args.chunk_size)
+            providers = [f'{fmt}user{i}' for i in range(args.users)]
+            body = encode(skill_rows(args.listings, providers), fmt)
+            report[f'import_skills_{fmt}'] = timed_import('skills', body, fmt, args.chunk_size)
+        for fmt in ('ndjson', 'csv'):
+            report[f'export_skills_{fmt}'] = timed_export('skills', fmt)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
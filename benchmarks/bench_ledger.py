@@ -0,0 +1,115 @@
+"""Stress the wallet ledger with concurrent transfers and check that no update was lost.
+
+Usage:
+    python benchmarks/bench_ledger.py [--users 50] [--threads 16] [--transfers 200] [--database-url URL]
+
+Without --database-url a temporary SQLite file is used. Point it at MySQL
+(mysql+pymysql://...) to exercise real row locks. The run fails when the
+total money/credits in the system changed, a wallet went negative, or a
+wallet's balance disagrees with its completed transactions.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--transfers', type=int, default=200, help='transfers per thread')
+    parser.add_argument('--initial-balance', type=str, default='100.00')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'ledger_bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}?timeout=30'
+
+    import app_simple as m
+    from ledger import LedgerError
+
+    initial = Decimal(args.initial_balance)
+    with m.app.app_context():
+        m.db.drop_all()
+        m.db.create_all()
+        m.db.session.bulk_insert_mappings(m.User, [
+            {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'}
+            for i in range(1, args.users + 1)
+        ])
+        m.db.session.bulk_insert_mappings(m.Wallet, [
+            {'user_id': i, 'balance': initial, 'time_credits': 100} for i in range(1, args.users + 1)
+        ])
+        m.db.session.commit()
+
+    counters = {'completed': 0, 'rejected': 0, 'errors': 0}
+    counters_lock = threading.Lock()
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        with m.app.app_context():
+            for n in range(args.transfers):
+                a, b = rng.sample(range(1, args.users + 1), 2)
+                try:
+                    m.ledger.transfer(a, b, amount=Decimal(rng.randint(1, 2500)) / 100,
+                                      time_credits=rng.randint(0, 3),
+                                      idempotency_key=f'{seed}-{n}')
+                    outcome = 'completed'
+                except LedgerError:
+                    outcome = 'rejected'
+                except Exception:
+                    outcome = 'errors'
+                with counters_lock:
+                    counters[outcome] += 1
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with m.app.app_context():
+        wallets = {w.user_id: w for w in m.Wallet.query.all()}
+        expected = {uid: [initial, 100] for uid in wallets}
+        for tx in m.Transaction.query.filter_by(status='completed'):
+            expected[tx.from_user_id][0] -= tx.amount
+            expected[tx.from_user_id][1] -= tx.time_credits
+            expected[tx.to_user_id][0] += tx.amount
+            expected[tx.to_user_id][1] += tx.time_credits
+        mismatched = [uid for uid, w in wallets.items()
+                      if Decimal(w.balance) != expected[uid][0] or w.time_credits != expected[uid][1]]
+        negative = [uid for uid, w in wallets.items() if w.balance < 0 or w.time_credits < 0]
+        total_money = sum(Decimal(w.balance) for w in wallets.values())
+        total_credits = sum(w.time_credits for w in wallets.values())
+        backend = m.db.engine.url.get_backend_name()
+
+    conserved = total_money == initial * args.users and total_credits == 100 * args.users
+    report = {
+        'database': backend,
+        'threads': args.threads,
+        'attempted': args.threads * args.transfers,
+        **counters,
+        'elapsed_s': elapsed,
+        'transfers_per_s': args.threads * args.transfers / elapsed,
+        'conserved': conserved,
+        'wallets_disagreeing_with_history': len(mismatched),
+        'negative_wallets': len(negative),
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if conserved and not mismatched and not negative else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+"""Time BM25 search over a synthetic catalog and check it against exhaustive scoring.
+
+Usage:
+    python benchmarks/bench_search.py [--listings 1000000] [--rounds 200] [--limit 20]
+
+The index is built without a database, as `_sync_search_index` does from
+rows. Titles and descriptions draw words from a Zipf-like vocabulary, so some
+terms are in a large share of the catalog. Each query is timed warm (after
+its first run has built the terms' impact lists) for the top ``--limit``
+and for the first SEARCH_MAX_CANDIDATES-sized batch the listing endpoints
+read. The exhaustive scorer walks every posting of every query term; the
+index must return exactly its ranking, otherwise the script exits non-zero.
+"""
+import argparse
+import gc
+import heapq
+import json
+import math
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex, _rank_key  # noqa: E402
+
+QUERIES = (
+    'lesson',              # in a large share of listings
+    'guitar lesson',       # a rarer word with a common one
+    'python tutor online',
+    'gard',                # type-ahead prefix
+    'spanish conv',
+    'word17',
+    'word4000 word9000',   # rare words
+    'zzzz',                # no match
+)
+
+
+def synthetic_catalog(n_listings: int, rng):
+    vocabulary = [f'word{i}' for i in range(20000)]
+    vocabulary[:12] = ['lesson', 'tutor', 'online', 'beginner', 'guitar', 'python', 'garden', 'gardening',
+                       'spanish', 'conversation', 'repair', 'cooking']
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1) ** 0.9
+    weights /= weights.sum()
+    title_words = rng.choice(len(vocabulary), size=(n_listings, 4), p=weights)
+    description_words = rng.choice(len(vocabulary), size=(n_listings, 14), p=weights)
+    for i in range(n_listings):
+        yield (i + 1, ' '.join(vocabulary[j] for j in title_words[i]),
+               ' '.join(vocabulary[j] for j in description_words[i]))
+
+
+def exhaustive(index, text):
+    """BM25 over every posting of every query term, as the index computed it before impact lists."""
+    n_docs = len(index._doc_len)
+    avg_len = index._total_len / n_docs
+    k1, b = index.k1, index.b
+    scores = defaultdict(float)
+    for terms in index._query_terms(text, True):
+        best = {}
+        for term in terms:
+            postings = index._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings.items():
+                norm = k1 * (1.0 - b + b * index._doc_len[doc_id] / avg_len)
+                score = idf * tf * (k1 + 1.0) / (tf + norm)
+                if score > best.get(doc_id, 0.0):
+                    best[doc_id] = score
+        for doc_id, score in best.items():
+            scores[doc_id] += score
+    return scores
+
+
+def timed(fn, rounds: int):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {'p50': statistics.median(samples), 'p95': samples[int(len(samples) * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=1000000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--batch', type=int, default=1000, help='SEARCH_MAX_CANDIDATES')
+    args = parser.parse_args()
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    for doc_id, title, description in synthetic_catalog(args.listings, np.random.default_rng(7)):
+        index.add(doc_id, title, description)
+    gc.collect()
+    build_s = time.perf_counter() - start
+
+    report = {'listings': args.listings, 'build_s': build_s, 'queries': {}}
+    identical = True
+    for query in QUERIES:
+        start = time.perf_counter()
+        index.search(query, limit=args.limit)
+        first_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        scores = exhaustive(index, query)
+        expected = heapq.nlargest(args.batch, scores.items(), key=_rank_key)
+        exhaustive_ms = (time.perf_counter() - start) * 1000
+        top = index.search(query, limit=args.limit)
+        batch = next(index.search_batches(query, args.batch))
+        same = top == expected[:args.limit] and batch == [doc_id for doc_id, _ in expected]
+        identical = identical and same
+
+        report['queries'][query] = {
+            'matches': len(scores),
+            'identical': same,
+            'first_ms': first_ms,
+            'exhaustive_ms': exhaustive_ms,
+            'top_ms': timed(lambda: index.search(query, limit=args.limit), args.rounds),
+            'batch_ms': timed(lambda: next(index.search_batches(query, args.batch)), max(1, args.rounds // 10)),
+        }
+    print(json.dumps(report, indent=2))
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
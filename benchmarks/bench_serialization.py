@@ -0,0 +1,115 @@
+"""Compare marshmallow auto-schema dumps with the compiled serializer on listing pages.
+
+Usage:
+    python benchmarks/bench_serialization.py [--listings 5000] [--page-size 100] [--rounds 200]
+
+Runs against a throwaway in-memory SQLite database. Compares the response
+bodies themselves: ``fast_jsonify`` of the compiled rows against ``jsonify``
+of marshmallow's dump. They must be byte-for-byte identical with either
+encoder (``dumps`` leaves bodies orjson would spell differently to the
+stdlib encoder); the script exits non-zero otherwise. The titles include
+non-ASCII text, so ``--ascii`` shows orjson's speed on bodies it does write.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import app_simple as m  # noqa: E402
+import serializers  # noqa: E402
+from serializers import dumps, fast_jsonify  # noqa: E402
+
+
+def seed(n_listings: int, ascii_only: bool):
+    user = m.User(username='bench', email='bench@example.com', password_hash='x')
+    m.db.session.add(user)
+    m.db.session.flush()
+    now = datetime.utcnow()
+    m.db.session.bulk_insert_mappings(m.SkillListing, [{
+        'title': f'Listing {i} unicode' if ascii_only else f'Listing {i} ünïcode',
+        'description': 'Lorem ipsum dolor sit amet ' * 8,
+        'category': f'Category {i % 20}',
+        'location': None if i % 7 == 0 else f'City {i % 50}',
+        'time_credits': i % 10,
+        'monetary_price': (i % 100) * 1.25,
+        'created_at': now - timedelta(seconds=i),
+        'updated_at': now - timedelta(seconds=i),
+        'is_active': True,
+        'provider_id': user.id,
+    } for i in range(n_listings)])
+    m.db.session.commit()
+
+
+def timed(fn, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = fn()
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=5000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--ascii', action='store_true', help='ASCII-only titles.')
+    args = parser.parse_args()
+
+    with m.app.app_context():
+        m.db.create_all()
+        seed(args.listings, args.ascii)
+
+        def marshmallow_path():
+            m.db.session.expunge_all()
+            skills = m.SkillListing.query.order_by(m.SkillListing.created_at.desc()).limit(args.page_size).all()
+            return m.app.json.dumps(m.skills_schema.dump(skills))
+
+        def compiled_path():
+            rows = m.db.session.query(*m.skill_serializer.entities) \
+                .order_by(m.SkillListing.created_at.desc()) \
+                .limit(args.page_size) \
+                .all()
+            return dumps(m.skill_serializer.dump_rows(rows))
+
+        def marshmallow_dump_only():
+            return m.skills_schema.dump(objects)
+
+        def compiled_dump_only():
+            return m.skill_serializer.dump_rows(rows)
+
+        objects = m.SkillListing.query.order_by(m.SkillListing.created_at.desc()).limit(args.page_size).all()
+        rows = m.db.session.query(*m.skill_serializer.entities) \
+            .order_by(m.SkillListing.created_at.desc()).limit(args.page_size).all()
+
+        slow_dump, expected = timed(marshmallow_dump_only, args.rounds)
+        fast_dump, actual = timed(compiled_dump_only, args.rounds)
+        expected_body = m.jsonify({'skills': expected}).get_data()
+        actual_body = fast_jsonify({'skills': actual}).get_data()
+        identical_bytes = expected_body == actual_body
+        identical_json = json.loads(expected_body) == json.loads(actual_body)
+        encoder = 'json' if serializers.orjson is None else 'orjson'
+
+        slow_total, _ = timed(marshmallow_path, args.rounds)
+        fast_total, _ = timed(compiled_path, args.rounds)
+
+    report = {
+        'page_size': args.page_size,
+        'encoder': encoder,
+        'identical_bytes': identical_bytes,
+        'identical_json': identical_json,
+        'dump_ms': {'marshmallow': slow_dump * 1000, 'compiled': fast_dump * 1000,
+                    'speedup': slow_dump / fast_dump},
+        'query_dump_encode_ms': {'marshmallow': slow_total * 1000, 'compiled': fast_total * 1000,
+                                 'speedup': slow_total / fast_total},
+    }
+    print(json.dumps(report, indent=2))
+    return 0 if identical_bytes else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
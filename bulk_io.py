@@ -0,0 +1,277 @@
+import csv
+import io
+import json
+import math
+import time
+from itertools import islice
+
+from geo import InvalidLocation, encode as geohash_encode, parse_coordinates
+
+FORMATS = ('ndjson', 'csv')
+
+
+class RowError(ValueError):
+    pass
+
+
+# ------------------------------
+# Readers (generators: input is never held in memory)
+# ------------------------------
+
+def detect_format(name: str = None, content_type: str = None, default: str = 'ndjson') -> str:
+    name, content_type = (name or '').lower(), (content_type or '').lower()
+    if name.endswith('.csv') or 'csv' in content_type:
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'ndjson'
+    return default
+
+
+def read_rows(stream, fmt: str):
+    """Yield ``(line_number, row_dict_or_RowError)`` from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key is not None}
+        return
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f'Invalid JSON: {e}')
+            continue
+        yield line_number, row if isinstance(row, dict) else RowError('Each line must be a JSON object')
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# ------------------------------
+# Field coercion (CSV gives strings, NDJSON gives JSON types)
+# ------------------------------
+
+def _blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _text(row, field: str, max_length: int, required: bool = True):
+    value = row.get(field)
+    if _blank(value):
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    value = str(value).strip()
+    if len(value) > max_length:
+        raise RowError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _number(row, field: str, kind, default):
+    value = row.get(field)
+    if _blank(value):
+        return default
+    try:
+        number = kind(value)
+    except (TypeError, ValueError, OverflowError):  # int(float('inf')) overflows
+        raise RowError(f'{field} must be a number') from None
+    if not math.isfinite(number):
+        raise RowError(f'{field} must be a finite number')
+    if number < 0:
+        raise RowError(f'{field} must not be negative')
+    return number
+
+
+def _flag(row, field: str, default: bool) -> bool:
+    value = row.get(field)
+    if _blank(value):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def validate_skill_row(row: dict) -> dict:
+    """Normalize one listing row into column values; ``provider_id`` may still be a username/email to resolve."""
+    mapping = {
+        'title': _text(row, 'title', 200),
+        'description': _text(row, 'description', 65535),
+        'category': _text(row, 'category', 100),
+        'location': _text(row, 'location', 200, required=False),
+        'availability': _text(row, 'availability', 50, required=False) or 'available',
+        'time_credits': _number(row, 'time_credits', int, 0),
+        'monetary_price': _number(row, 'monetary_price', float, 0.0),
+        'is_active': _flag(row, 'is_active', True),
+    }
+    try:
+        coordinates = parse_coordinates(None if _blank(row.get('latitude')) else row.get('latitude'),
+                                        None if _blank(row.get('longitude')) else row.get('longitude'))
+    except InvalidLocation as e:
+        raise RowError(str(e)) from None
+    if coordinates:
+        mapping['latitude'], mapping['longitude'] = coordinates
+        mapping['geohash'] = geohash_encode(*coordinates)
+
+    if not _blank(row.get('provider_id')):
+        mapping['provider_id'] = _number(row, 'provider_id', int, None)
+    else:
+        provider = _text(row, 'provider_username', 80, required=False) or _text(row, 'provider_email', 120,
+                                                                                  required=False)
+        if provider is None:
+            raise RowError('provider_id, provider_username or provider_email is required')
+        mapping['provider_ref'] = provider
+    return mapping
+
+
+def validate_user_row(row: dict) -> dict:
+    """Normalize one user row; exactly one of ``password_hash`` (bcrypt/scrypt) or ``password`` is needed."""
+    mapping = {
+        'username': _text(row, 'username', 80),
+        'email': _text(row, 'email', 120).lower(),
+        'phone': _text(row, 'phone', 20, required=False),
+        'role': _text(row, 'role', 20, required=False) or 'user',
+        'is_active': _flag(row, 'is_active', True),
+    }
+    if '@' not in mapping['email']:
+        raise RowError('email is not valid')
+    if mapping['role'] not in ('user', 'admin'):
+        raise RowError('role must be user or admin')
+    password_hash = _text(row, 'password_hash', 255, required=False)
+    if password_hash:
+        if not (password_hash.startswith('$2') or password_hash.startswith('scrypt$')):
+            raise RowError('password_hash must be a bcrypt or scrypt hash')
+        mapping['password_hash'] = password_hash
+    else:
+        mapping['password'] = _text(row, 'password', 128)
+    return mapping
+
+
+# ------------------------------
+# Import
+# ------------------------------
+
+class BulkImporter:
+    """Validate and insert rows ``chunk_size`` at a time, one DB transaction per chunk.
+
+    ``prepare_chunk(valid)`` takes ``[(line, mapping)]`` and returns
+    ``(kept, errors)``; it is where checks that need the database (foreign
+    keys, uniqueness) run, with one query per chunk instead of per row.
+    ``after_insert(kept)`` runs in the same transaction (e.g. to create
+    dependent rows), ``after_commit(kept)`` once it has committed (e.g. to
+    invalidate caches). A chunk that fails to insert is rolled back and
+    reported; the import continues with the next one.
+    """
+
+    def __init__(self, db, model, validate_row, prepare_chunk=None, after_insert=None, after_commit=None,
+                 chunk_size: int = 1000, max_errors: int = 100):
+        self.db = db
+        self.model = model
+        self.validate_row = validate_row
+        self.prepare_chunk = prepare_chunk
+        self.after_insert = after_insert
+        self.after_commit = after_commit
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+
+    def run(self, rows) -> dict:
+        started = time.perf_counter()
+        inserted = rejected = 0
+        errors = []
+
+        def reject(line, message):
+            nonlocal rejected
+            rejected += 1
+            if len(errors) < self.max_errors:
+                errors.append({'line': line, 'error': message})
+
+        for chunk in chunked(rows, self.chunk_size):
+            valid = []
+            for line, row in chunk:
+                if isinstance(row, RowError):
+                    reject(line, str(row))
+                    continue
+                try:
+                    valid.append((line, self.validate_row(row)))
+                except RowError as e:
+                    reject(line, str(e))
+            if self.prepare_chunk is not None and valid:
+                valid, chunk_errors = self.prepare_chunk(valid)
+                for line, message in chunk_errors:
+                    reject(line, message)
+            if not valid:
+                continue
+            try:
+                self.db.session.bulk_insert_mappings(self.model, [mapping for _, mapping in valid])
+                if self.after_insert is not None:
+                    self.after_insert(valid)
+                self.db.session.commit()
+                inserted += len(valid)
+            except Exception as e:
+                self.db.session.rollback()
+                for line, _ in valid:
+                    reject(line, f'Insert failed: {e.__class__.__name__}: {e}'[:300])
+                continue
+            if self.after_commit is not None:
+                self.after_commit(valid)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'inserted': inserted,
+            'rejected': rejected,
+            'errors': errors,
+            'elapsed_s': round(elapsed, 3),
+            'rows_per_s': round((inserted + rejected) / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+# ------------------------------
+# Export
+# ------------------------------
+
+def iter_keyset(query, key_column, chunk_size: int = 1000):
+    """Yield rows of ``query`` in ``key_column`` order, one short query per chunk.
+
+    ``key_column`` must be unique and selected first in ``query``.
+    Unlike one long server-side cursor, no connection or snapshot is held
+    while the client reads a slow response.
+    """
+    last = None
+    while True:
+        page = query.order_by(key_column.asc())
+        if last is not None:
+            page = page.filter(key_column > last)
+        rows = page.limit(chunk_size).all()
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1][0]
+        if len(rows) < chunk_size:
+            return
+
+
+def export_lines(records, fmt: str, fields, dumps):
+    """Encode dict ``records`` as NDJSON lines or CSV (with header), one chunk of bytes at a time."""
+    if fmt == 'ndjson':
+        for record in records:
+            yield dumps(record) + b'\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for record in records:
+        writer.writerow(record)
+        count += 1
+        if count % 500 == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
@@ -0,0 +1,172 @@
+import gzip
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import Response, request
+from werkzeug.http import parse_accept_header
+
+from profiling import CounterMetric, Histogram
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/javascript', 'image/svg+xml')
+# Compressing a listing page takes well under the smallest request latency bucket
+COMPRESSION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+
+
+def matching_etag(if_none_match, etag: str):
+    """The variant of ``etag`` that ``if_none_match`` holds, or None.
+
+    A compressed response carries ``<etag>-<encoding>``, so a client that
+    negotiated gzip revalidates with that; any encoding of the current
+    etag means the client's copy is current.
+    """
+    if not if_none_match or etag is None:
+        return None
+    for candidate in (etag, f'{etag}-br', f'{etag}-gzip'):
+        if if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def not_modified(etag: str, cache_control: str = None) -> Response:
+    response = Response(status=304)
+    response.set_etag(etag)
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def conditional(etag, cache_control):
+    """Answer ``If-None-Match`` with 304 before the view runs, and validate its 200 responses.
+
+    ``etag()`` returns the current validator, or None to send neither a
+    304 nor an ETag. It runs before the view, so a body is never labelled
+    with a newer state than the one it was built from. ``cache_control``
+    is a header value or a callable returning one.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current = etag()
+            control = cache_control() if callable(cache_control) else cache_control
+            if current is not None and matching_etag(request.if_none_match, current):
+                return not_modified(current, control)
+            result = view(*args, **kwargs)
+            response, status = (result[0], result[1]) if isinstance(result, tuple) else (result, None)
+            if isinstance(response, Response) and (status or response.status_code) == 200:
+                if current is not None:
+                    response.set_etag(current)
+                response.headers['Cache-Control'] = control
+            return result
+        return wrapper
+    return decorator
+
+
+class ResponseCompressor:
+    """Compresses response bodies with the best encoding the client accepts.
+
+    Only textual bodies of at least ``min_size`` bytes are compressed;
+    below that the headers cost more than the encoding saves. Brotli is
+    preferred when the ``brotli`` package is installed, then gzip. Streamed
+    responses (the event stream, file downloads) are left alone. A strong
+    ETag gets the encoding appended, since the compressed bytes differ.
+    """
+
+    def __init__(self, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4, enabled: bool = True):
+        self.min_size = min_size
+        self.enabled = enabled
+        self.encoders = {}
+        if brotli is not None:
+            self.encoders['br'] = lambda body: brotli.compress(body, quality=brotli_quality)
+        # mtime=0 keeps the output identical for identical bodies
+        self.encoders['gzip'] = lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        self.bytes = CounterMetric('http_compression_bytes_total', 'Response body bytes before and after '
+                                   'compression.', ('encoding', 'stage'))
+        self.duration = Histogram('http_compression_seconds', 'Time spent compressing a response body.',
+                                  ('encoding',), COMPRESSION_BUCKETS)
+        self.skipped = CounterMetric('http_compression_skipped_total', 'Compressible responses sent as they were.',
+                                     ('reason',))
+        self._totals = Counter()
+        self._totals_lock = threading.Lock()
+
+    def init_app(self, app):
+        app.after_request(self.compress_response)
+
+    def negotiate(self, accept_encoding: str):
+        """The preferred encoding among those ``accept_encoding`` allows, or None for identity."""
+        if not accept_encoding:
+            return None
+        accept = parse_accept_header(accept_encoding)
+        best, best_quality = None, 0
+        for name in self.encoders:
+            quality = accept.quality(name)
+            if quality > best_quality:
+                best, best_quality = name, quality
+        return best
+
+    def encode(self, body: bytes, accept_encoding: str):
+        """``(encoding, body)``: ``body`` compressed for ``accept_encoding``, or ``(None, body)`` when not worth it."""
+        if not self.enabled:
+            return None, body
+        if len(body) < self.min_size:
+            self.skipped.inc(('small',))
+            return None, body
+        encoding = self.negotiate(accept_encoding)
+        if encoding is None:
+            self.skipped.inc(('not_accepted',))
+            return None, body
+        started = time.perf_counter()
+        compressed = self.encoders[encoding](body)
+        self.duration.observe((encoding,), time.perf_counter() - started)
+        if len(compressed) >= len(body):
+            self.skipped.inc(('incompressible',))
+            return None, body
+        self.bytes.inc((encoding, 'uncompressed'), len(body))
+        self.bytes.inc((encoding, 'compressed'), len(compressed))
+        with self._totals_lock:
+            self._totals[encoding] += 1
+            self._totals['bytes_saved'] += len(body) - len(compressed)
+        return encoding, compressed
+
+    def compressible(self, mimetype: str) -> bool:
+        return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+    def compress_response(self, response):
+        if not self.enabled:
+            return response
+        etag, weak = response.get_etag()
+        if response.status_code == 304:
+            # Answer with the variant the client revalidated, not the identity etag
+            held = matching_etag(request.if_none_match, etag)
+            if held is not None and held != etag:
+                response.set_etag(held, weak)
+                response.vary.add('Accept-Encoding')
+            return response
+        if not self.compressible(response.mimetype):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not 200 <= response.status_code < 300 or response.status_code in (204, 206) \
+                or response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+        encoding, body = self.encode(response.get_data(), request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag is not None:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+
+    def metrics(self) -> dict:
+        with self._totals_lock:
+            totals = dict(self._totals)
+        return {'enabled': self.enabled, 'min_size': self.min_size, 'encodings': list(self.encoders), **totals}
+
+    def metric_lines(self) -> list:
+        return self.bytes.expose() + self.duration.expose() + self.skipped.expose()
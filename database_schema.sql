@@ -20,6 +20,9 @@ CREATE TABLE IF NOT EXISTS skill_listings (
     description TEXT NOT NULL,
     category VARCHAR(100) NOT NULL,
     location VARCHAR(200),
+    latitude DOUBLE,
+    longitude DOUBLE,
+    geohash VARCHAR(12),
     time_credits INT DEFAULT 0,
     monetary_price DECIMAL(10, 2) DEFAULT 0.00,
     availability VARCHAR(50) DEFAULT 'available',
@@ -33,8 +36,8 @@ CREATE TABLE IF NOT EXISTS skill_listings (
 -- Wallets table
 CREATE TABLE IF NOT EXISTS wallets (
     id INT AUTO_INCREMENT PRIMARY KEY,
-    balance DECIMAL(10, 2) DEFAULT 0.00,
-    time_credits INT DEFAULT 0,
+    balance DECIMAL(10, 2) NOT NULL DEFAULT 0.00,
+    time_credits INT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     user_id INT NOT NULL UNIQUE,
@@ -50,9 +53,11 @@ CREATE TABLE IF NOT EXISTS transactions (
     transaction_type VARCHAR(20) DEFAULT 'skill_exchange',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     completed_at TIMESTAMP NULL,
+    idempotency_key VARCHAR(64),
     from_user_id INT NOT NULL,
     to_user_id INT NOT NULL,
     skill_id INT,
+    UNIQUE KEY uq_transactions_idempotency (from_user_id, idempotency_key),
     FOREIGN KEY (from_user_id) REFERENCES users(id),
     FOREIGN KEY (to_user_id) REFERENCES users(id),
     FOREIGN KEY (skill_id) REFERENCES skill_listings(id)
@@ -68,6 +73,8 @@ CREATE TABLE IF NOT EXISTS reviews (
     reviewed_id INT NOT NULL,
     skill_id INT,
     transaction_id INT,
+    -- Set once the rating is in user_stats (by its review_stats job or rebuild-user-stats)
+    stats_applied BOOLEAN NOT NULL DEFAULT FALSE,
     FOREIGN KEY (reviewer_id) REFERENCES users(id),
     FOREIGN KEY (reviewed_id) REFERENCES users(id),
     FOREIGN KEY (skill_id) REFERENCES skill_listings(id),
@@ -82,6 +89,10 @@ CREATE TABLE IF NOT EXISTS chats (
     user1_id INT NOT NULL,
     user2_id INT NOT NULL,
     skill_id INT,
+    -- Maintained by every send (rebuild with `flask --app app_simple rebuild-chat-counters`)
+    last_message_id INT,
+    user1_received INT NOT NULL DEFAULT 0,
+    user2_received INT NOT NULL DEFAULT 0,
     FOREIGN KEY (user1_id) REFERENCES users(id),
     FOREIGN KEY (user2_id) REFERENCES users(id),
     FOREIGN KEY (skill_id) REFERENCES skill_listings(id)
@@ -102,15 +113,127 @@ CREATE TABLE IF NOT EXISTS messages (
     FOREIGN KEY (receiver_id) REFERENCES users(id)
 );
 
--- Indexes for better performance
-CREATE INDEX idx_skills_provider ON skill_listings(provider_id);
-CREATE INDEX idx_skills_category ON skill_listings(category);
+-- Per-user read position in each chat
+CREATE TABLE IF NOT EXISTS chat_read_cursors (
+    chat_id INT NOT NULL,
+    user_id INT NOT NULL,
+    last_read_message_id INT NOT NULL DEFAULT 0,
+    read_count INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, user_id),
+    FOREIGN KEY (chat_id) REFERENCES chats(id),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Revoked access tokens. Rows without a jti revoke every token issued to the
+-- user before revoked_at; expired rows are purged by the API workers
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    jti VARCHAR(64) UNIQUE,
+    user_id INT NOT NULL,
+    revoked_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Reputation counters, maintained by the review and transaction writes
+-- (rebuild with `flask --app app_simple rebuild-user-stats`)
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INT PRIMARY KEY,
+    review_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    completed_exchanges INT NOT NULL DEFAULT 0,
+    credits_earned INT NOT NULL DEFAULT 0,
+    money_earned DECIMAL(12, 2) NOT NULL DEFAULT 0.00,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Time-decayed trending scores per category/location; score is as of updated_at (UTC)
+CREATE TABLE IF NOT EXISTS trending_counters (
+    dimension VARCHAR(20) NOT NULL,
+    name VARCHAR(200) NOT NULL,
+    score FLOAT NOT NULL DEFAULT 0,
+    updated_at DATETIME NOT NULL,
+    PRIMARY KEY (dimension, name)
+);
+
+-- Precomputed top-k suggestions (rebuild with `flask --app app_simple rebuild-recommendations`)
+CREATE TABLE IF NOT EXISTS skill_neighbors (
+    skill_id INT NOT NULL,
+    neighbor_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    PRIMARY KEY (skill_id, neighbor_id),
+    FOREIGN KEY (skill_id) REFERENCES skill_listings(id),
+    FOREIGN KEY (neighbor_id) REFERENCES skill_listings(id)
+);
+
+CREATE TABLE IF NOT EXISTS user_recommendations (
+    user_id INT NOT NULL,
+    skill_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    PRIMARY KEY (user_id, skill_id),
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (skill_id) REFERENCES skill_listings(id)
+);
+
+-- Side effects queued with the writes that caused them (run by `flask --app app_simple run-jobs`
+-- or the web workers' job threads); run_at is the lease expiry while a job is running
+CREATE TABLE IF NOT EXISTS jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    payload TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    run_at DATETIME NOT NULL,
+    locked_by VARCHAR(32),
+    last_error TEXT,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Applied versions of the migrations in app_simple.py (`flask --app app_simple migrate --status`);
+-- this file is already at the latest one
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INT PRIMARY KEY,
+    description VARCHAR(200) NOT NULL,
+    applied_at DATETIME NOT NULL
+);
+
+INSERT IGNORE INTO schema_migrations (version, description, applied_at) VALUES
+    (1, 'Baseline tables', CURRENT_TIMESTAMP),
+    (2, 'Chat read cursors', CURRENT_TIMESTAMP),
+    (3, 'Message sync indexes', CURRENT_TIMESTAMP),
+    (4, 'Exact wallet balances, one wallet per user, transfer idempotency keys', CURRENT_TIMESTAMP),
+    (5, 'User stats, one review per reviewer and reviewed user', CURRENT_TIMESTAMP),
+    (6, 'Skill suggestion and similar-listing tables', CURRENT_TIMESTAMP),
+    (7, 'Trending counters', CURRENT_TIMESTAMP),
+    (8, 'Listing coordinates and geohash index', CURRENT_TIMESTAMP),
+    (9, 'Revoked tokens', CURRENT_TIMESTAMP),
+    (10, 'Chat unread counters and last-message pointer', CURRENT_TIMESTAMP),
+    (11, 'Job queue, reviews.stats_applied', CURRENT_TIMESTAMP),
+    (12, 'Composite feed, inbox and chat indexes, FULLTEXT listing search', CURRENT_TIMESTAMP),
+    (13, 'updated_at indexes for catalog ETags', CURRENT_TIMESTAMP);
+
+-- Indexes for better performance; keep in step with the models (`flask --app app_simple check-schema`)
+CREATE INDEX idx_skill_listings_feed ON skill_listings(created_at, id, is_active);
+CREATE INDEX idx_skill_listings_category_feed ON skill_listings(category, is_active, created_at, id);
+CREATE INDEX idx_skill_listings_provider_feed ON skill_listings(provider_id, is_active, created_at);
 CREATE INDEX idx_skills_location ON skill_listings(location);
-CREATE INDEX idx_transactions_from_user ON transactions(from_user_id);
-CREATE INDEX idx_transactions_to_user ON transactions(to_user_id);
+CREATE INDEX idx_skill_listings_updated_at ON skill_listings(updated_at);
+CREATE INDEX idx_skill_listings_geo ON skill_listings(geohash, latitude, longitude);
+CREATE FULLTEXT INDEX ft_skill_listings_text ON skill_listings(title, description);
+CREATE INDEX idx_transactions_from_user_feed ON transactions(from_user_id, created_at, id);
+CREATE INDEX idx_transactions_to_user_feed ON transactions(to_user_id, created_at, id);
 CREATE INDEX idx_transactions_status ON transactions(status);
 CREATE INDEX idx_reviews_reviewer ON reviews(reviewer_id);
-CREATE INDEX idx_reviews_reviewed ON reviews(reviewed_id);
-CREATE INDEX idx_messages_chat ON messages(chat_id);
+CREATE INDEX idx_reviews_reviewed_feed ON reviews(reviewed_id, created_at, id);
+CREATE UNIQUE INDEX uq_reviews_reviewer_reviewed ON reviews(reviewer_id, reviewed_id);
+CREATE INDEX idx_messages_chat_id_id ON messages(chat_id, id);
+CREATE INDEX idx_messages_chat_edited ON messages(chat_id, edited_at);
 CREATE INDEX idx_messages_sender ON messages(sender_id);
-CREATE INDEX idx_chats_users ON chats(user1_id, user2_id);
\ No newline at end of file
+CREATE INDEX idx_chats_pair_skill ON chats(user1_id, user2_id, skill_id);
+CREATE INDEX idx_chats_user2_active ON chats(user2_id, is_active);
+CREATE INDEX idx_revoked_tokens_user ON revoked_tokens(user_id);
+CREATE INDEX idx_revoked_tokens_expires ON revoked_tokens(expires_at);
+CREATE INDEX idx_user_stats_updated_at ON user_stats(updated_at);
+CREATE INDEX idx_jobs_status_run_at ON jobs(status, run_at);
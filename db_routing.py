@@ -0,0 +1,257 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from response_cache import LRUCache
+
+# Checkout wait histogram bounds in seconds (cumulative, Prometheus style)
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# asyncio DBAPI used for each backend by the ASGI entry point
+ASYNC_DRIVERS = {'mysql': 'aiomysql', 'mariadb': 'aiomysql', 'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+
+# ------------------------------
+# Pool configuration and instrumentation
+# ------------------------------
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout took, including waits for a free slot."""
+
+    on_checkout = None  # callable(pool, seconds, timed_out), set by PoolMetrics.instrument
+
+    def __init__(self, creator, pool_size: int = 5, max_overflow: int = 10, **kwargs):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kwargs)
+        self.capacity = None if max_overflow < 0 else pool_size + max_overflow
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.on_checkout is not None:
+                self.on_checkout(self, time.perf_counter() - started, True)
+            raise
+        if self.on_checkout is not None:
+            self.on_checkout(self, time.perf_counter() - started, False)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.on_checkout = self.on_checkout
+        return pool
+
+
+def in_memory_sqlite(url: str) -> bool:
+    parsed = make_url(url)
+    return parsed.drivername.startswith('sqlite') and parsed.database in (None, '', ':memory:')
+
+
+def engine_options(url: str, pool_size: int, max_overflow: int, pool_timeout: float, pool_recycle: int,
+                   pre_ping: bool) -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS for ``url``.
+
+    In-memory SQLite keeps Flask-SQLAlchemy's single shared connection, so
+    only pre-ping applies there.
+    """
+    options = {'pool_pre_ping': pre_ping}
+    if in_memory_sqlite(url):
+        return options
+    options.update(poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                   pool_timeout=pool_timeout, pool_recycle=pool_recycle)
+    return options
+
+
+def async_database_url(url: str) -> str:
+    """``url`` with its driver swapped for the asyncio one, e.g. ``mysql+pymysql`` -> ``mysql+aiomysql``."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No asyncio driver known for {backend}; set ASYNC_DATABASE_URL')
+    if in_memory_sqlite(url):
+        raise ValueError('An in-memory SQLite database cannot be shared with the async engine')
+    return parsed.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}').render_as_string(hide_password=False)
+
+
+def async_engine_options(url: str, **pool_settings) -> dict:
+    """``engine_options`` for ``create_async_engine``, which brings its own asyncio-aware pool class."""
+    options = engine_options(url, **pool_settings)
+    options.pop('poolclass', None)
+    return options
+
+
+class PoolMetrics:
+    """Checkout counts, wait times and saturation for every engine's pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def instrument(self, name: str, engine):
+        stats = {'checkouts': 0, 'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                 'wait_buckets': [0] * len(WAIT_BUCKETS), 'peak_checked_out': 0}
+        with self._lock:
+            self._pools[name] = (engine, stats)
+
+        def on_checkout(pool, seconds, timed_out):
+            checked_out = pool.checkedout()
+            with self._lock:
+                stats['checkouts'] += 1
+                stats['timeouts'] += timed_out
+                stats['wait_seconds'] += seconds
+                stats['max_wait_seconds'] = max(stats['max_wait_seconds'], seconds)
+                stats['peak_checked_out'] = max(stats['peak_checked_out'], checked_out)
+                for i, bound in enumerate(WAIT_BUCKETS):
+                    if seconds <= bound:
+                        stats['wait_buckets'][i] += 1
+
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.on_checkout = on_checkout
+
+    def snapshot(self) -> dict:
+        result = {}
+        with self._lock:
+            pools = {name: (engine, dict(stats, wait_buckets=list(stats['wait_buckets'])))
+                     for name, (engine, stats) in self._pools.items()}
+        for name, (engine, stats) in pools.items():
+            pool = engine.pool
+            capacity = getattr(pool, 'capacity', None)
+            checked_out = pool.checkedout() if isinstance(pool, QueuePool) else None
+            checkouts = stats.pop('checkouts')
+            result[name] = {
+                'pool': type(pool).__name__,
+                'size': pool.size() if isinstance(pool, QueuePool) else None,
+                'capacity': capacity,
+                'checked_out': checked_out,
+                'saturation': round(checked_out / capacity, 3) if capacity and checked_out is not None else None,
+                'checkouts': checkouts,
+                'mean_wait_ms': round(stats['wait_seconds'] / checkouts * 1000, 3) if checkouts else 0.0,
+                'max_wait_ms': round(stats.pop('max_wait_seconds') * 1000, 3),
+                'wait_seconds_buckets': dict(zip((str(b) for b in WAIT_BUCKETS), stats.pop('wait_buckets'))),
+                **stats,
+            }
+        return result
+
+
+# ------------------------------
+# Read replica routing
+# ------------------------------
+
+class ReplicaRouter:
+    """Send the queries of read-only views to replica binds, everything else to the primary.
+
+    A view opts in with ``read_only``. Its statements still go to the
+    primary once the session has written (flushes and DML always do),
+    inside ``primary()``, and for ``sticky_seconds`` after the same user
+    committed a write, so users read their own writes even while replicas
+    lag. Stickiness is kept per worker, and also in ``shared`` (e.g. the
+    response cache's Redis tier) when one is given so it holds across workers.
+    """
+
+    def __init__(self, replica_keys, sticky_seconds: float = 5.0, identity=None, shared=None,
+                 maxsize: int = 10000):
+        self.replica_keys = list(replica_keys)
+        self.sticky_seconds = sticky_seconds
+        self.identity = identity or (lambda: None)
+        self.shared = shared
+        self._sticky = LRUCache(maxsize)
+        self.replica_reads = 0
+        self.sticky_reads = 0
+
+    def session_class(self):
+        router = self
+
+        class RoutingSession(Session):
+            def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+                if getattr(clause, 'is_dml', False):
+                    self.info['wrote'] = True  # session.execute(update(...)) never flushes
+                elif bind is None and router._use_replica(self):
+                    return self._db.engines[random.choice(router.replica_keys)]
+                return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+        event.listen(RoutingSession, 'before_flush', self._on_write)
+        event.listen(RoutingSession, 'after_commit', self._on_commit)
+        event.listen(RoutingSession, 'after_rollback', lambda session: session.info.pop('wrote', None))
+        return RoutingSession
+
+    def read_only(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g._db_read_only = True
+            return view(*args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def primary(self):
+        previous = g.get('_db_primary', False)
+        g._db_primary = True
+        try:
+            yield
+        finally:
+            g._db_primary = previous
+
+    def _on_write(self, session, *args):
+        session.info['wrote'] = True
+
+    def _on_commit(self, session):
+        if not session.info.pop('wrote', False) or not self.replica_keys or not has_request_context():
+            return
+        user = self._user()
+        if user is None:
+            return
+        self.wrote(user)
+
+    def wrote(self, user):
+        """Keep ``user``'s reads on the primary for ``sticky_seconds``; for writes made outside this router."""
+        if not self.replica_keys:
+            return
+        self._sticky.set(user, True, self.sticky_seconds)
+        if self.shared is not None:
+            try:
+                self.shared.set(f'db-sticky:{user}', 1, self.sticky_seconds)
+            except Exception:
+                pass  # this worker still honours it
+
+    def _user(self):
+        if '_db_user' not in g:
+            try:
+                g._db_user = self.identity()
+            except Exception:
+                g._db_user = None
+        return g._db_user
+
+    def _is_sticky(self, user) -> bool:
+        if self._sticky.get(user):
+            return True
+        if self.shared is not None:
+            try:
+                return bool(self.shared.get(f'db-sticky:{user}'))
+            except Exception:
+                return True  # cannot tell whether replicas are safe to read
+        return False
+
+    def _use_replica(self, session) -> bool:
+        if not self.replica_keys or not has_request_context() or not g.get('_db_read_only'):
+            return False
+        if g.get('_db_primary') or session.info.get('wrote'):
+            return False
+        if '_db_replica_ok' not in g:
+            user = self._user()
+            g._db_replica_ok = user is None or not self._is_sticky(user)
+            if g._db_replica_ok:
+                self.replica_reads += 1
+            else:
+                self.sticky_reads += 1
+        return g._db_replica_ok
+
+    def metrics(self) -> dict:
+        return {'replicas': len(self.replica_keys), 'replica_requests': self.replica_reads,
+                'sticky_primary_requests': self.sticky_reads}
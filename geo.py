@@ -0,0 +1,171 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 9  # ~5m cells, stored per listing; queries use shorter prefixes
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+class InvalidLocation(ValueError):
+    pass
+
+
+# Byte -> the same bits spread to the even positions of 16 bits, for interleaving
+_SPREAD = [int(''.join(c + '0' for c in format(b, '08b')), 2) >> 1 for b in range(256)]
+
+
+def _spread(value: int) -> int:
+    out = shift = 0
+    while value:
+        out |= _SPREAD[value & 255] << shift
+        value >>= 8
+        shift += 16
+    return out
+
+
+def _cell_index(value: float, low: float, span: float, bits: int) -> int:
+    """Which of ``2**bits`` equal cells from ``low`` holds ``value``, as bisection decides it.
+
+    Rounding can put a value next to an edge one cell off. The edges, like
+    bisection's midpoints, are exact floats, so comparing against them fixes it.
+    """
+    cells = 1 << bits
+    index = min(int((value - low) * cells / span), cells - 1)
+    if index > 0 and value < low + span * index / cells:
+        index -= 1
+    elif index < cells - 1 and value >= low + span * (index + 1) / cells:
+        index += 1
+    return index
+
+
+def encode(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Standard geohash: interleaved lon/lat bisection bits, 5 per base32 character.
+
+    Taking each coordinate's cell index gives the same bits as bisecting
+    one bit at a time, and table-driven interleaving keeps bulk imports
+    from spending most of their time here.
+    """
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    lat_index = _cell_index(lat, -90.0, 180.0, lat_bits)
+    lon_index = _cell_index(lon, -180.0, 360.0, lon_bits)
+    # Longitude takes the first (odd) bit; pad latitude to the same width, then drop the padding
+    code = (_spread(lon_index) << 1 | _spread(lat_index << (lon_bits - lat_bits))) >> (2 * lon_bits - bits)
+    return ''.join([_BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5)])
+
+
+def cell_size(precision: int):
+    """(lat_degrees, lon_degrees) spanned by one geohash cell of ``precision`` characters."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_km_many(lat: float, lon: float, lats, lons) -> np.ndarray:
+    """Vectorized ``haversine_km`` from one point to arrays of points."""
+    phi1, phi2 = math.radians(lat), np.radians(np.asarray(lats, dtype=np.float64))
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(d_phi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float):
+    """(min_lat, max_lat, min_lon, max_lon) containing the circle; longitudes may fall outside +-180."""
+    d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, max_lat, -180.0, 180.0
+    d_lon = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(max(abs(min_lat), abs(max_lat))))))
+    if d_lon >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - d_lon, lon + d_lon
+
+
+def covering_prefixes(lat: float, lon: float, radius_km: float, max_cells: int = 32):
+    """Geohash prefixes whose cells together cover the circle, using the longest prefix that needs <= max_cells.
+
+    Each prefix becomes one index range scan, so longer prefixes mean fewer
+    rows read outside the circle.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    best = None
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        cell_lat, cell_lon = cell_size(precision)
+        rows = math.floor(max_lat / cell_lat) - math.floor(min_lat / cell_lat) + 1
+        cols = math.floor(max_lon / cell_lon) - math.floor(min_lon / cell_lon) + 1
+        if rows * cols > max_cells:
+            break
+        best = precision
+    if best is None:
+        return ['']  # the circle spans too much of the globe; scan everything
+
+    cell_lat, cell_lon = cell_size(best)
+    prefixes = set()
+    lat_index = math.floor(min_lat / cell_lat)
+    while lat_index * cell_lat <= max_lat:
+        cell_center_lat = min(max((lat_index + 0.5) * cell_lat, -90.0), 90.0)
+        lon_index = math.floor(min_lon / cell_lon)
+        while lon_index * cell_lon <= max_lon:
+            cell_center_lon = (lon_index + 0.5) * cell_lon
+            cell_center_lon = (cell_center_lon + 180.0) % 360.0 - 180.0
+            prefixes.add(encode(cell_center_lat, cell_center_lon, best))
+            lon_index += 1
+        lat_index += 1
+    return sorted(prefixes)
+
+
+def prefix_range(prefix: str):
+    """``(low, high)`` such that geohashes starting with ``prefix`` are exactly those with ``low <= g < high``.
+
+    ``high`` is the next prefix in base32 order (``None`` after ``'zz…'``).
+    It uses only digits and lowercase letters, which sort the same way in
+    binary and in case- and accent-insensitive collations such as MySQL's
+    utf8mb4_0900_ai_ci, so the comparison is right whatever the column's
+    collation is, and each range stays an index range scan.
+    """
+    stem = prefix
+    while stem and stem[-1] == _BASE32[-1]:
+        stem = stem[:-1]
+    if not stem:
+        return prefix, None
+    return prefix, stem[:-1] + _BASE32[_BASE32.index(stem[-1]) + 1]
+
+
+def parse_coordinates(lat, lon):
+    """Validate a latitude/longitude pair; both None means "no location"."""
+    if lat is None and lon is None:
+        return None
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError) as e:
+        raise InvalidLocation('latitude and longitude must both be numbers') from e
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise InvalidLocation('latitude and longitude must be finite numbers')
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise InvalidLocation('latitude must be within +-90 and longitude within +-180')
+    return lat, lon
+
+
+def parse_near(near: str, radius_km, default_radius_km: float, max_radius_km: float):
+    """Parse ``near=lat,lon`` and ``radius_km`` into ``(lat, lon, radius_km)``."""
+    parts = (near or '').split(',')
+    if len(parts) != 2:
+        raise InvalidLocation('near must be "lat,lon"')
+    lat, lon = parse_coordinates(parts[0].strip(), parts[1].strip())
+    try:
+        radius = float(radius_km) if radius_km not in (None, '') else default_radius_km
+    except (TypeError, ValueError) as e:
+        raise InvalidLocation('radius_km must be a number') from e
+    if not 0 < radius <= max_radius_km:
+        raise InvalidLocation(f'radius_km must be greater than 0 and at most {max_radius_km:g}')
+    return lat, lon, radius
@@ -0,0 +1,82 @@
+import re
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+_WHITESPACE = re.compile(r'\s+')
+_SQLITE_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+_SQLITE_SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+class IndexAdvisor:
+    """EXPLAINs the SELECTs a block of code runs and flags full table scans and sorts without an index.
+
+    Statements are captured with their parameters from engine events, so
+    the plans are for the exact SQL the routes generate. Plans are read
+    per dialect: SQLite ``EXPLAIN QUERY PLAN``, MySQL ``EXPLAIN`` (``type``
+    ALL) and PostgreSQL ``EXPLAIN`` (``Seq Scan``).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.captured = {}  # label -> [(statement, parameters)]
+        self._label = None
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self._label is not None and not executemany and statement.lstrip()[:6].upper() == 'SELECT':
+            statements = self.captured.setdefault(self._label, [])
+            if all(statement != seen for seen, _ in statements):
+                statements.append((statement, parameters))
+
+    @contextmanager
+    def capture(self, label: str):
+        """Record the distinct SELECTs run inside the block under ``label``."""
+        self._label = label
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        try:
+            yield
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+            self._label = None
+
+    def explain(self, statement: str, parameters):
+        """``(plan_lines, problems)`` for one statement; each problem is ``(table, description)``."""
+        dialect = self.engine.dialect.name
+        with self.engine.connect() as conn:
+            if dialect == 'sqlite':
+                rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+                lines = [row[-1] for row in rows]
+                # Reading a subquery's own rows back is not a table scan
+                subqueries = {m.group(1) for m in map(_SQLITE_SUBQUERY.match, lines) if m}
+                problems = [(m.group(1), f'full scan of {m.group(1)}') for m in map(_SQLITE_SCAN.match, lines)
+                            if m and m.group(1) not in subqueries]
+                problems += [(None, line.lower()) for line in lines if line.startswith('USE TEMP B-TREE')]
+            elif dialect in ('mysql', 'mariadb'):
+                rows = conn.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings().all()
+                lines = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} "
+                         f"{row.get('Extra') or ''}".strip() for row in rows]
+                problems = [(row['table'], f"full scan of {row['table']} (~{row['rows']} rows)") for row in rows
+                            if row['type'] == 'ALL']
+                problems += [(row['table'], f"filesort on {row['table']}") for row in rows
+                             if 'filesort' in (row.get('Extra') or '')]
+            elif dialect == 'postgresql':
+                lines = [row[0] for row in conn.exec_driver_sql('EXPLAIN ' + statement, parameters).all()]
+                problems = [(table, f'full scan of {table}') for line in lines for table in _POSTGRES_SCAN.findall(line)]
+            else:
+                raise ValueError(f'EXPLAIN is not supported for {dialect}')
+            conn.rollback()
+        return lines, problems
+
+    def report(self, ignore_tables=()):
+        """``[(label, statement, plan_lines, problems)]`` for everything captured, worst first.
+
+        Scans of ``ignore_tables`` (small lookup tables, say) are not reported.
+        """
+        results = []
+        for label, statements in self.captured.items():
+            for statement, parameters in statements:
+                lines, problems = self.explain(statement, parameters)
+                problems = [text for table, text in problems if table not in ignore_tables]
+                results.append((label, _WHITESPACE.sub(' ', statement).strip(), lines, problems))
+        return sorted(results, key=lambda result: -len(result[3]))
@@ -0,0 +1,262 @@
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from profiling import LATENCY_BUCKETS, CounterMetric, Histogram, format_metric
+
+logger = logging.getLogger(__name__)
+
+# Enqueue-to-start delays are longer than request latencies once retries and backlogs are involved
+WAIT_BUCKETS = LATENCY_BUCKETS + (30.0, 60.0, 300.0, 900.0)
+
+
+def _utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def _timestamp(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class JobQueue:
+    """Durable queue for the side effects of writes, stored as ``model`` rows.
+
+    ``enqueue`` only adds a row to the caller's session, so a job commits or
+    rolls back with the write that caused it and the request pays for one
+    INSERT however slow the side effect is. Workers lease due rows in
+    batches (``SKIP LOCKED`` where the database has it) and run each handler
+    in a transaction that also deletes its job. A failed job is retried
+    after an exponential backoff with jitter; after ``max_attempts`` its row
+    stays behind with status ``failed``. A worker that dies mid-job loses
+    its lease after ``lease_seconds`` and the job runs again, so handlers
+    with effects outside the database must be idempotent.
+
+    ``start`` runs worker threads in this process, woken as soon as a
+    session that enqueued commits. With ``eager`` jobs run at the end of
+    the request that enqueued them instead (tests, in-memory SQLite).
+    """
+
+    def __init__(self, db, model, max_attempts: int = 5, backoff_seconds: float = 2.0,
+                 backoff_max_seconds: float = 300.0, lease_seconds: float = 60.0, poll_seconds: float = 1.0,
+                 batch_size: int = 20, eager: bool = False):
+        self.db = db
+        self.Job = model
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.eager = eager
+        self._handlers = {}
+        self._app = None
+        self._worker_count = 0
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._local = threading.local()
+        self._totals = Counter()
+        self._totals_lock = threading.Lock()
+        self.outcomes = CounterMetric('jobs_total', 'Job runs by outcome.', ('job', 'outcome'))
+        self.duration = Histogram('job_duration_seconds', 'Time spent running a job handler.', ('job',),
+                                  LATENCY_BUCKETS)
+        self.wait = Histogram('job_wait_seconds', 'Time from enqueue to the first run of a job.', ('job',),
+                              WAIT_BUCKETS)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', lambda session: session.info.pop('jobs_enqueued', None))
+
+    def init_app(self, app, workers: int = 1):
+        """Run jobs for ``app``: ``workers`` local threads started on the first enqueue (0 = none), or eagerly."""
+        self._app = app
+        self._worker_count = workers
+        if self.eager:
+            app.after_request(self._run_eager)
+
+    def task(self, name: str):
+        """Register ``handler(**payload)`` for jobs called ``name``; it runs with ``db.session`` open."""
+        def decorator(handler):
+            self._handlers[name] = handler
+            return handler
+        return decorator
+
+    def enqueue(self, session, name: str, payload: dict = None, delay: float = 0.0):
+        """Add a job to ``session``'s transaction; it becomes visible to workers when the caller commits."""
+        if name not in self._handlers:
+            raise LookupError(f'No handler registered for job {name!r}')
+        now = time.time()
+        session.add(self.Job(name=name, payload=json.dumps(payload or {}), status='pending', attempts=0,
+                             run_at=_utc(now + delay), created_at=_utc(now)))
+        session.info['jobs_enqueued'] = True
+
+    # Running jobs
+    def run_due(self) -> int:
+        """Lease and run one batch of due jobs in the current app context; returns how many were leased."""
+        session = self.db.session
+        jobs = self._lease(session)
+        for job in jobs:
+            self._run(session, job)
+        return len(jobs)
+
+    def run_until_empty(self, limit: int = None) -> int:
+        ran = 0
+        while limit is None or ran < limit:
+            leased = self.run_due()
+            if not leased:
+                break
+            ran += leased
+        return ran
+
+    def _lease(self, session):
+        table = self.Job.__table__
+        now = time.time()
+        # Running rows whose lease ran out belong to a worker that died or hung
+        due = (table.c.status.in_(('pending', 'running')), table.c.run_at <= _utc(now))
+        ids = session.execute(select(table.c.id).where(*due).order_by(table.c.run_at).limit(self.batch_size)
+                              .with_for_update(skip_locked=True)).scalars().all()
+        if not ids:
+            session.rollback()
+            return []
+        lease = uuid.uuid4().hex
+        session.execute(update(table).where(table.c.id.in_(ids), *due).values(
+            status='running', locked_by=lease, attempts=table.c.attempts + 1,
+            run_at=_utc(now + self.lease_seconds)))
+        jobs = session.execute(select(table).where(table.c.locked_by == lease).order_by(table.c.id)).all()
+        session.commit()
+        return jobs
+
+    def _run(self, session, job):
+        table = self.Job.__table__
+        started = time.time()
+        if job.attempts == 1:
+            self.wait.observe((job.name,), max(started - _timestamp(job.created_at), 0.0))
+        try:
+            handler = self._handlers.get(job.name)
+            if handler is None:
+                raise LookupError(f'No handler registered for job {job.name!r}')
+            if job.attempts > self.max_attempts:
+                raise RuntimeError('Lease expired on every attempt')
+            handler(**json.loads(job.payload))
+            # Under our lease only: if it expired and another worker took the job, commit none of this run
+            if not session.execute(delete(table).where(table.c.id == job.id,
+                                                       table.c.locked_by == job.locked_by)).rowcount:
+                session.rollback()
+                outcome = 'lease_lost'
+            else:
+                session.commit()
+                outcome = 'succeeded'
+        except Exception as e:
+            session.rollback()
+            outcome = self._release(session, job, e)
+        self.duration.observe((job.name,), time.time() - started)
+        self.outcomes.inc((job.name, outcome))
+        with self._totals_lock:
+            self._totals[outcome] += 1
+
+    def _release(self, session, job, error: Exception) -> str:
+        table = self.Job.__table__
+        failed = job.attempts >= self.max_attempts
+        values = {'status': 'failed' if failed else 'pending', 'locked_by': None,
+                  'last_error': f'{type(error).__name__}: {error}'[:2000]}
+        if not failed:
+            delay = min(self.backoff_seconds * 2 ** (job.attempts - 1), self.backoff_max_seconds)
+            values['run_at'] = _utc(time.time() + delay * random.uniform(0.5, 1.0))
+        logger.log(logging.ERROR if failed else logging.WARNING, 'Job %s (%s) failed on attempt %d%s: %s',
+                   job.id, job.name, job.attempts, ', giving up' if failed else '', error)
+        session.execute(update(table).where(table.c.id == job.id, table.c.locked_by == job.locked_by)
+                        .values(**values))
+        session.commit()
+        return 'failed' if failed else 'retried'
+
+    def retry_failed(self, name: str = None) -> int:
+        """Give failed jobs (all, or those called ``name``) a fresh set of attempts."""
+        table = self.Job.__table__
+        statement = update(table).where(table.c.status == 'failed')
+        if name:
+            statement = statement.where(table.c.name == name)
+        count = self.db.session.execute(statement.values(status='pending', attempts=0,
+                                                         run_at=_utc(time.time()))).rowcount
+        self.db.session.commit()
+        return count
+
+    # Local workers
+    def start(self, app=None, workers: int = None):
+        app = app or self._app
+        workers = self._worker_count if workers is None else workers
+        with self._start_lock:
+            if self._threads or workers <= 0:
+                return
+            self._stopping.clear()
+            for i in range(workers):
+                thread = threading.Thread(target=self._work, args=(app,), name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def join(self):
+        for thread in list(self._threads):
+            thread.join()
+
+    def _work(self, app):
+        while not self._stopping.is_set():
+            try:
+                with app.app_context():
+                    leased = self.run_due()
+            except Exception:
+                logger.exception('Job worker failed to run a batch')
+                leased = 0
+            if not leased:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def _after_commit(self, session):
+        if not session.info.pop('jobs_enqueued', False):
+            return
+        if self.eager:
+            self._local.pending = True
+        elif self._worker_count > 0 and self._app is not None:
+            if not self._threads:
+                self.start()
+            self._wake.set()
+
+    def _run_eager(self, response):
+        if getattr(self._local, 'pending', False):
+            self._local.pending = False
+            try:
+                self.run_until_empty()
+            except Exception:
+                logger.exception('Running jobs for this request failed')
+        return response
+
+    # Metrics
+    def depth(self) -> dict:
+        """Queued jobs as ``{(name, status): count}``; one grouped query over the (small) table."""
+        table = self.Job.__table__
+        rows = self.db.session.execute(select(table.c.name, table.c.status, func.count())
+                                       .group_by(table.c.name, table.c.status)).all()
+        return {(name, status): count for name, status, count in rows}
+
+    def metrics(self) -> dict:
+        with self._totals_lock:
+            totals = dict(self._totals)
+        return {'workers': len(self._threads), 'eager': self.eager, **totals}
+
+    def metric_lines(self) -> list:
+        return (self.outcomes.expose() + self.duration.expose() + self.wait.expose()
+                + format_metric('jobs_queued', 'gauge', 'Jobs in the queue table by status.',
+                                [({'job': name, 'status': status}, count)
+                                 for (name, status), count in sorted(self.depth().items())]))
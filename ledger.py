@@ -0,0 +1,251 @@
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+CENT = Decimal('0.01')
+TRANSACTION_TYPES = ('skill_exchange', 'recharge', 'withdrawal')
+
+# MySQL deadlock / lock wait timeout, and SQLite's "database is locked"
+_RETRYABLE_ERRORS = ('1213', '1205', 'database is locked', 'deadlock')
+
+
+class LedgerError(Exception):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+def to_amount(value) -> Decimal:
+    try:
+        amount = Decimal(str(value if value is not None else 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation as e:
+        raise LedgerError('Invalid amount') from e
+    if amount < 0:
+        raise LedgerError('Amounts must not be negative')
+    return amount
+
+
+def to_credits(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise LedgerError('time_credits must be a non-negative integer')
+    return value
+
+
+class Ledger:
+    """Moves money and time credits between wallets without lost updates.
+
+    Every transfer, whether immediate or settled in batches, follows the same rules:
+
+    * the wallet rows involved are locked with one ``SELECT ... FOR UPDATE``
+      ordered by user_id, so two transfers touching the same wallets always
+      take the locks in the same order and cannot deadlock each other;
+    * balances change only through relative ``UPDATE ... SET balance = balance - :x``
+      statements that are guarded by ``balance >= :x``, so even a backend
+      without row locks (SQLite) cannot overdraw or lose an update;
+    * an optional idempotency key makes retries of the same request return
+      the original transaction.
+    """
+
+    def __init__(self, db, wallet_model, transaction_model, max_retries: int = 3, on_completed=None):
+        self.db = db
+        self.Wallet = wallet_model
+        self.Transaction = transaction_model
+        self.max_retries = max_retries
+        # Called with the newly completed transactions just before commit, so
+        # derived data (e.g. user stats) lands in the same DB transaction
+        self.on_completed = on_completed
+
+    # ------------------------------
+    # Internals
+    # ------------------------------
+
+    def _lock_wallets(self, user_ids, strict: bool = True):
+        Wallet = self.Wallet
+        wallets = Wallet.query \
+            .filter(Wallet.user_id.in_(sorted(set(user_ids)))) \
+            .order_by(Wallet.user_id.asc()) \
+            .with_for_update() \
+            .all()
+        by_user = {w.user_id: w for w in wallets}
+        missing = set(user_ids) - set(by_user)
+        if missing and strict:
+            raise LedgerError(f'Wallet not found for user {min(missing)}')
+        return by_user
+
+    def _apply_delta(self, user_id: int, amount_delta: Decimal, credit_delta: int):
+        Wallet = self.Wallet
+        result = self.db.session.execute(
+            update(Wallet)
+            .where(Wallet.user_id == user_id,
+                   Wallet.balance + amount_delta >= 0,
+                   Wallet.time_credits + credit_delta >= 0)
+            .values(balance=Wallet.balance + amount_delta,
+                    time_credits=Wallet.time_credits + credit_delta,
+                    updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            raise InsufficientFunds('Insufficient balance')
+
+    def _movements(self, tx):
+        """(debit_user, credit_user) for a transaction type; None means the outside world."""
+        if tx.transaction_type == 'recharge':
+            return None, tx.to_user_id
+        if tx.transaction_type == 'withdrawal':
+            return tx.from_user_id, None
+        return tx.from_user_id, tx.to_user_id
+
+    def _find_by_key(self, from_user_id: int, idempotency_key: str):
+        Transaction = self.Transaction
+        return Transaction.query.filter_by(from_user_id=from_user_id, idempotency_key=idempotency_key).first()
+
+    def _with_retries(self, fn):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn()
+            except OperationalError as e:
+                self.db.session.rollback()
+                if attempt == self.max_retries or not any(code in str(e.orig) for code in _RETRYABLE_ERRORS):
+                    raise
+                time.sleep(0.01 * 2 ** attempt)
+
+    # ------------------------------
+    # Public API
+    # ------------------------------
+
+    def transfer(self, from_user_id: int, to_user_id: int, amount=0, time_credits=0,
+                 transaction_type: str = 'skill_exchange', skill_id: int = None,
+                 idempotency_key: str = None, settle: bool = True):
+        """Record a transfer and, unless ``settle`` is False, apply it in the same DB transaction.
+
+        Returns ``(transaction, created)``; ``created`` is False for an idempotent replay.
+        """
+        if transaction_type not in TRANSACTION_TYPES:
+            raise LedgerError(f'Unknown transaction type: {transaction_type}')
+        amount = to_amount(amount)
+        credits = to_credits(time_credits)
+        if amount == 0 and credits == 0:
+            raise LedgerError('Transfer must move money or time credits')
+        if transaction_type == 'skill_exchange' and from_user_id == to_user_id:
+            raise LedgerError('Cannot transfer to yourself')
+
+        if idempotency_key:
+            existing = self._find_by_key(from_user_id, idempotency_key)
+            if existing is not None:
+                return existing, False
+
+        def attempt():
+            tx = self.Transaction()
+            tx.from_user_id = from_user_id
+            tx.to_user_id = to_user_id
+            tx.amount = amount
+            tx.time_credits = credits
+            tx.transaction_type = transaction_type
+            tx.skill_id = skill_id
+            tx.idempotency_key = idempotency_key
+            tx.status = 'pending'
+            self.db.session.add(tx)
+            if settle:
+                debit_user, credit_user = self._movements(tx)
+                self._lock_wallets([u for u in (debit_user, credit_user) if u is not None])
+                if debit_user is not None:
+                    self._apply_delta(debit_user, -amount, -credits)
+                if credit_user is not None:
+                    self._apply_delta(credit_user, amount, credits)
+                tx.status = 'completed'
+                tx.completed_at = datetime.utcnow()
+                if self.on_completed is not None:
+                    self.on_completed([tx])
+            self.db.session.commit()
+            return tx
+
+        try:
+            return self._with_retries(attempt), True
+        except IntegrityError:
+            # Lost an idempotency-key race with a concurrent identical request
+            self.db.session.rollback()
+            existing = self._find_by_key(from_user_id, idempotency_key) if idempotency_key else None
+            if existing is None:
+                raise
+            return existing, False
+        except Exception:
+            self.db.session.rollback()
+            raise
+
+    def settle_pending(self, batch_size: int = 500):
+        """Settle up to ``batch_size`` pending transactions in one DB transaction.
+
+        Transactions are applied in id order against the locked balances, and
+        any that would overdraw are marked failed. Each wallet then receives a
+        single net UPDATE, so a batch costs O(wallets) writes, not O(transactions).
+        Returns ``(completed, failed)`` counts.
+        """
+        Transaction = self.Transaction
+
+        def attempt():
+            pending = Transaction.query \
+                .filter(Transaction.status == 'pending') \
+                .order_by(Transaction.id.asc()) \
+                .limit(batch_size) \
+                .with_for_update(skip_locked=True) \
+                .all()
+            if not pending:
+                return 0, 0
+
+            user_ids = set()
+            for tx in pending:
+                user_ids.update(u for u in self._movements(tx) if u is not None)
+            wallets = self._lock_wallets(user_ids, strict=False)
+            balances = {uid: [to_amount(w.balance), w.time_credits or 0] for uid, w in wallets.items()}
+            deltas = defaultdict(lambda: [Decimal('0.00'), 0])
+
+            completed = failed = 0
+            completed_txs = []
+            now = datetime.utcnow()
+            for tx in pending:
+                amount, credits = to_amount(tx.amount), tx.time_credits or 0
+                debit_user, credit_user = self._movements(tx)
+                if any(u is not None and u not in balances for u in (debit_user, credit_user)):
+                    tx.status = 'failed'
+                    failed += 1
+                    continue
+                if debit_user is not None:
+                    balance = balances[debit_user]
+                    if balance[0] < amount or balance[1] < credits:
+                        tx.status = 'failed'
+                        failed += 1
+                        continue
+                    balance[0] -= amount
+                    balance[1] -= credits
+                    deltas[debit_user][0] -= amount
+                    deltas[debit_user][1] -= credits
+                if credit_user is not None:
+                    balances[credit_user][0] += amount
+                    balances[credit_user][1] += credits
+                    deltas[credit_user][0] += amount
+                    deltas[credit_user][1] += credits
+                tx.status = 'completed'
+                tx.completed_at = now
+                completed += 1
+                completed_txs.append(tx)
+
+            for user_id, (amount_delta, credit_delta) in sorted(deltas.items()):
+                self._apply_delta(user_id, amount_delta, credit_delta)
+            if completed_txs and self.on_completed is not None:
+                self.on_completed(completed_txs)
+            self.db.session.commit()
+            return completed, failed
+
+        try:
+            return self._with_retries(attempt)
+        except Exception:
+            self.db.session.rollback()
+            raise
@@ -0,0 +1,507 @@
+import re
+from datetime import datetime
+from functools import partial
+
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, Numeric, String, Table,
+                        Text, delete, func, inspect, insert, select, update)
+from sqlalchemy.schema import CreateColumn
+
+_CREATE_INDEX_RE = re.compile(r'CREATE\s+(?:(UNIQUE|FULLTEXT)\s+)?INDEX\s+(\w+)\s+ON\s+(\w+)\s*\(([^)]*)\)', re.I)
+_CREATE_TABLE_RE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\((.*?)\n\);', re.I | re.S)
+_COLUMN_RE = re.compile(r'(\w+)\s+(\w+)\s*(?:\(([^)]*)\))?')
+_TABLE_KEYWORDS = ('PRIMARY', 'FOREIGN', 'UNIQUE', 'KEY', 'INDEX', 'FULLTEXT', 'CONSTRAINT', 'CHECK')
+
+
+class Migration:
+    def __init__(self, version: int, description: str, upgrade):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade  # callable(connection)
+
+
+# ------------------------------
+# Runner
+# ------------------------------
+
+class Migrator:
+    """Applies numbered migrations in order and records each in ``schema_migrations``.
+
+    Every migration runs in its own transaction together with its record,
+    so a failed one can be fixed and rerun. MySQL commits DDL implicitly,
+    which is why the operations below check before they create or drop.
+    """
+
+    def __init__(self, engine, migrations):
+        self.engine = engine
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        versions = [m.version for m in self.migrations]
+        if len(set(versions)) != len(versions):
+            raise ValueError('Duplicate migration versions')
+        self.table = Table('schema_migrations', MetaData(),
+                           Column('version', Integer, primary_key=True),
+                           Column('description', String(200), nullable=False),
+                           Column('applied_at', DateTime, nullable=False))
+
+    def applied(self) -> dict:
+        """``{version: applied_at}`` of the migrations this database has had."""
+        with self.engine.connect() as conn:
+            if not inspect(conn).has_table(self.table.name):
+                return {}
+            return dict(conn.execute(select(self.table.c.version, self.table.c.applied_at)).all())
+
+    def pending(self):
+        applied = self.applied()
+        return [m for m in self.migrations if m.version not in applied]
+
+    def upgrade(self, target: int = None):
+        """Apply pending migrations up to ``target`` (default: all); returns the ones applied."""
+        self.table.create(self.engine, checkfirst=True)
+        done = []
+        for migration in self.pending():
+            if target is not None and migration.version > target:
+                break
+            with self.engine.begin() as conn:
+                migration.upgrade(conn)
+                conn.execute(insert(self.table).values(version=migration.version, description=migration.description,
+                                                       applied_at=datetime.utcnow()))
+            done.append(migration)
+        return done
+
+    def stamp(self, version: int):
+        """Record every migration up to ``version`` as applied without running it (databases built from SQL)."""
+        self.table.create(self.engine, checkfirst=True)
+        applied = self.applied()
+        with self.engine.begin() as conn:
+            for migration in self.migrations:
+                if migration.version <= version and migration.version not in applied:
+                    conn.execute(insert(self.table).values(version=migration.version,
+                                                           description=migration.description,
+                                                           applied_at=datetime.utcnow()))
+
+
+# ------------------------------
+# Operations
+# ------------------------------
+
+def dialect_index(*args, dialects=('mysql', 'mariadb'), **kwargs) -> Index:
+    """An index that only exists on ``dialects`` (e.g. a MySQL FULLTEXT index); the sync checks skip it elsewhere."""
+    return Index(*args, info={'dialects': dialects}, **kwargs).ddl_if(dialect=dialects)
+
+
+def _applies(index: Index, dialect_name: str) -> bool:
+    dialects = index.info.get('dialects')
+    return dialects is None or dialect_name in dialects
+
+
+def create_indexes(conn, table: Table, names):
+    """Create the model's indexes called ``names`` on ``table`` unless they exist."""
+    by_name = {index.name: index for index in table.indexes}
+    for name in names:
+        if _applies(by_name[name], conn.dialect.name):
+            by_name[name].create(conn, checkfirst=True)
+
+
+def drop_indexes(conn, table_name: str, names):
+    """Drop the indexes called ``names`` from ``table_name`` if they exist (superseded ones)."""
+    inspector = inspect(conn)
+    if not inspector.has_table(table_name):
+        return
+    existing = {index['name'] for index in inspector.get_indexes(table_name)}
+    quote = conn.dialect.identifier_preparer.quote
+    for name in names:
+        if name not in existing:
+            continue
+        if conn.dialect.name in ('mysql', 'mariadb'):
+            conn.exec_driver_sql(f'DROP INDEX {quote(name)} ON {quote(table_name)}')
+        else:
+            conn.exec_driver_sql(f'DROP INDEX {quote(name)}')
+
+
+def add_columns(conn, table: Table, names):
+    """Add the model's columns called ``names`` to an existing ``table`` unless they exist.
+
+    ``create_all`` skips tables that already exist, so columns added to a
+    model later need this. NOT NULL columns need a ``server_default`` for
+    the rows already there. Returns the names that were added.
+    """
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    quote = conn.dialect.identifier_preparer.quote
+    added = []
+    for name in names:
+        if name not in existing:
+            definition = CreateColumn(table.c[name]).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f'ALTER TABLE {quote(table.name)} ADD COLUMN {definition}')
+            added.append(name)
+    return added
+
+
+def add_unique(conn, table: Table, columns, name: str):
+    """Create a unique index ``name`` on ``columns`` unless some unique constraint or index already covers exactly them."""
+    inspector = inspect(conn)
+    covered = [tuple(c['column_names']) for c in inspector.get_unique_constraints(table.name)]
+    covered += [tuple(i['column_names']) for i in inspector.get_indexes(table.name) if i.get('unique')]
+    if tuple(columns) not in covered:
+        index = Index(name, *(table.c[column] for column in columns), unique=True)
+        index.create(conn)
+        # Building it on the model's columns attached it to the model's table; the models do not declare it
+        table.indexes.discard(index)
+
+
+def alter_column_type(conn, table: Table, name: str):
+    """Give an existing column the model's type and nullability (e.g. a longer VARCHAR, DOUBLE to DECIMAL).
+
+    Skipped when the column already matches. SQLite does not enforce
+    lengths or decimal types, so nothing is changed there.
+    """
+    column = table.c[name]
+    current = next(c for c in inspect(conn).get_columns(table.name) if c['name'] == name)
+    if (type_spec(current['type']), current['nullable']) == (type_spec(column.type), column.nullable):
+        return
+    quote = conn.dialect.identifier_preparer.quote
+    column_type = column.type.compile(dialect=conn.dialect)
+    if conn.dialect.name in ('mysql', 'mariadb'):
+        null = 'NULL' if column.nullable else 'NOT NULL'
+        conn.exec_driver_sql(f'ALTER TABLE {quote(table.name)} MODIFY {quote(name)} {column_type} {null}')
+    elif conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql(f'ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(name)} TYPE {column_type}')
+
+
+# ------------------------------
+# Schema sync checks
+# ------------------------------
+
+def type_spec(column_type):
+    """What the column checks compare of a type: a VARCHAR's length, a DECIMAL's precision and scale.
+
+    Other types map to None; their spelling differs too much between the
+    models, the schema file and each dialect's reflection to compare.
+    """
+    if isinstance(column_type, String) and column_type.length:
+        return f'VARCHAR({column_type.length})'
+    if isinstance(column_type, Numeric) and not isinstance(column_type, Float):
+        return f'DECIMAL({column_type.precision}, {column_type.scale})'
+    return None
+
+
+def _sql_type_spec(name: str, args: str):
+    name = name.upper()
+    if name in ('VARCHAR', 'CHAR') and args:
+        return f'VARCHAR({int(args)})'
+    if name in ('DECIMAL', 'NUMERIC') and args:
+        precision, scale = (int(a) for a in args.split(','))
+        return f'DECIMAL({precision}, {scale})'
+    return None
+
+
+def model_columns(metadata) -> dict:
+    """``{(table, column): type spec}`` for the columns the models declare."""
+    return {(table.name, column.name): type_spec(column.type)
+            for table in metadata.sorted_tables for column in table.columns}
+
+
+def sql_file_columns(text: str) -> dict:
+    """The same mapping for the ``CREATE TABLE`` statements in a schema file."""
+    result = {}
+    for table, body in _CREATE_TABLE_RE.findall(text):
+        for line in body.splitlines():
+            line = line.strip()
+            if not line or line.startswith('--') or line.split()[0].upper() in _TABLE_KEYWORDS:
+                continue
+            match = _COLUMN_RE.match(line)
+            if match:
+                result[(table, match.group(1))] = _sql_type_spec(match.group(2), match.group(3))
+    return result
+
+
+def database_columns(conn, table_names) -> dict:
+    """The same mapping for what the connected database has."""
+    inspector = inspect(conn)
+    result = {}
+    for table in table_names:
+        if not inspector.has_table(table):
+            continue
+        for column in inspector.get_columns(table):
+            result[(table, column['name'])] = type_spec(column['type'])
+    return result
+
+
+def column_drift(expected: dict, actual: dict, where: str, types: bool = True) -> list:
+    """Human-readable differences between two column mappings, for the tables ``expected`` has.
+
+    Types are compared where the models give a length or precision;
+    ``types=False`` compares names only (SQLite keeps whatever type a
+    column was created with).
+    """
+    problems = []
+    tables = {table for table, _ in expected}
+    present = {table for table, _ in actual}
+    for table in sorted(tables - present):
+        problems.append(f'{where}: missing table {table}')
+    for (table, column), spec in sorted(expected.items()):
+        if table not in present:
+            continue
+        if (table, column) not in actual:
+            problems.append(f'{where}: missing column {table}.{column}')
+        elif types and spec is not None and actual[(table, column)] != spec:
+            problems.append(f'{where}: column {table}.{column} is {actual[(table, column)] or "another type"}, '
+                            f'models say {spec}')
+    for table, column in sorted(actual):
+        if table in tables and (table, column) not in expected:
+            problems.append(f'{where}: column {table}.{column} is not in the models')
+    return problems
+
+
+def model_indexes(metadata, dialect_name: str = None) -> dict:
+    """``{name: (table, columns, kind)}`` for the named indexes the models declare."""
+    result = {}
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            if dialect_name is not None and not _applies(index, dialect_name):
+                continue
+            kind = 'UNIQUE' if index.unique else index.dialect_options['mysql'].get('prefix') or ''
+            result[index.name] = (table.name, tuple(c.name for c in index.columns), kind.upper())
+    return result
+
+
+def sql_file_indexes(text: str) -> dict:
+    """The same mapping for the ``CREATE INDEX`` statements in a schema file."""
+    return {name: (table, tuple(c.strip().split()[0] for c in columns.split(',')), (kind or '').upper())
+            for kind, name, table, columns in _CREATE_INDEX_RE.findall(text)}
+
+
+def database_indexes(conn, table_names) -> dict:
+    """The same mapping for what the connected database has, unique constraints included."""
+    inspector = inspect(conn)
+    result = {}
+    for table in table_names:
+        if not inspector.has_table(table):
+            continue
+        for index in inspector.get_indexes(table):
+            kind = 'UNIQUE' if index.get('unique') else (index.get('type') or '').upper()
+            result[index['name']] = (table, tuple(index['column_names']), kind)
+    return result
+
+
+def index_drift(expected: dict, actual: dict, where: str, extra: bool = True) -> list:
+    """Human-readable differences between two index mappings; ``extra`` also reports indexes only ``actual`` has."""
+    problems = []
+    for name, spec in sorted(expected.items()):
+        if name not in actual:
+            problems.append(f'{where}: missing index {name} on {spec[0]}({", ".join(spec[1])})')
+        elif actual[name][:2] != spec[:2]:
+            problems.append(f'{where}: index {name} is on {actual[name][0]}({", ".join(actual[name][1])}), '
+                            f'models say {spec[0]}({", ".join(spec[1])})')
+    for name, spec in sorted(actual.items()) if extra else ():
+        if name not in expected:
+            problems.append(f'{where}: index {name} on {spec[0]}({", ".join(spec[1])}) is not in the models')
+    return problems
+
+
+# ------------------------------
+# Schema history
+# ------------------------------
+
+def baseline_metadata() -> MetaData:
+    """The seven tables as the first release created them; migration 1 must keep building exactly these."""
+    metadata = MetaData()
+    Table('users', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('username', String(80), unique=True, nullable=False),
+          Column('email', String(120), unique=True, nullable=False),
+          Column('password_hash', String(255), nullable=False),
+          Column('phone', String(20), unique=True),
+          Column('role', String(20)),
+          Column('created_at', DateTime),
+          Column('is_active', Boolean))
+    Table('skill_listings', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('title', String(200), nullable=False),
+          Column('description', Text, nullable=False),
+          Column('category', String(100), nullable=False),
+          Column('location', String(200)),
+          Column('time_credits', Integer),
+          Column('monetary_price', Float),
+          Column('availability', String(50)),
+          Column('created_at', DateTime),
+          Column('updated_at', DateTime),
+          Column('is_active', Boolean),
+          Column('provider_id', Integer, ForeignKey('users.id'), nullable=False))
+    Table('wallets', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('balance', Float),
+          Column('time_credits', Integer),
+          Column('created_at', DateTime),
+          Column('updated_at', DateTime),
+          Column('user_id', Integer, ForeignKey('users.id'), nullable=False))
+    Table('transactions', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('amount', Float),
+          Column('time_credits', Integer),
+          Column('status', String(20)),
+          Column('transaction_type', String(20)),
+          Column('created_at', DateTime),
+          Column('completed_at', DateTime),
+          Column('from_user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('to_user_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('skill_id', Integer, ForeignKey('skill_listings.id')))
+    Table('reviews', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('rating', Integer, nullable=False),
+          Column('comment', Text),
+          Column('created_at', DateTime),
+          Column('reviewer_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('reviewed_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('skill_id', Integer, ForeignKey('skill_listings.id')),
+          Column('transaction_id', Integer, ForeignKey('transactions.id')))
+    Table('chats', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('created_at', DateTime),
+          Column('is_active', Boolean),
+          Column('user1_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('user2_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('skill_id', Integer, ForeignKey('skill_listings.id')))
+    Table('messages', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('content', Text, nullable=False),
+          Column('created_at', DateTime),
+          Column('is_edited', Boolean),
+          Column('edited_at', DateTime),
+          Column('chat_id', Integer, ForeignKey('chats.id'), nullable=False),
+          Column('sender_id', Integer, ForeignKey('users.id'), nullable=False),
+          Column('receiver_id', Integer, ForeignKey('users.id'), nullable=False))
+    return metadata
+
+
+# Indexes of the baseline schema file that later ones replace: each was the leading column of its successor
+SUPERSEDED_INDEXES = {
+    'messages': ('idx_messages_chat',),
+    'skill_listings': ('idx_skills_provider', 'idx_skills_category'),
+    'transactions': ('idx_transactions_from_user', 'idx_transactions_to_user'),
+    'reviews': ('idx_reviews_reviewed',),
+    'chats': ('idx_chats_users',),
+}
+
+
+def chat_counter_updates(tables) -> tuple:
+    """UPDATEs recomputing each chat's last message and received counters, and each cursor's read count."""
+    chats, messages, cursors = tables['chats'], tables['messages'], tables['chat_read_cursors']
+
+    def received_by(user_column):
+        return select(func.count(messages.c.id)) \
+            .where(messages.c.chat_id == chats.c.id, messages.c.receiver_id == user_column) \
+            .scalar_subquery()
+
+    return (
+        update(chats).values(
+            last_message_id=select(func.max(messages.c.id)).where(messages.c.chat_id == chats.c.id)
+            .scalar_subquery(),
+            user1_received=received_by(chats.c.user1_id),
+            user2_received=received_by(chats.c.user2_id),
+        ),
+        update(cursors).values(
+            read_count=select(func.count(messages.c.id))
+            .where(messages.c.chat_id == cursors.c.chat_id, messages.c.receiver_id == cursors.c.user_id,
+                   messages.c.id <= cursors.c.last_read_message_id)
+            .scalar_subquery()
+        ),
+    )
+
+
+def create_tables(conn, tables):
+    """Create each of ``tables``, with its indexes, unless it exists."""
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+
+def _message_sync_indexes(tables, conn):
+    # In the schema file since this feature, but never created on databases that began with create_all
+    create_indexes(conn, tables['messages'], ('idx_messages_chat_id_id', 'idx_messages_chat_edited'))
+    drop_indexes(conn, 'messages', SUPERSEDED_INDEXES['messages'])
+
+
+def _wallet_ledger(tables, conn):
+    wallets, transactions = tables['wallets'], tables['transactions']
+    # Float balances become exact decimals, and neither wallet column may be NULL any more
+    conn.execute(update(wallets).where(wallets.c.balance.is_(None)).values(balance=0))
+    conn.execute(update(wallets).where(wallets.c.time_credits.is_(None)).values(time_credits=0))
+    alter_column_type(conn, wallets, 'balance')
+    alter_column_type(conn, wallets, 'time_credits')
+    add_unique(conn, wallets, ('user_id',), 'uq_wallets_user_id')
+    alter_column_type(conn, transactions, 'amount')
+    add_columns(conn, transactions, ('idempotency_key',))
+    add_unique(conn, transactions, ('from_user_id', 'idempotency_key'), 'uq_transactions_idempotency')
+
+
+def _user_stats(tables, conn):
+    reviews = tables['reviews']
+    # Repeat reviews from before the index: keep each reviewer's latest
+    latest = select(func.max(reviews.c.id).label('id')) \
+        .group_by(reviews.c.reviewer_id, reviews.c.reviewed_id).subquery()
+    conn.execute(delete(reviews).where(reviews.c.id.not_in(select(latest.c.id))))
+    create_indexes(conn, reviews, ('uq_reviews_reviewer_reviewed',))
+    create_tables(conn, [tables['user_stats']])
+
+
+def _listing_coordinates(tables, conn):
+    add_columns(conn, tables['skill_listings'], ('latitude', 'longitude', 'geohash'))
+    create_indexes(conn, tables['skill_listings'], ('idx_skill_listings_geo',))
+
+
+def _chat_counters(tables, conn):
+    if add_columns(conn, tables['chats'], ('last_message_id', 'user1_received', 'user2_received')):
+        # The new counters start at 0; count the messages already there
+        for statement in chat_counter_updates(tables):
+            conn.execute(statement)
+
+
+def _job_queue(tables, conn):
+    create_tables(conn, [tables['jobs']])
+    if add_columns(conn, tables['reviews'], ('stats_applied',)):
+        # Reviews already there were counted when they were written, or are by rebuild-user-stats
+        conn.execute(update(tables['reviews']).values(stats_applied=True))
+
+
+def _composite_indexes(tables, conn):
+    create_indexes(conn, tables['skill_listings'], ('idx_skill_listings_feed', 'idx_skill_listings_category_feed',
+                                                    'idx_skill_listings_provider_feed', 'idx_skills_location',
+                                                    'ft_skill_listings_text'))
+    create_indexes(conn, tables['transactions'], ('idx_transactions_from_user_feed', 'idx_transactions_to_user_feed',
+                                                  'idx_transactions_status'))
+    create_indexes(conn, tables['reviews'], ('idx_reviews_reviewer', 'idx_reviews_reviewed_feed'))
+    create_indexes(conn, tables['chats'], ('idx_chats_pair_skill', 'idx_chats_user2_active'))
+    create_indexes(conn, tables['messages'], ('idx_messages_sender',))
+    # Only after their replacements exist: MySQL will not drop the last index a foreign key can use
+    for table_name in ('skill_listings', 'transactions', 'reviews', 'chats'):
+        drop_indexes(conn, table_name, SUPERSEDED_INDEXES[table_name])
+
+
+def _updated_at_indexes(tables, conn):
+    create_indexes(conn, tables['skill_listings'], ('idx_skill_listings_updated_at',))
+    create_indexes(conn, tables['user_stats'], ('idx_user_stats_updated_at',))
+
+
+def app_migrations(metadata) -> list:
+    """The app's schema history against the models' ``metadata``: the baseline, then one migration per feature.
+
+    Later tables and columns are created as the models declare them now;
+    no schema between the baseline and the current one was released.
+    """
+    tables = metadata.tables
+    return [
+        Migration(1, 'Baseline tables', lambda conn: baseline_metadata().create_all(conn)),
+        Migration(2, 'Chat read cursors', lambda conn: create_tables(conn, [tables['chat_read_cursors']])),
+        Migration(3, 'Message sync indexes', partial(_message_sync_indexes, tables)),
+        Migration(4, 'Exact wallet balances, one wallet per user, transfer idempotency keys',
+                  partial(_wallet_ledger, tables)),
+        Migration(5, 'User stats, one review per reviewer and reviewed user', partial(_user_stats, tables)),
+        Migration(6, 'Skill suggestion and similar-listing tables',
+                  lambda conn: create_tables(conn, [tables['skill_neighbors'], tables['user_recommendations']])),
+        Migration(7, 'Trending counters', lambda conn: create_tables(conn, [tables['trending_counters']])),
+        Migration(8, 'Listing coordinates and geohash index', partial(_listing_coordinates, tables)),
+        Migration(9, 'Revoked tokens', lambda conn: create_tables(conn, [tables['revoked_tokens']])),
+        Migration(10, 'Chat unread counters and last-message pointer', partial(_chat_counters, tables)),
+        Migration(11, 'Job queue, reviews.stats_applied', partial(_job_queue, tables)),
+        Migration(12, 'Composite feed, inbox and chat indexes, FULLTEXT listing search',
+                  partial(_composite_indexes, tables)),
+        Migration(13, 'updated_at indexes for catalog ETags', partial(_updated_at_indexes, tables)),
+    ]
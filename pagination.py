@@ -0,0 +1,101 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import or_, and_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+    if not isinstance(payload, dict):
+        raise InvalidCursor('Invalid cursor')
+    return payload
+
+
+def clamp_page_size(value, default: int, maximum: int) -> int:
+    if not isinstance(value, int) or value <= 0:
+        return default
+    return min(value, maximum)
+
+
+# ------------------------------
+# Keyset pagination on (created_at, id), newest first
+# ------------------------------
+
+def _key_cursor(row, direction: str) -> str:
+    return encode_cursor({'k': [row.created_at.isoformat(), row.id], 'd': direction})
+
+
+def keyset_page(query, model, cursor=None, limit: int = 10):
+    """Return ``(rows, next_cursor, prev_cursor)`` for ``query`` ordered by (created_at, id) desc.
+
+    Each page is a single index range scan of ``limit + 1`` rows, so the cost
+    is the same on page 1 and page 10,000.
+    """
+    direction = 'next'
+    if cursor:
+        payload = decode_cursor(cursor)
+        try:
+            created_raw, last_id = payload['k']
+            created_at = datetime.fromisoformat(created_raw)
+            last_id = int(last_id)
+            direction = payload.get('d', 'next')
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidCursor('Invalid cursor') from e
+        if direction == 'prev':
+            query = query.filter(or_(model.created_at > created_at,
+                                     and_(model.created_at == created_at, model.id > last_id)))
+        else:
+            query = query.filter(or_(model.created_at < created_at,
+                                     and_(model.created_at == created_at, model.id < last_id)))
+
+    if direction == 'prev':
+        rows = query.order_by(model.created_at.asc(), model.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        next_cursor = _key_cursor(rows[-1], 'next') if rows else None
+        prev_cursor = _key_cursor(rows[0], 'prev') if rows and has_more else None
+    else:
+        rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = _key_cursor(rows[-1], 'next') if rows and has_more else None
+        prev_cursor = _key_cursor(rows[0], 'prev') if rows and cursor else None
+    return rows, next_cursor, prev_cursor
+
+
+# ------------------------------
+# Offset cursors over an already-ranked, capped id list
+# ------------------------------
+
+def ranked_page(ranked_ids, cursor=None, limit: int = 10):
+    """Slice a ranked id list; the cursor carries the offset so clients treat both modes alike."""
+    offset = 0
+    if cursor:
+        try:
+            offset = int(decode_cursor(cursor)['o'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidCursor('Invalid cursor') from e
+        offset = max(offset, 0)
+    page_ids = ranked_ids[offset:offset + limit]
+    next_cursor = encode_cursor({'o': offset + limit}) if offset + limit < len(ranked_ids) else None
+    prev_cursor = encode_cursor({'o': max(offset - limit, 0)}) if offset > 0 else None
+    return page_ids, next_cursor, prev_cursor
+
+
+def approximate_count(query, model, cap: int):
+    """Count at most ``cap`` matches; returns ``(count, is_exact)``."""
+    n = query.with_entities(model.id).order_by(None).limit(cap + 1).count()
+    return min(n, cap), n <= cap
@@ -0,0 +1,157 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+_LEGACY_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 503 + Retry-After."""
+
+
+# ------------------------------
+# Work functions (run inside the pool, so they must be module-level)
+# ------------------------------
+
+def _bcrypt_hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _bcrypt_check(password: str, stored: str) -> bool:
+    return bcrypt.checkpw(password.encode(), stored.encode())
+
+
+def _scrypt_hash(password: str, n: int, r: int, p: int) -> str:
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024)
+    return 'scrypt${}${}${}${}${}'.format(n, r, p, base64.b64encode(salt).decode(), base64.b64encode(digest).decode())
+
+
+def _scrypt_check(password: str, stored: str) -> bool:
+    _, n, r, p, salt, expected = stored.split('$')
+    n, r, p = int(n), int(r), int(p)
+    digest = hashlib.scrypt(password.encode(), salt=base64.b64decode(salt), n=n, r=r, p=p,
+                            maxmem=256 * n * r + 1024 * 1024)
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+# ------------------------------
+# Hashing service
+# ------------------------------
+
+class PasswordHasher:
+    """Runs a slow KDF in a bounded process pool.
+
+    At most ``max_pending`` hash/verify calls may be queued or running at
+    once. Beyond that, callers wait up to ``queue_timeout`` seconds for a
+    slot and then get HasherBusy. That sheds load instead of piling up
+    blocked request threads. ``workers=0`` runs inline, which suits tests
+    and single-threaded tools.
+    """
+
+    def __init__(self, scheme: str = 'bcrypt', bcrypt_rounds: int = 12, scrypt_n: int = 2 ** 14,
+                 scrypt_r: int = 8, scrypt_p: int = 1, workers: int = None, max_pending: int = None,
+                 queue_timeout: float = 2.0):
+        if scheme not in ('bcrypt', 'scrypt'):
+            raise ValueError(f'Unsupported password hash scheme: {scheme}')
+        self.scheme = scheme
+        self.bcrypt_rounds = bcrypt_rounds
+        self.scrypt_params = (scrypt_n, scrypt_r, scrypt_p)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or max(self.workers, 1) * 4
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._rehashed = 0
+        self._wait_seconds = 0.0
+        self._run_seconds = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _run(self, fn, *args):
+        queued_at = time.perf_counter()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._stats_lock:
+                self._rejected += 1
+            raise HasherBusy('Password hashing is saturated, retry shortly')
+        started_at = time.perf_counter()
+        with self._stats_lock:
+            self._in_flight += 1
+        try:
+            if self.workers == 0:
+                return fn(*args)
+            return self._get_pool().submit(fn, *args).result()
+        finally:
+            finished_at = time.perf_counter()
+            self._slots.release()
+            with self._stats_lock:
+                self._in_flight -= 1
+                self._completed += 1
+                self._wait_seconds += started_at - queued_at
+                self._run_seconds += finished_at - started_at
+
+    def hash(self, password: str) -> str:
+        if self.scheme == 'scrypt':
+            return self._run(_scrypt_hash, password, *self.scrypt_params)
+        return self._run(_bcrypt_hash, password, self.bcrypt_rounds)
+
+    def needs_rehash(self, stored: str) -> bool:
+        if self.scheme == 'bcrypt':
+            if not stored.startswith('$2'):
+                return True
+            return int(stored.split('$')[2]) < self.bcrypt_rounds
+        if not stored.startswith('scrypt$'):
+            return True
+        return tuple(int(v) for v in stored.split('$')[1:4]) != self.scrypt_params
+
+    def verify(self, password: str, stored: str):
+        """Return ``(matches, needs_rehash)``. Legacy unsalted SHA-256 hashes always need a rehash."""
+        if not stored:
+            return False, False
+        if _LEGACY_SHA256_RE.match(stored):
+            matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+            return matches, matches
+        if stored.startswith('scrypt$'):
+            matches = self._run(_scrypt_check, password, stored)
+        elif stored.startswith('$2'):
+            matches = self._run(_bcrypt_check, password, stored)
+        else:
+            return False, False
+        return matches, matches and self.needs_rehash(stored)
+
+    def record_rehash(self):
+        with self._stats_lock:
+            self._rehashed += 1
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            completed = self._completed
+            return {
+                'scheme': self.scheme,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'in_flight': self._in_flight,
+                'saturation': self._in_flight / self.max_pending,
+                'completed': completed,
+                'rejected': self._rejected,
+                'rehashed': self._rehashed,
+                'avg_wait_ms': self._wait_seconds * 1000 / completed if completed else 0.0,
+                'avg_run_ms': self._run_seconds * 1000 / completed if completed else 0.0,
+            }
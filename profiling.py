@@ -0,0 +1,289 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Response, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+INF_BUCKET = 'le="+Inf"'
+
+
+# ------------------------------
+# Prometheus text format
+# ------------------------------
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_metric(name: str, kind: str, help_text: str, samples) -> list:
+    """Lines for one metric family; ``samples`` is ``[(labels_dict, value)]``."""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        if value is None:
+            continue
+        lines.append(f'{name}{_labels(labels.keys(), labels.values())} {_number(value)}')
+    return lines
+
+
+def format_histogram(name: str, help_text: str, samples) -> list:
+    """Lines for one histogram; ``samples`` is ``[(labels_dict, [(bound, cumulative_count)], count, sum)]``."""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for labels, buckets, count, total in samples:
+        names, values = tuple(labels.keys()), tuple(labels.values())
+        for bound, bucket_count in buckets:
+            le = 'le="%r"' % float(bound)
+            lines.append(f'{name}_bucket{_labels(names, values, le)} {bucket_count}')
+        lines.append(f'{name}_bucket{_labels(names, values, INF_BUCKET)} {count}')
+        lines.append(f'{name}_count{_labels(names, values)} {count}')
+        lines.append(f'{name}_sum{_labels(names, values)} {_number(float(total))}')
+    return lines
+
+
+class Histogram:
+    """Thread-safe labelled histogram with cumulative buckets."""
+
+    def __init__(self, name: str, help_text: str, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value: float):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def expose(self) -> list:
+        with self._lock:
+            series = sorted((k, list(v[0]), v[1], v[2]) for k, v in self._series.items())
+        return format_histogram(self.name, self.help_text, [
+            (dict(zip(self.label_names, label_values)), list(zip(self.buckets, buckets)), count, total)
+            for label_values, buckets, count, total in series])
+
+
+class CounterMetric:
+    def __init__(self, name: str, help_text: str, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def expose(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        return format_metric(self.name, 'counter', self.help_text,
+                             [(dict(zip(self.label_names, k)), v) for k, v in values])
+
+
+# ------------------------------
+# Per-request profile
+# ------------------------------
+
+@contextmanager
+def section(name: str):
+    """Add the time spent in the block to the current request's ``name`` total (no-op outside requests)."""
+    profile = g.get('_profile') if has_request_context() else None
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] = profile.sections.get(name, 0.0) + time.perf_counter() - started
+
+
+class RequestProfile:
+    __slots__ = ('started', 'sql_count', 'sql_seconds', 'statements', 'sections')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+        self.sections = {}
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """``jsonify`` encoder that counts its time as the request's serialization time."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        with section('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+class RequestProfiler:
+    """Per-route latency, SQL and serialization metrics, Server-Timing headers and N+1 detection.
+
+    SQL is counted through engine cursor events, so every query issued while
+    a request is being handled is attributed to its route, whichever part of
+    the code issued it. A request that runs the same statement more than
+    ``n_plus_one_threshold`` times is counted and logged once per route and
+    statement. Metrics are per process; scrape each worker.
+    """
+
+    def __init__(self, app=None, engines=(), n_plus_one_threshold: int = 10, server_timing: bool = False):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.server_timing = server_timing
+        self.collectors = []
+        labels = ('method', 'route', 'status')
+        self.latency = Histogram('http_request_duration_seconds', 'Time spent handling the request.',
+                                 labels, LATENCY_BUCKETS)
+        self.queries = Histogram('http_request_sql_queries', 'SQL statements executed per request.',
+                                 ('method', 'route'), QUERY_COUNT_BUCKETS)
+        self.sql_time = Histogram('http_request_sql_seconds', 'Time spent in SQL statements per request.',
+                                  ('method', 'route'), LATENCY_BUCKETS)
+        self.serialize_time = Histogram('http_request_serialize_seconds',
+                                        'Time spent converting rows and encoding JSON per request.',
+                                        ('method', 'route'), LATENCY_BUCKETS)
+        self.response_size = Histogram('http_response_size_bytes', 'Response body size (unstreamed responses).',
+                                       ('method', 'route'), SIZE_BUCKETS)
+        self.n_plus_one = CounterMetric('http_request_n_plus_one_total',
+                                        'Requests that repeated one SQL statement more than the threshold.',
+                                        ('method', 'route'))
+        self._reported = set()
+        self._reported_lock = threading.Lock()
+        self._instrumented = set()
+        for engine in engines:
+            self.instrument_engine(engine)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.json = TimedJSONProvider(app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def instrument_engine(self, engine):
+        if id(engine) in self._instrumented:
+            return
+        self._instrumented.add(id(engine))
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        event.listen(engine, 'handle_error', self._execute_failed)
+
+    def add_collector(self, collect):
+        """Register ``collect() -> [lines]`` to append other subsystems' metrics to ``/metrics``."""
+        self.collectors.append(collect)
+
+    # SQLAlchemy hooks
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and '_profile' in g:
+            conn.info.setdefault('_profile_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context() or '_profile' not in g:
+            return
+        stack = conn.info.get('_profile_started')
+        if not stack:
+            return
+        profile = g._profile
+        profile.sql_count += 1
+        profile.sql_seconds += time.perf_counter() - stack.pop()
+        profile.statements[statement] += 1
+
+    def _execute_failed(self, context):
+        stack = context.connection.info.get('_profile_started') if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+    # Flask hooks
+    def _before_request(self):
+        g._profile = RequestProfile()
+
+    @staticmethod
+    def _route():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def _after_request(self, response: Response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        elapsed = time.perf_counter() - profile.started
+        route, method = self._route(), request.method
+        self.latency.observe((method, route, str(response.status_code)), elapsed)
+        self.queries.observe((method, route), profile.sql_count)
+        self.sql_time.observe((method, route), profile.sql_seconds)
+        serialize = profile.sections.get('serialize', 0.0)
+        self.serialize_time.observe((method, route), serialize)
+        if not response.is_streamed:
+            self.response_size.observe((method, route), response.calculate_content_length() or 0)
+
+        repeated = [(statement, count) for statement, count in profile.statements.items()
+                    if count > self.n_plus_one_threshold]
+        if repeated:
+            self.n_plus_one.inc((method, route))
+            for statement, count in repeated:
+                self._report_n_plus_one(method, route, statement, count)
+
+        if self.server_timing:
+            response.headers.add('Server-Timing', ', '.join([
+                f'db;dur={profile.sql_seconds * 1000:.2f};desc="{profile.sql_count} queries"',
+                f'serialize;dur={serialize * 1000:.2f}',
+                f'total;dur={elapsed * 1000:.2f}',
+            ]))
+        return response
+
+    def _report_n_plus_one(self, method: str, route: str, statement: str, count: int):
+        key = (method, route, hashlib.sha1(statement.encode()).hexdigest())
+        with self._reported_lock:
+            if key in self._reported:
+                return
+            self._reported.add(key)
+        logger.warning('Possible N+1 in %s %s: statement ran %d times in one request: %s',
+                       method, route, count, _WHITESPACE.sub(' ', statement)[:300])
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.latency, self.queries, self.sql_time, self.serialize_time, self.response_size,
+                       self.n_plus_one):
+            lines.extend(metric.expose())
+        for collect in self.collectors:
+            try:
+                lines.extend(collect())
+            except Exception:
+                logger.exception('Metrics collector failed')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_response(self) -> Response:
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
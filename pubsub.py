@@ -0,0 +1,151 @@
+import asyncio
+import json
+import queue
+import threading
+
+
+class Subscription:
+    """A bounded mailbox for one listener. Slow consumers drop their oldest events."""
+
+    def __init__(self, hub, channels, maxsize: int = 256):
+        self.hub = hub
+        self.channels = tuple(channels)
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, message):
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float = None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """Mailbox for an asyncio consumer. Publishers on any thread wake its event loop instead of a thread."""
+
+    def __init__(self, hub, channels, loop, maxsize: int = 256):
+        super().__init__(hub, channels, maxsize)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def put(self, message):
+        super().put(message)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # the loop has shut down
+
+    async def get_async(self, timeout: float = None):
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            # Any put after this point schedules set() to run after the clear
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+
+class MemoryHub:
+    """Fan-out within one process. Good for a single worker or development."""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, *channels) -> Subscription:
+        return self._register(Subscription(self, channels))
+
+    def subscribe_async(self, *channels) -> AsyncSubscription:
+        """Subscribe from a coroutine; read with ``await subscription.get_async(timeout)``."""
+        return self._register(AsyncSubscription(self, channels, asyncio.get_running_loop()))
+
+    def _register(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def publish(self, channel: str, message: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+        return len(subscribers)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+class RedisHub(MemoryHub):
+    """Fan-out across worker processes through any Redis-protocol server (Redis, Valkey, KeyDB).
+
+    Every worker keeps one pattern subscription and delivers to its local
+    subscribers, so a publish in one gunicorn worker reaches SSE streams held
+    by all the others.
+    """
+
+    def __init__(self, url: str, prefix: str = 'tradecraft:'):
+        super().__init__()
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('PUBSUB_URL points at Redis but the "redis" package is not installed') from e
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(**{prefix + '*': self._on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=0.5, daemon=True)
+
+    def _on_message(self, raw):
+        channel = raw['channel']
+        if isinstance(channel, bytes):
+            channel = channel.decode()
+        MemoryHub.publish(self, channel[len(self.prefix):], json.loads(raw['data']))
+
+    def publish(self, channel: str, message: dict):
+        return self._redis.publish(self.prefix + channel, json.dumps(message))
+
+
+def create_hub(url: str = None):
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisHub(url)
+    return MemoryHub()
+
+
+def format_sse(message: dict, event: str = None) -> str:
+    lines = []
+    if event:
+        lines.append(f'event: {event}')
+    if 'id' in message:
+        lines.append(f"id: {message['id']}")
+    lines.append('data: ' + json.dumps(message, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
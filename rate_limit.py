@@ -0,0 +1,200 @@
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import jsonify, request
+
+from profiling import CounterMetric, format_metric
+
+_PERIODS = {'s': 1, 'sec': 1, 'second': 1, 'm': 60, 'min': 60, 'minute': 60, 'h': 3600, 'hour': 3600,
+            'd': 86400, 'day': 86400}
+_RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([a-z]+?)s?\s*$')
+
+
+def parse_rate(value: str):
+    """``'30/minute'`` -> ``(capacity, tokens_per_second)``; empty means unlimited (None).
+
+    The count is also the burst: a full bucket allows that many requests at
+    once, then one more every ``period / count``. ``'5/10s'`` is 5 per 10 seconds.
+    """
+    if not value or not value.strip():
+        return None
+    match = _RATE_RE.match(value.lower())
+    if not match or match.group(3) not in _PERIODS or int(match.group(1)) < 1:
+        raise ValueError(f'Invalid rate limit {value!r}; expected e.g. "30/minute" or "5/10s"')
+    count = int(match.group(1))
+    period = int(match.group(2) or 1) * _PERIODS[match.group(3)]
+    return count, count / period
+
+
+# ------------------------------
+# Bucket stores
+# ------------------------------
+
+class MemoryBuckets:
+    """Token buckets held by this process; one lock makes each take atomic.
+
+    At most ``maxsize`` buckets are kept. The least recently used go first;
+    an idle bucket refills to full anyway, so dropping it changes little.
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, capacity: int, rate: float, cost: int = 1):
+        """Spend ``cost`` tokens if available; returns ``(allowed, tokens_left)``."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is None:
+                tokens = float(capacity)
+            else:
+                tokens = min(capacity, state[0] + (now - state[1]) * rate)
+                self._buckets.move_to_end(key)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Refill and spend in one step on the server, so workers sharing a bucket never race
+_REDIS_TAKE = '''
+local capacity, rate, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or capacity
+if state[2] then tokens = math.min(capacity, tokens + math.max(0, now - tonumber(state[2])) * rate) end
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+'''
+
+
+class RedisBuckets:
+    """Token buckets on a Redis-protocol server, shared by every worker that points at it."""
+
+    def __init__(self, url: str, prefix: str = 'tradecraft:ratelimit:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('RATE_LIMIT_STORAGE_URL points at Redis but the "redis" package is not installed') from e
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(_REDIS_TAKE)
+        self.prefix = prefix
+
+    def take(self, key: str, capacity: int, rate: float, cost: int = 1):
+        allowed, tokens = self._take(keys=[self.prefix + key], args=[capacity, rate, cost])
+        return bool(allowed), float(tokens)
+
+
+def create_store(url: str):
+    if not url or url.startswith('memory://'):
+        return MemoryBuckets()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBuckets(url)
+    raise ValueError(f'Unsupported RATE_LIMIT_STORAGE_URL: {url}')
+
+
+# ------------------------------
+# Limiter
+# ------------------------------
+
+class RateLimiter:
+    """Per-route token-bucket limits keyed by the caller's identity or IP address.
+
+    Each limit has its own buckets, so a client throttled on one route can
+    still use the others. When the shared store fails, requests are checked
+    against this worker's own buckets instead of being let through or refused.
+    """
+
+    def __init__(self, store=None, enabled: bool = True, identity=None):
+        self.store = store or MemoryBuckets()
+        self.enabled = enabled
+        self.identity = identity or (lambda: None)
+        self.limits = {}
+        self._fallback = MemoryBuckets() if not isinstance(self.store, MemoryBuckets) else None
+        self.requests = CounterMetric('rate_limit_requests_total', 'Rate-limited route requests by result.',
+                                      ('limit', 'result'))
+        self.store_errors = 0
+
+    def configure(self, name: str, rate: str):
+        """Set (or with an empty ``rate``, remove) the limit called ``name``."""
+        parsed = parse_rate(rate)
+        if parsed is None:
+            self.limits.pop(name, None)
+        else:
+            self.limits[name] = parsed
+
+    def hit(self, name: str, key: str):
+        """Count one request by ``key`` against the limit ``name``; returns seconds to wait, or 0 if allowed."""
+        limit = self.limits.get(name)
+        if not self.enabled or limit is None:
+            return 0
+        capacity, rate = limit
+        bucket = f'{name}:{key}'
+        try:
+            allowed, tokens = self.store.take(bucket, capacity, rate)
+        except Exception:
+            if self._fallback is None:
+                raise
+            self.store_errors += 1
+            allowed, tokens = self._fallback.take(bucket, capacity, rate)
+        self.requests.inc((name, 'allowed' if allowed else 'rejected'))
+        return 0 if allowed else max(math.ceil((1 - tokens) / rate), 1)
+
+    def client_key(self, by: str) -> str:
+        """The current request's bucket key: ``user:<id>`` when ``by == 'user'`` and a token is present, else its IP."""
+        if by == 'user':
+            try:
+                user = self.identity()
+            except Exception:
+                user = None  # invalid tokens are the view's problem; count them by address
+            if user is not None:
+                return f'user:{user}'
+        return f'ip:{request.remote_addr}'
+
+    def limit(self, name: str, by: str = 'user'):
+        """Reject requests over the limit ``name`` with 429 and ``Retry-After``, before the view runs."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.enabled and name in self.limits:
+                    retry_after = self.hit(name, self.client_key(by))
+                    if retry_after:
+                        return too_many_requests(retry_after)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def metrics(self) -> dict:
+        return {'enabled': self.enabled, 'store': type(self.store).__name__, 'store_errors': self.store_errors,
+                'limits': {name: f'{capacity} per {capacity / rate:g}s'
+                           for name, (capacity, rate) in sorted(self.limits.items())}}
+
+    def metric_lines(self) -> list:
+        return self.requests.expose() + format_metric(
+            'rate_limit_store_errors_total', 'counter', 'Checks that fell back to local buckets because the shared '
+            'store failed.', [({}, self.store_errors)])
+
+
+def too_many_requests(retry_after: int):
+    response = jsonify({'message': f'Too many requests, retry in {retry_after} seconds'})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
@@ -0,0 +1,279 @@
+import math
+import time
+import zlib
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from search_index import stem, tokenize
+
+Recommendations = namedtuple('Recommendations', ['skill_neighbors', 'user_recommendations', 'timings'])
+
+
+# ------------------------------
+# Listing vectors
+# ------------------------------
+
+def hash_features(documents, dim: int = 256, title_boost: int = 2, chunk_rows: int = 65536) -> np.ndarray:
+    """Signed hashed TF-IDF vectors for a sequence of ``(title, description)`` pairs, L2-normalized.
+
+    Hashing keeps memory at ``n * dim`` floats however large the vocabulary
+    gets, and needs no vocabulary pass before vectorizing. Rows are filled
+    ``chunk_rows`` at a time so the float64 scratch space stays small.
+    """
+    n = len(documents)
+    vectors = np.zeros((n, dim), dtype=np.float32)
+    df = np.zeros(dim, dtype=np.int64)
+    # Raw token -> (column, sign); stemming and hashing run once per distinct token
+    token_slots = {}
+
+    def slot(token):
+        h = zlib.crc32(stem(token).encode())
+        slot = token_slots[token] = (h % dim, -1.0 if h & 0x80000000 else 1.0)
+        return slot
+
+    for start in range(0, n, chunk_rows):
+        chunk = documents[start:start + chunk_rows]
+        cells, values = [], []
+        for row, (title, description) in enumerate(chunk):
+            terms = Counter()
+            for token in tokenize(title):
+                terms[token_slots.get(token) or slot(token)] += title_boost
+            for token in tokenize(description):
+                terms[token_slots.get(token) or slot(token)] += 1
+            offset = row * dim
+            for (col, sign), tf in terms.items():
+                cells.append(offset + col)
+                values.append(sign * (1.0 + math.log(tf)))
+        if not cells:
+            continue
+        cells = np.asarray(cells, dtype=np.int64)
+        vectors[start:start + len(chunk)] = np.bincount(cells, weights=values, minlength=len(chunk) * dim) \
+            .reshape(len(chunk), dim)
+        df += np.bincount(np.unique(cells) % dim, minlength=dim)
+
+    vectors *= (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+# ------------------------------
+# Neighbor search
+# ------------------------------
+
+def _blocks(indices: np.ndarray, vectors: np.ndarray, max_block: int, rng, iterations: int = 3):
+    """Split ``indices`` into blocks of at most ``max_block`` rows of mutually similar vectors.
+
+    Oversized blocks are clustered with a few rounds of spherical k-means
+    (one matrix product per round) and the clusters split again until they
+    fit, so a block is a cluster rather than an arbitrary slice. Comparing
+    only within blocks keeps most true neighbors while the cost stays
+    O(n * max_block) instead of O(n^2).
+    """
+    stack = [indices]
+    while stack:
+        block = stack.pop()
+        if len(block) <= max_block:
+            yield block
+            continue
+        block_vectors = vectors[block]
+        n_clusters = 2 * -(-len(block) // max_block)
+        centroids = block_vectors[rng.choice(len(block), size=n_clusters, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(block_vectors @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            _, starts = np.unique(assignment[order], return_index=True)
+            centroids = np.add.reduceat(block_vectors[order], starts, axis=0)
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            np.divide(centroids, norms, out=centroids, where=norms > 0)
+        assignment = np.argmax(block_vectors @ centroids.T, axis=1)
+        clusters = [block[assignment == label] for label in np.unique(assignment)]
+        if len(clusters) == 1:
+            # Degenerate (e.g. identical vectors): fall back to halving
+            half = len(block) // 2
+            clusters = [block[:half], block[half:]]
+        stack.extend(clusters)
+
+
+def content_neighbors(vectors: np.ndarray, groups: np.ndarray, k: int, max_block: int = 2048,
+                      passes: int = 1, seed: int = 0):
+    """Top-``k`` cosine neighbors of every row among rows with the same group code.
+
+    Groups larger than ``max_block`` are partitioned ``passes`` times from
+    different random seeds and the candidates merged, which recovers
+    neighbors that one partition split apart. Returns ``(src, dst, score)``
+    arrays of row indices; pairs with no positive similarity are dropped.
+    """
+    rng = np.random.default_rng(seed)
+    order = np.argsort(groups, kind='stable')
+    boundaries = np.flatnonzero(np.diff(groups[order])) + 1
+    src, dst, score = [], [], []
+    for group in np.split(order, boundaries):
+        for _ in range(passes if len(group) > max_block else 1):
+            for block in _blocks(group, vectors, max_block, rng):
+                kk = min(k, len(block) - 1)
+                if kk <= 0:
+                    continue
+                block_vectors = vectors[block]
+                similarity = block_vectors @ block_vectors.T
+                np.fill_diagonal(similarity, -1.0)
+                top = np.argpartition(-similarity, kk - 1, axis=1)[:, :kk]
+                top_scores = np.take_along_axis(similarity, top, axis=1)
+                keep = top_scores > 0
+                src.append(np.repeat(block, kk).reshape(len(block), kk)[keep])
+                dst.append(block[top][keep])
+                score.append(top_scores[keep])
+    if not src:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    src, dst, score = np.concatenate(src), np.concatenate(dst), np.concatenate(score)
+    if passes > 1:
+        # The same pair found in several passes has the same score; keep one copy
+        _, first = np.unique(src * len(vectors) + dst, return_index=True)
+        src, dst, score = top_k_per_source(src[first], dst[first], score[first], len(vectors), k)
+    return src, dst, score
+
+
+def cooccurrence_neighbors(user_codes: np.ndarray, item_rows: np.ndarray, n_items: int, max_items_per_user: int = 50):
+    """Item pairs engaged by the same users, scored ``count / sqrt(pop_a * pop_b)``.
+
+    Each user contributes at most ``max_items_per_user`` items (the newest
+    ones), so a handful of very active users cannot dominate or blow up the
+    quadratic pair expansion.
+    """
+    keys = np.unique(user_codes.astype(np.int64) * n_items + item_rows)
+    users, items = keys // n_items, keys % n_items
+    popularity = np.bincount(items, minlength=n_items).astype(np.float32)
+
+    boundaries = np.flatnonzero(np.diff(users)) + 1
+    pair_keys = []
+    for user_items in np.split(items, boundaries):
+        if len(user_items) < 2:
+            continue
+        user_items = user_items[-max_items_per_user:]
+        a, b = np.meshgrid(user_items, user_items, indexing='ij')
+        mask = a != b
+        pair_keys.append(a[mask] * n_items + b[mask])
+    if not pair_keys:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+
+    pairs, counts = np.unique(np.concatenate(pair_keys), return_counts=True)
+    src, dst = pairs // n_items, pairs % n_items
+    score = counts / np.sqrt(popularity[src] * popularity[dst])
+    return src, dst, score.astype(np.float32)
+
+
+def top_k_per_source(src: np.ndarray, dst: np.ndarray, score: np.ndarray, n_dst: int, k: int):
+    """Sum the scores of duplicate ``(src, dst)`` pairs and keep the best ``k`` per source.
+
+    The result is sorted by source, then by descending score.
+    """
+    if len(src) == 0:
+        return src, dst, score
+    pairs, inverse = np.unique(src.astype(np.int64) * n_dst + dst, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=score).astype(np.float32)
+    src, dst = pairs // n_dst, pairs % n_dst
+    order = np.lexsort((-summed, src))
+    src, dst, summed = src[order], dst[order], summed[order]
+    starts = np.r_[0, np.flatnonzero(np.diff(src)) + 1]
+    rank = np.arange(len(src)) - np.repeat(starts, np.diff(np.r_[starts, len(src)]))
+    keep = rank < k
+    return src[keep], dst[keep], summed[keep]
+
+
+def expand_user_scores(user_codes: np.ndarray, item_rows: np.ndarray, nbr_src: np.ndarray,
+                       nbr_dst: np.ndarray, nbr_score: np.ndarray, n_items: int):
+    """Score every neighbor of every item a user engaged with; ``nbr_src`` must be sorted."""
+    starts = np.searchsorted(nbr_src, np.arange(n_items))
+    degree = np.diff(np.r_[starts, len(nbr_src)])
+    user_degree = degree[item_rows]
+    total = int(user_degree.sum())
+    offsets = np.arange(total) - np.repeat(np.cumsum(user_degree) - user_degree, user_degree)
+    positions = np.repeat(starts[item_rows], user_degree) + offsets
+    return np.repeat(user_codes, user_degree), nbr_dst[positions], nbr_score[positions]
+
+
+# ------------------------------
+# Pipeline
+# ------------------------------
+
+class RecommendationBuilder:
+    """Offline pipeline that turns listings and user interactions into top-k tables.
+
+    * listing vectors: hashed TF-IDF over title and description
+    * content neighbors: cosine similarity within each category, compared
+      block-wise within clusters (see ``_blocks``) so a 1M-listing catalog stays tractable
+    * behavioral neighbors: listings engaged by the same users (chats,
+      transactions, reviews), weighted by ``cooccurrence_weight``
+    * user recommendations: summed neighbor scores of everything the user
+      engaged with, minus what they already engaged with or provide themselves
+    """
+
+    def __init__(self, dim: int = 256, neighbors: int = 20, per_user: int = 50, max_block: int = 2048,
+                 passes: int = 1, cooccurrence_weight: float = 0.5, max_items_per_user: int = 50, seed: int = 0):
+        self.dim = dim
+        self.neighbors = neighbors
+        self.per_user = per_user
+        self.max_block = max_block
+        self.passes = passes
+        self.cooccurrence_weight = cooccurrence_weight
+        self.max_items_per_user = max_items_per_user
+        self.seed = seed
+
+    def build(self, listings, interactions) -> Recommendations:
+        """``listings``: ``(id, title, description, category, provider_id)`` rows of active listings.
+        ``interactions``: ``(user_id, skill_id)`` pairs; unknown skill ids are ignored.
+        """
+        timings = {}
+        started = time.perf_counter()
+        listings = list(listings)
+        skill_ids = np.fromiter((row[0] for row in listings), dtype=np.int64, count=len(listings))
+        provider_ids = np.fromiter((row[4] for row in listings), dtype=np.int64, count=len(listings))
+        _, categories = np.unique(np.array([row[3] or '' for row in listings], dtype=object).astype(str),
+                                  return_inverse=True)
+        vectors = hash_features([(row[1], row[2]) for row in listings], dim=self.dim)
+        timings['vectorize_s'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        src, dst, score = content_neighbors(vectors, categories.ravel(), self.neighbors, self.max_block,
+                                            self.passes, self.seed)
+        timings['content_neighbors_s'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        interactions = np.asarray(list(interactions), dtype=np.int64).reshape(-1, 2)
+        order = np.argsort(skill_ids)
+        positions = np.searchsorted(skill_ids, interactions[:, 1], sorter=order).clip(0, max(len(order) - 1, 0))
+        rows = order[positions] if len(order) else positions
+        known = skill_ids[rows] == interactions[:, 1] if len(order) else np.zeros(len(rows), dtype=bool)
+        interaction_users, interaction_rows = interactions[known, 0], rows[known]
+        user_ids, user_codes = np.unique(interaction_users, return_inverse=True)
+        user_codes = user_codes.ravel()
+
+        co_src, co_dst, co_score = cooccurrence_neighbors(user_codes, interaction_rows, len(listings),
+                                                          self.max_items_per_user)
+        nbr_src, nbr_dst, nbr_score = top_k_per_source(
+            np.concatenate([src, co_src]), np.concatenate([dst, co_dst]),
+            np.concatenate([score, co_score * self.cooccurrence_weight]),
+            len(listings), self.neighbors)
+        timings['cooccurrence_s'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rec_users, rec_rows, rec_scores = expand_user_scores(user_codes, interaction_rows,
+                                                             nbr_src, nbr_dst, nbr_score, len(listings))
+        n_items = max(len(listings), 1)
+        candidate_keys = rec_users * n_items + rec_rows
+        # Drop listings the user already engaged with or provides
+        owner_codes = np.searchsorted(user_ids, provider_ids).clip(0, max(len(user_ids) - 1, 0))
+        owned = user_ids[owner_codes] == provider_ids if len(user_ids) else np.zeros(len(listings), dtype=bool)
+        seen_keys = np.concatenate([user_codes * n_items + interaction_rows,
+                                    owner_codes[owned] * n_items + np.flatnonzero(owned)])
+        fresh = ~np.isin(candidate_keys, seen_keys)
+        rec_users, rec_rows, rec_scores = top_k_per_source(rec_users[fresh], rec_rows[fresh], rec_scores[fresh],
+                                                           n_items, self.per_user)
+        timings['user_recommendations_s'] = time.perf_counter() - started
+
+        return Recommendations(
+            skill_neighbors=(skill_ids[nbr_src], skill_ids[nbr_dst], nbr_score),
+            user_recommendations=(user_ids[rec_users], skill_ids[rec_rows], rec_scores),
+            timings=timings,
+        )
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+from werkzeug.http import unquote_etag
+
+from compression import matching_etag
+
+# Validators travel with a cached body so hits can be revalidated like misses
+_STORED_HEADERS = ('ETag', 'Cache-Control')
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with per-entry expiry."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisTier:
+    """Shared tier on a Redis-protocol server. Also owns tag versions so invalidation reaches every worker."""
+
+    def __init__(self, url: str, prefix: str = 'tradecraft:cache:'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('RESPONSE_CACHE_URL points at Redis but the "redis" package is not installed') from e
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, value, ttl: float):
+        self._redis.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def tag_versions(self, tags):
+        raw = self._redis.mget([self.prefix + 'tag:' + t for t in tags])
+        return [int(v) if v else 0 for v in raw]
+
+    def bump(self, tags):
+        pipe = self._redis.pipeline()
+        for tag in tags:
+            pipe.incr(self.prefix + 'tag:' + tag)
+        pipe.execute()
+
+
+class ResponseCache:
+    """Two-tier cache for whole JSON responses of anonymous GET routes.
+
+    Entries are never deleted on writes. Every key embeds the current
+    version of each tag the response depends on, so invalidating a tag
+    bumps its version and the stale entries fall out through LRU/TTL.
+    """
+
+    def __init__(self, maxsize: int = 1024, shared_url: str = None, enabled: bool = True):
+        self.local = LRUCache(maxsize)
+        self.shared = RedisTier(shared_url) if shared_url else None
+        self.enabled = enabled
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _tag_versions(self, tags):
+        if self.shared is not None:
+            return self.shared.tag_versions(tags)
+        with self._lock:
+            return [self._versions.get(t, 0) for t in tags]
+
+    def invalidate(self, *tags):
+        if not tags:
+            return
+        if self.shared is not None:
+            self.shared.bump(tags)
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def _key(self, tags):
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        versions = ','.join(f'{t}@{v}' for t, v in zip(tags, self._tag_versions(tags)))
+        return f'{request.path}?{args}|{versions}'
+
+    def lookup(self, key):
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                # Remaining TTL is unknown here; keep the local copy short-lived
+                self.local.set(key, entry, 5)
+        return entry
+
+    def store(self, key, entry, ttl: float):
+        self.local.set(key, entry, ttl)
+        if self.shared is not None:
+            self.shared.set(key, entry, ttl)
+
+    def cached(self, ttl: float, tags=None):
+        """Cache a route's 200 responses for ``ttl`` seconds.
+
+        ``tags`` is a list, or a callable that receives the view kwargs and
+        returns the tags for the current request.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method != 'GET':
+                    return view(*args, **kwargs)
+                route_tags = tags(**kwargs) if callable(tags) else list(tags or ())
+                key = self._key(route_tags)
+                entry = self.lookup(key)
+                if entry is not None:
+                    self.hits += 1
+                    headers = entry.get('headers') or {}
+                    if 'ETag' in headers and matching_etag(request.if_none_match, unquote_etag(headers['ETag'])[0]):
+                        response = Response(status=304, headers=headers)
+                    else:
+                        response = Response(entry['body'], status=200, mimetype=entry['mimetype'], headers=headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self.misses += 1
+                result = view(*args, **kwargs)
+                response, status = (result[0], result[1]) if isinstance(result, tuple) else (result, None)
+                if isinstance(response, Response) and (status or response.status_code) == 200:
+                    self.store(key, {
+                        'body': response.get_data(as_text=True),
+                        'mimetype': response.mimetype,
+                        'headers': {name: response.headers[name] for name in _STORED_HEADERS
+                                    if name in response.headers}
+                    }, ttl)
+                    response.headers['X-Cache'] = 'MISS'
+                return result
+            return wrapper
+        return decorator
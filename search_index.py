@@ -0,0 +1,377 @@
+import math
+import re
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+from itertools import islice
+
+# ------------------------------
+# Text analysis
+# ------------------------------
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'i', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'with', 'you', 'your',
+))
+
+# Longest suffixes first so that e.g. "ations" wins over "s"
+_SUFFIXES = (
+    ('ational', 'ate'), ('ization', 'ize'), ('fulness', 'ful'), ('iveness', 'ive'),
+    ('ations', 'ate'), ('ation', 'ate'), ('ement', ''), ('ments', ''), ('ment', ''),
+    ('ness', ''), ('ings', ''), ('ing', ''), ('edly', ''), ('ies', 'y'), ('ied', 'y'),
+    ('ers', ''), ('er', ''), ('ed', ''), ('ly', ''), ('es', ''), ('s', ''),
+)
+
+
+def stem(token: str) -> str:
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix, replacement in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            if suffix == 's' and token.endswith('ss'):
+                return token
+            token = token[:-len(suffix)] + replacement
+            # "running" -> "runn" -> "run"
+            if len(token) > 3 and token[-1] == token[-2] and token[-1] not in 'lsz':
+                token = token[:-1]
+            return token
+    return token
+
+
+def tokenize(text: str):
+    return [t for t in _TOKEN_RE.findall((text or '').lower()) if t not in STOP_WORDS]
+
+
+def analyze(text: str):
+    return [stem(t) for t in tokenize(text)]
+
+
+# ------------------------------
+# Inverted index with BM25 ranking
+# ------------------------------
+
+_ID_MASK = 0xFFFFFFFF
+
+
+def _impact_key(doc_len: int, doc_id: int) -> int:
+    # Ascending keys run shortest documents first, then highest ids: best BM25 score first for a fixed tf
+    return (doc_len << 32) | (_ID_MASK - doc_id)
+
+
+class SearchIndex:
+    """In-memory inverted index over skill listings.
+
+    Posting lists map term -> {doc_id: term frequency}. Title terms are
+    counted ``title_boost`` times so that title matches outrank body matches.
+
+    Each queried term also gets impact lists: its postings grouped by tf and
+    sorted by document length, i.e. by BM25 score within a group. Ranking
+    reads them best first and stops once no unread posting can enter the
+    top k (Fagin's threshold algorithm), so a query touches a few hundred
+    postings rather than every document containing a common word. Impact
+    lists are built on a term's first query and kept in step afterwards,
+    until ``max_impact_updates`` changes arrive between two queries of the
+    term; then they are dropped and rebuilt when next queried, so bulk
+    loading does not pay for them.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, title_boost: int = 2, max_prefix_expansions: int = 32,
+                 max_impact_updates: int = 256):
+        self.k1 = k1
+        self.b = b
+        self.title_boost = title_boost
+        self.max_prefix_expansions = max_prefix_expansions
+        self.max_impact_updates = max_impact_updates
+        self._postings = defaultdict(dict)
+        self._impacts = {}  # term -> {tf: array of _impact_key}, for terms queried since they last changed
+        self._impact_updates = {}  # term -> changes kept in step since its last query
+        self._doc_len = {}
+        self._doc_terms = {}
+        self._total_len = 0
+        self._vocab = []
+        self._vocab_dirty = False
+        self.max_doc_id = 0
+        # Bumped by every add or remove that changes the index
+        self.version = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_len
+
+    def add(self, doc_id: int, title: str, description: str = ''):
+        terms = analyze(title) * self.title_boost + analyze(description)
+        counts = defaultdict(int)
+        for term in terms:
+            counts[term] += 1
+        signature = tuple(counts.items())
+        with self._lock:
+            if doc_id in self._doc_len:
+                if self._doc_terms[doc_id] == signature:
+                    return  # re-synced without changes
+                self._remove_locked(doc_id)
+            self.version += 1
+            key = _impact_key(len(terms), doc_id)
+            for term, tf in counts.items():
+                postings = self._postings[term]
+                if not postings:
+                    self._vocab_dirty = True
+                postings[doc_id] = tf
+                impacts = self._kept_impacts(term)
+                if impacts is not None:
+                    insort(impacts.setdefault(tf, array('q')), key)
+            self._doc_len[doc_id] = len(terms)
+            self._doc_terms[doc_id] = signature
+            self._total_len += len(terms)
+            if doc_id > self.max_doc_id:
+                self.max_doc_id = doc_id
+
+    def remove(self, doc_id: int):
+        with self._lock:
+            if doc_id in self._doc_len:
+                self._remove_locked(doc_id)
+                self.version += 1
+
+    def _remove_locked(self, doc_id):
+        key = _impact_key(self._doc_len[doc_id], doc_id)
+        for term, tf in self._doc_terms.pop(doc_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            impacts = self._kept_impacts(term)
+            if impacts is not None:
+                keys = impacts[tf]
+                del keys[bisect_left(keys, key)]
+            if not postings:
+                del self._postings[term]
+                self._impacts.pop(term, None)
+                self._impact_updates.pop(term, None)
+                self._vocab_dirty = True
+        self._total_len -= self._doc_len.pop(doc_id)
+
+    def _kept_impacts(self, term):
+        """The term's impact lists if they are still worth keeping in step with a change, else None."""
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            return None
+        updates = self._impact_updates.get(term, 0) + 1
+        if updates > self.max_impact_updates:
+            del self._impacts[term], self._impact_updates[term]
+            return None
+        self._impact_updates[term] = updates
+        return impacts
+
+    def _impact_lists(self, term):
+        self._impact_updates[term] = 0
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            by_tf = defaultdict(list)
+            doc_len = self._doc_len
+            for doc_id, tf in self._postings[term].items():
+                by_tf[tf].append(_impact_key(doc_len[doc_id], doc_id))
+            impacts = self._impacts[term] = {tf: array('q', sorted(keys)) for tf, keys in by_tf.items()}
+        return impacts
+
+    def _expand_prefix(self, prefix: str):
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        expansions = []
+        i = bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            expansions.append(self._vocab[i])
+            if len(expansions) >= self.max_prefix_expansions:
+                break
+            i += 1
+        return expansions
+
+    def _query_terms(self, text: str, prefix: bool):
+        raw = tokenize(text)
+        groups = []
+        for position, token in enumerate(raw):
+            terms = {stem(token)}
+            # Only the last token is still being typed
+            if prefix and position == len(raw) - 1:
+                terms.update(self._expand_prefix(token))
+            groups.append(terms)
+        return groups
+
+    def _query_groups(self, text: str, prefix: bool):
+        """Per query token, ``[(term, postings, idf)]`` of the terms it matches in the index."""
+        n_docs = len(self._doc_len)
+        groups = []
+        for terms in self._query_terms(text, prefix):
+            group = []
+            for term in sorted(terms):
+                postings = self._postings.get(term)
+                if postings:
+                    df = len(postings)
+                    group.append((term, postings, math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))))
+            if group:
+                groups.append(group)
+        return groups
+
+    def _score(self, doc_id, groups, avg_len):
+        """BM25 of one document; a token that expands to several terms counts its best-matching one."""
+        k1, b = self.k1, self.b
+        norm = k1 * (1.0 - b + b * self._doc_len[doc_id] / avg_len)
+        total = 0.0
+        matched = False
+        for group in groups:
+            best = 0.0
+            for _, postings, idf in group:
+                tf = postings.get(doc_id)
+                if tf is not None:
+                    score = idf * tf * (k1 + 1.0) / (tf + norm)
+                    if score > best:
+                        best = score
+                    matched = True
+            total += best
+        return total if matched else None
+
+    def _ranking(self, text: str, prefix: bool):
+        """Yield ``(doc_id, score)`` for every match in BM25 order; call with the lock held.
+
+        Each token's impact lists are merged into one stream of postings,
+        best score first. Every document read from a stream is scored in
+        full, and yielded once it outranks anything still unread: with one
+        token, the stream's next posting; with several, the sum of the
+        streams' next scores. Tokens that are all common words keep that sum
+        high for long; after reading a sixteenth of their postings the rest is
+        scored exhaustively instead.
+        """
+        n_docs = len(self._doc_len)
+        groups = self._query_groups(text, prefix)
+        if not n_docs or not groups:
+            return
+        avg_len = self._total_len / n_docs
+        k1, b = self.k1, self.b
+
+        def entry(keys, position, tf, idf):
+            # Heap order is rank order: best score, then highest id; the same formula as _score
+            key = keys[position]
+            norm = k1 * (1.0 - b + b * (key >> 32) / avg_len)
+            return -(idf * tf * (k1 + 1.0) / (tf + norm)), (key & _ID_MASK) - _ID_MASK, position, keys, tf, idf
+
+        streams = []
+        for group in groups:
+            stream = [entry(keys, 0, tf, idf)
+                      for term, _, idf in group for tf, keys in self._impact_lists(term).items() if keys]
+            heapq.heapify(stream)
+            streams.append(stream)
+        heads = [-stream[0][0] for stream in streams]
+        single = len(streams) == 1
+        budget = sum(len(postings) for group in groups for _, postings, _ in group) // 16
+
+        seen = set()
+        ready = []  # (-score, -doc_id) of documents read and scored, not yielded yet
+        while streams:
+            if single:
+                bound = streams[0][0][:2]
+                while ready and ready[0] < bound:
+                    score, doc_id = heapq.heappop(ready)
+                    yield -doc_id, -score
+                i = 0
+            else:
+                threshold = sum(heads)
+                while ready and -ready[0][0] > threshold:
+                    score, doc_id = heapq.heappop(ready)
+                    yield -doc_id, -score
+                i = heads.index(max(heads))
+            if len(seen) > budget:
+                break
+            stream = streams[i]
+            _, negative_id, position, keys, tf, idf = stream[0]
+            if position + 1 < len(keys):
+                heapq.heapreplace(stream, entry(keys, position + 1, tf, idf))
+            else:
+                heapq.heappop(stream)
+            if stream:
+                heads[i] = -stream[0][0]
+            else:
+                del streams[i], heads[i]
+            doc_id = -negative_id
+            if doc_id not in seen:
+                seen.add(doc_id)
+                heapq.heappush(ready, (-self._score(doc_id, groups, avg_len), negative_id))
+        if not streams:
+            while ready:
+                score, doc_id = heapq.heappop(ready)
+                yield -doc_id, -score
+            return
+        yielded = seen.difference(-negative_id for _, negative_id in ready)
+        scores = self._exhaustive_scores(groups, avg_len)
+        # A heap, so that reading one more batch does not sort every remaining match
+        rest = [(-score, -doc_id) for doc_id, score in scores.items() if doc_id not in yielded]
+        heapq.heapify(rest)
+        while rest:
+            score, doc_id = heapq.heappop(rest)
+            yield -doc_id, -score
+
+    def _exhaustive_scores(self, groups, avg_len):
+        """``{doc_id: score}`` for every match, walking each term's postings once."""
+        k1, b = self.k1, self.b
+        doc_len = self._doc_len
+        scores = defaultdict(float)
+        for group in groups:
+            best = {}
+            for _, postings, idf in group:
+                for doc_id, tf in postings.items():
+                    score = idf * tf * (k1 + 1.0) / (tf + k1 * (1.0 - b + b * doc_len[doc_id] / avg_len))
+                    if score > best.get(doc_id, 0.0):
+                        best[doc_id] = score
+            for doc_id, score in best.items():
+                scores[doc_id] += score
+        return scores
+
+    def search(self, text: str, limit: int = 20, prefix: bool = True, doc_ids=None):
+        """Return ``[(doc_id, score), ...]`` ranked by BM25, best first.
+
+        ``doc_ids`` restricts the ranking to those documents.
+        """
+        with self._lock:
+            if doc_ids is not None:
+                n_docs = len(self._doc_len)
+                groups = self._query_groups(text, prefix)
+                if not n_docs or not groups:
+                    return []
+                avg_len = self._total_len / n_docs
+                scored = ((doc_id, self._score(doc_id, groups, avg_len)) for doc_id in doc_ids
+                          if doc_id in self._doc_len)
+                return heapq.nlargest(limit, ((d, s) for d, s in scored if s is not None), key=_rank_key)
+            return list(islice(self._ranking(text, prefix), limit))
+
+    def search_batches(self, text: str, batch_size: int, prefix: bool = True):
+        """Yield every match in BM25 order, ``batch_size`` doc ids at a time.
+
+        Only as much of the ranking is computed as the batches read. If the
+        index changes between batches the ranking restarts, skipping the ids
+        already yielded.
+        """
+        ranking, version = None, None
+        yielded = set()
+        while True:
+            batch = []
+            with self._lock:
+                if ranking is None or self.version != version:
+                    ranking, version = self._ranking(text, prefix), self.version
+                for doc_id, _ in ranking:
+                    if doc_id not in yielded:
+                        yielded.add(doc_id)
+                        batch.append(doc_id)
+                        if len(batch) >= batch_size:
+                            break
+            yield batch
+            if len(batch) < batch_size:
+                return
+
+
+def _rank_key(item):
+    return item[1], item[0]
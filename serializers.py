@@ -0,0 +1,125 @@
+import json
+import re
+from operator import attrgetter
+
+import sqlalchemy as sa
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+from profiling import section
+
+try:
+    import orjson
+except ImportError:  # optional, falls back to the stdlib encoder
+    orjson = None
+
+
+# ------------------------------
+# Compiled row serializers
+# ------------------------------
+
+def _column_expression(column, var: str) -> str:
+    """Python expression that converts ``var`` the way marshmallow's auto-generated field would."""
+    column_type = column.type
+    if isinstance(column_type, (sa.DateTime, sa.Date, sa.Time)):
+        return f'{var}.isoformat()'
+    if isinstance(column_type, sa.Boolean):
+        return f'bool({var})'
+    if isinstance(column_type, sa.Integer):
+        return f'int({var})'
+    if isinstance(column_type, sa.Float):
+        return f'float({var})'
+    if isinstance(column_type, sa.Numeric):
+        # marshmallow's Decimal field leaves the Decimal for the JSON encoder
+        return var
+    if isinstance(column_type, sa.String):
+        return f'str({var})'
+    return var
+
+
+class CompiledSerializer:
+    """Dump function specialized for one model's columns, generated once at import time.
+
+    ``dump_row`` takes the tuples produced by ``query.with_entities(*serializer.entities)``,
+    so hot endpoints skip ORM identity-map work as well as schema introspection.
+    """
+
+    def __init__(self, model, exclude=()):
+        self.model = model
+        self.columns = [c for c in model.__table__.columns if c.key not in exclude]
+        self.keys = [c.key for c in self.columns]
+        self.entities = [getattr(model, key) for key in self.keys]
+        self._getter = attrgetter(*self.keys)
+        self.dump_row = self._compile()
+
+    def _compile(self):
+        name = f'dump_{self.model.__tablename__}_row'
+        variables = [f'v{i}' for i in range(len(self.columns))]
+        lines = [f'def {name}(row):']
+        if len(variables) == 1:
+            lines.append(f'    {variables[0]}, = row')
+        else:
+            lines.append(f"    {', '.join(variables)} = row")
+        lines.append('    return {')
+        for column, var in zip(self.columns, variables):
+            expression = _column_expression(column, var)
+            if expression != var:
+                expression = f'None if {var} is None else {expression}'
+            lines.append(f'        {column.key!r}: {expression},')
+        lines.append('    }')
+        namespace = {}
+        exec(compile('\n'.join(lines), f'<serializer {self.model.__name__}>', 'exec'), namespace)
+        return namespace[name]
+
+    def dump_rows(self, rows):
+        dump_row = self.dump_row
+        # A lazy Query runs its SQL when iterated; keep that out of the serialize section
+        rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+        with section('serialize'):
+            return [dump_row(row) for row in rows]
+
+    def dump_object(self, obj):
+        values = self._getter(obj)
+        return self.dump_row(values if len(self.keys) > 1 else (values,))
+
+    def dump_objects(self, objs):
+        objs = objs if isinstance(objs, (list, tuple)) else list(objs)
+        with section('serialize'):
+            return [self.dump_object(obj) for obj in objs]
+
+
+# ------------------------------
+# Fast JSON responses
+# ------------------------------
+
+# Decimals, dates and the rest exactly as jsonify converts them
+_default = DefaultJSONProvider.default
+
+# What orjson writes differently from jsonify: non-ASCII and DEL unescaped, and floats
+# below 1e-4 or from 1e16 without Python's exponent form ("0.00001", "1e16"). NaN and infinities,
+# which jsonify writes as bare NaN/Infinity (not JSON), come out as null; imports reject them.
+_NOT_LIKE_JSONIFY = re.compile(rb'[^\x00-\x7e]|(?:^|[:,\[])-?(?:\d[\d.]*e|0\.0000)')
+
+
+def dumps(payload) -> bytes:
+    """Compact, key-sorted JSON, byte for byte what jsonify would send.
+
+    orjson's output is used when nothing in it needs jsonify's escaping or
+    float spelling; otherwise, or for values orjson cannot encode, the
+    stdlib encoder writes the body.
+    """
+    with section('serialize'):
+        if orjson is not None:
+            try:
+                body = orjson.dumps(payload, default=_default,
+                                    option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+            except orjson.JSONEncodeError:
+                body = None
+            if body is not None and not _NOT_LIKE_JSONIFY.search(body):
+                return body
+        return json.dumps(payload, default=_default, sort_keys=True, separators=(',', ':')).encode()
+
+
+def fast_jsonify(payload, status: int = 200) -> Response:
+    # Newline-terminated like jsonify, so with the stdlib encoder the bodies are identical
+    return Response(dumps(payload) + b'\n', status=status, mimetype='application/json')
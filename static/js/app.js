@@ -3,6 +3,9 @@ let currentUser = null;
 let authToken = null;
 let currentChatId = null;
 let currentChatUserId = null;
+let eventSource = null;
+let hasOlderMessages = false;
+let loadingOlderMessages = false;
 
 // API Base URL
 const API_BASE = 'http://localhost:5000/api';
@@ -67,6 +70,13 @@ function setupEventListeners() {
             sendMessage();
         }
     });
+    
+    // Older messages load lazily
+    document.getElementById('messagesContainer').addEventListener('scroll', function() {
+        if (this.scrollTop === 0) {
+            loadOlderMessages();
+        }
+    });
 }
 
 // Navigation functions
@@ -219,11 +229,38 @@ function updateUIForLoggedInUser() {
     document.getElementById('userDropdown').style.display = 'block';
     document.getElementById('authButtons').style.display = 'none';
     document.getElementById('navUsername').textContent = currentUser.username;
+    connectEventStream();
 }
 
 function updateUIForLoggedOutUser() {
     document.getElementById('userDropdown').style.display = 'none';
     document.getElementById('authButtons').style.display = 'block';
+    disconnectEventStream();
+}
+
+// Real-time events (Server-Sent Events)
+function connectEventStream() {
+    disconnectEventStream();
+    if (!authToken || !window.EventSource) {
+        return;
+    }
+    eventSource = new EventSource(`${API_BASE}/stream?jwt=${encodeURIComponent(authToken)}`);
+    eventSource.addEventListener('open', syncNewMessages);
+    eventSource.addEventListener('chat_message', function(e) {
+        const message = JSON.parse(e.data);
+        if (message.chat_id === currentChatId) {
+            appendMessage(message);
+        } else if (document.getElementById('chatsSection').style.display === 'block') {
+            loadChats();
+        }
+    });
+}
+
+function disconnectEventStream() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
 }
 
 // Skill functions
@@ -386,7 +423,7 @@ async function advancedSearch() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ query, filters })
+            body: JSON.stringify({ query, filters, include_total: true })
         });
         
         const data = await response.json();
@@ -792,9 +829,12 @@ function displayChats(chats) {
                 </div>
                 <div class="flex-grow-1">
                     <div class="fw-bold">${otherUser?.username || 'Unknown'}</div>
-                    <small class="text-muted">${chat.skill?.title || 'General chat'}</small>
+                    <small class="text-muted">${chat.last_message ? escapeHtml(chat.last_message.content.substring(0, 40)) : (chat.skill?.title || 'General chat')}</small>
+                </div>
+                <div class="text-end">
+                    <small class="text-muted d-block">${new Date(chat.last_message?.created_at || chat.created_at).toLocaleDateString()}</small>
+                    ${chat.unread_count > 0 ? `<span class="badge bg-primary rounded-pill">${chat.unread_count}</span>` : ''}
                 </div>
-                <small class="text-muted">${new Date(chat.created_at).toLocaleDateString()}</small>
             </div>
         `;
         chatItem.onclick = () => loadChatMessages(chat.id, otherUser);
@@ -826,6 +866,7 @@ async function loadChatMessages(chatId, otherUser) {
         
         if (response.ok) {
             displayMessages(data.messages);
+            hasOlderMessages = data.has_more;
         } else {
             showToast('Failed to load messages', 'error');
         }
@@ -840,25 +881,103 @@ function displayMessages(messages) {
     messagesContainer.innerHTML = '';
     
     if (messages.length === 0) {
-        messagesContainer.innerHTML = '<div class="text-center text-muted">No messages yet. Start the conversation!</div>';
+        messagesContainer.innerHTML = '<div class="text-center text-muted empty-chat">No messages yet. Start the conversation!</div>';
         return;
     }
     
-    messages.forEach(message => {
-        const messageDiv = document.createElement('div');
-        const isSent = message.sender_id === currentUser.id;
-        messageDiv.className = `chat-message ${isSent ? 'sent' : 'received'}`;
-        messageDiv.innerHTML = `
-            <div>${message.content}</div>
-            <div class="timestamp">${new Date(message.created_at).toLocaleTimeString()}</div>
-        `;
-        messagesContainer.appendChild(messageDiv);
-    });
+    messages.forEach(message => appendMessage(message, false));
     
     // Scroll to bottom
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
 }
 
+function renderedMessageIds() {
+    return Array.from(document.querySelectorAll('#messagesContainer [data-message-id]'))
+        .map(el => parseInt(el.dataset.messageId));
+}
+
+// Page back through history only when the user scrolls to the top
+async function loadOlderMessages() {
+    const ids = renderedMessageIds();
+    if (!currentChatId || !hasOlderMessages || loadingOlderMessages || ids.length === 0) {
+        return;
+    }
+    loadingOlderMessages = true;
+    try {
+        const response = await fetch(`${API_BASE}/chats/${currentChatId}/messages?before_id=${Math.min(...ids)}`, {
+            headers: {
+                'Authorization': `Bearer ${authToken}`
+            }
+        });
+        const data = await response.json();
+        if (response.ok) {
+            const messagesContainer = document.getElementById('messagesContainer');
+            const previousHeight = messagesContainer.scrollHeight;
+            data.messages.slice().reverse().forEach(message => {
+                const messageDiv = createMessageElement(message);
+                messagesContainer.insertBefore(messageDiv, messagesContainer.firstChild);
+            });
+            messagesContainer.scrollTop = messagesContainer.scrollHeight - previousHeight;
+            hasOlderMessages = data.has_more;
+        }
+    } catch (error) {
+        console.error('Load older messages error:', error);
+    } finally {
+        loadingOlderMessages = false;
+    }
+}
+
+// Fetch only what arrived while the event stream was disconnected
+async function syncNewMessages() {
+    const ids = renderedMessageIds();
+    if (!currentChatId || ids.length === 0) {
+        return;
+    }
+    try {
+        const response = await fetch(`${API_BASE}/chats/${currentChatId}/messages?after_id=${Math.max(...ids)}`, {
+            headers: {
+                'Authorization': `Bearer ${authToken}`
+            }
+        });
+        if (response.ok) {
+            const data = await response.json();
+            data.messages.forEach(message => appendMessage(message));
+        }
+    } catch (error) {
+        console.error('Sync messages error:', error);
+    }
+}
+
+function createMessageElement(message) {
+    const messageDiv = document.createElement('div');
+    const isSent = message.sender_id === currentUser.id;
+    messageDiv.className = `chat-message ${isSent ? 'sent' : 'received'}`;
+    messageDiv.dataset.messageId = message.id;
+    messageDiv.innerHTML = `
+        <div>${message.content}</div>
+        <div class="timestamp">${new Date(message.created_at).toLocaleTimeString()}</div>
+    `;
+    return messageDiv;
+}
+
+function appendMessage(message, scroll = true) {
+    const messagesContainer = document.getElementById('messagesContainer');
+    // The sender sees its own message both in the POST response and on the stream
+    if (messagesContainer.querySelector(`[data-message-id="${message.id}"]`)) {
+        return;
+    }
+    const placeholder = messagesContainer.querySelector('.empty-chat');
+    if (placeholder) {
+        placeholder.remove();
+    }
+    
+    messagesContainer.appendChild(createMessageElement(message));
+    
+    if (scroll) {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+}
+
 async function sendMessage() {
     const content = document.getElementById('messageInput').value.trim();
     
@@ -880,7 +999,7 @@ async function sendMessage() {
         
         if (response.ok) {
             document.getElementById('messageInput').value = '';
-            loadChatMessages(currentChatId, { id: currentChatUserId, username: document.getElementById('chatTitle').textContent.replace('Chat with ', '') });
+            appendMessage(data.data);
         } else {
             showToast(data.message || 'Failed to send message', 'error');
         }
@@ -0,0 +1,236 @@
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import select, update, delete, insert
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+def _utc(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+class DecayedCounter:
+    """Counter whose counts halve every ``half_life`` seconds.
+
+    Uses forward decay: each increment is stored scaled up by
+    ``exp(rate * (t - landmark))``, so adding touches one key and every
+    stored value decays by the same factor. Ranking therefore only changes
+    on increments, never with the passage of time.
+    """
+
+    # Rescale before the stored values get anywhere near float overflow
+    _MAX_EXPONENT = 50.0
+
+    def __init__(self, half_life: float):
+        self.rate = math.log(2) / half_life
+        self._landmark = time.time()
+        self._counts = Counter()
+
+    def _rescale(self, now: float):
+        factor = math.exp(-self.rate * (now - self._landmark))
+        for key in self._counts:
+            self._counts[key] *= factor
+        self._landmark = now
+
+    def add(self, key, amount: float = 1.0, now: float = None):
+        now = time.time() if now is None else now
+        exponent = self.rate * (now - self._landmark)
+        if exponent > self._MAX_EXPONENT:
+            self._rescale(now)
+            exponent = 0.0
+        self._counts[key] += amount * math.exp(exponent)
+
+    def _factor(self, now: float = None) -> float:
+        now = time.time() if now is None else now
+        return math.exp(-self.rate * (now - self._landmark))
+
+    def score(self, key, now: float = None) -> float:
+        return self._counts.get(key, 0.0) * self._factor(now)
+
+    def items(self, now: float = None):
+        factor = self._factor(now)
+        return [(key, value * factor) for key, value in self._counts.items()]
+
+    def most_common(self, n: int = None, now: float = None):
+        factor = self._factor(now)
+        return [(key, value * factor) for key, value in self._counts.most_common(n)]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+class TrendingAggregator:
+    """Per-worker decayed activity counters (e.g. per category and location), shared through the DB.
+
+    ``record`` only touches memory. At most every ``snapshot_seconds`` a call
+    folds this worker's unsaved increments into ``counter_model`` rows, in
+    a short transaction of its own, and reloads every worker's totals from
+    the table. ``top`` serves from a cached ranking, so reads cost O(n)
+    for the n entries returned, however many events were recorded.
+
+    Keys longer than the name column are logged and ignored. After
+    ``max_sync_failures`` failed syncs in a row the unsaved increments are
+    logged and dropped rather than retried forever.
+    """
+
+    def __init__(self, db, counter_model, dimensions, half_life: float = 86400.0,
+                 snapshot_seconds: float = 10.0, min_score: float = 0.01, max_sync_failures: int = 5):
+        self.db = db
+        self.Counter = counter_model
+        self.dimensions = tuple(dimensions)
+        self.half_life = half_life
+        self.snapshot_seconds = snapshot_seconds
+        self.min_score = min_score
+        self.max_sync_failures = max_sync_failures
+        self.max_key_length = counter_model.__table__.c.name.type.length
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pending = {d: DecayedCounter(half_life) for d in self.dimensions}
+        self._view = {d: DecayedCounter(half_life) for d in self.dimensions}
+        self._ranked = {}
+        self._synced_at = 0.0
+
+    def record(self, dimension: str, key: str, weight: float = 1.0):
+        key = (key or '').strip()
+        if not key or dimension not in self._pending:
+            return
+        if self.max_key_length and len(key) > self.max_key_length:
+            logger.warning('Ignoring trending %s longer than %d characters: %.40s...', dimension,
+                           self.max_key_length, key)
+            return
+        now = time.time()
+        with self._lock:
+            self._pending[dimension].add(key, weight, now)
+            self._view[dimension].add(key, weight, now)
+            self._ranked.pop(dimension, None)
+
+    def top(self, dimension: str, n: int = 10):
+        try:
+            self.maybe_sync()
+        except Exception:
+            logger.exception('Trending sync failed; serving the last snapshot')
+        with self._lock:
+            ranked = self._ranked.get(dimension)
+            if ranked is None:
+                ranked = self._ranked[dimension] = [key for key, _ in self._view[dimension].most_common()]
+            view = self._view[dimension]
+            now = time.time()
+            return [(key, view.score(key, now)) for key in ranked[:n]]
+
+    def maybe_sync(self, force: bool = False):
+        if not force and time.time() - self._synced_at < self.snapshot_seconds:
+            return
+        if not self._sync_lock.acquire(blocking=force):
+            return  # another thread of this worker is already syncing
+        try:
+            self._sync()
+        finally:
+            self._sync_lock.release()
+
+    def _sync(self):
+        with self._lock:
+            pending, now = self._pending, time.time()
+            self._pending = {d: DecayedCounter(self.half_life) for d in self.dimensions}
+        try:
+            with self.db.engine.begin() as conn:
+                self._store(conn, pending, now)
+                view = self._load(conn, now)
+        except Exception:
+            self._failures += 1
+            self._synced_at = now  # retry at the next interval, not on every read
+            if self._failures >= self.max_sync_failures:
+                dropped = sum(len(counter) for counter in pending.values())
+                logger.error('Dropping trending increments for %d keys after %d failed syncs',
+                             dropped, self._failures)
+                self._failures = 0
+            else:
+                # Keep the increments for the next attempt
+                with self._lock:
+                    for dimension, counter in pending.items():
+                        for key, value in counter.items(now):
+                            self._pending[dimension].add(key, value, now)
+            raise
+        self._failures = 0
+        with self._lock:
+            # Increments recorded while the snapshot was being taken are not in it yet
+            for dimension, counter in self._pending.items():
+                for key, value in counter.items():
+                    view[dimension].add(key, value)
+            self._view = view
+            self._ranked = {}
+            self._synced_at = now
+
+    def _decay(self, score: float, since: datetime, now: float) -> float:
+        # updated_at is naive UTC, like the rest of the schema
+        age = max(now - since.replace(tzinfo=timezone.utc).timestamp(), 0.0) if since else 0.0
+        return score * math.exp(-math.log(2) / self.half_life * age)
+
+    def _store(self, conn, pending, now: float):
+        table = self.Counter.__table__
+        stamp = _utc(now)
+        for dimension, counter in pending.items():
+            increments = dict(counter.items(now))
+            if not increments:
+                continue
+            rows = conn.execute(
+                select(table.c.name, table.c.score, table.c.updated_at)
+                .where(table.c.dimension == dimension, table.c.name.in_(sorted(increments)))
+                .order_by(table.c.name)
+                .with_for_update()
+            ).all()
+            existing = {row.name: row for row in rows}
+            for key in sorted(increments):
+                row = existing.get(key)
+                if row is None:
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(insert(table).values(dimension=dimension, name=key,
+                                                              score=increments[key], updated_at=stamp))
+                        continue
+                    except IntegrityError:
+                        # Another worker inserted it first
+                        row = conn.execute(select(table.c.name, table.c.score, table.c.updated_at)
+                                           .where(table.c.dimension == dimension, table.c.name == key)
+                                           .with_for_update()).one()
+                conn.execute(
+                    update(table)
+                    .where(table.c.dimension == dimension, table.c.name == key)
+                    .values(score=self._decay(row.score, row.updated_at, now) + increments[key], updated_at=stamp)
+                )
+
+    def _load(self, conn, now: float):
+        table = self.Counter.__table__
+        view = {d: DecayedCounter(self.half_life) for d in self.dimensions}
+        faded = []
+        for dimension, name, score, updated_at in conn.execute(
+                select(table.c.dimension, table.c.name, table.c.score, table.c.updated_at)
+                .where(table.c.dimension.in_(self.dimensions))):
+            score = self._decay(score, updated_at, now)
+            if score < self.min_score:
+                faded.append((dimension, name))
+            else:
+                view[dimension].add(name, score, now)
+        for dimension, name in faded:
+            conn.execute(delete(table).where(table.c.dimension == dimension, table.c.name == name))
+        return view
+
+    def replace_all(self, totals):
+        """Overwrite the table with ``{dimension: {key: score}}`` scores valid now (used for backfills)."""
+        now = time.time()
+        stamp = _utc(now)
+        table = self.Counter.__table__
+        with self.db.engine.begin() as conn:
+            conn.execute(delete(table).where(table.c.dimension.in_(self.dimensions)))
+            rows = [{'dimension': d, 'name': k, 'score': s, 'updated_at': stamp}
+                    for d, scores in totals.items() for k, s in scores.items() if s >= self.min_score]
+            if rows:
+                conn.execute(insert(table), rows)
+        with self._lock:
+            self._pending = {d: DecayedCounter(self.half_life) for d in self.dimensions}
+        self.maybe_sync(force=True)